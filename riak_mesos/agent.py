@@ -0,0 +1,247 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos CLI Agent
+
+A long running process that serves framework API requests for other
+riak-mesos processes over a Unix socket. It keeps the resolved service URLs
+and pooled HTTP connections of a single Context, and caches responses to
+read-only requests (cluster lists, node lists, riak versions) for a few
+seconds.
+
+Each request is one line of JSON, answered by one line of JSON:
+
+    {"key": ..., "method": "get", "path": "clusters", "data": null,
+     "headers": null}
+    {"status": 200, "url": ..., "text": ..., "cached": false}
+
+A status of 0 means the framework couldn't be reached, and "sent" says
+whether the request may still have reached it.
+"""
+
+import json
+import os
+import re
+import socket
+import threading
+
+from six.moves import socketserver
+
+from riak_mesos.util import monotonic
+
+DEFAULT_TTL = 2
+# The url of a failed request that was never sent, see
+# Context.framework_request
+NOT_SENT_URL = 'framework_url_not_available/'
+CONNECT_TIMEOUT = 1
+REQUEST_TIMEOUT = 120
+
+# GET responses the agent may serve from its cache
+CACHEABLE_PATHS = [
+    re.compile(r'^clusters$'),
+    re.compile(r'^clusters/[^/]+$'),
+    re.compile(r'^clusters/[^/]+/nodes$'),
+    re.compile(r'^riak/versions$')
+]
+
+
+def is_cacheable(method, path, headers=None):
+    if method.lower() != 'get' or headers:
+        return False
+    return any(p.match(path) for p in CACHEABLE_PATHS)
+
+
+class AgentRequest(object):
+    def __init__(self, method, body):
+        self.method = method
+        self.body = body
+
+
+class AgentResponse(object):
+    """The parts of a requests.Response that riak-mesos commands use"""
+
+    def __init__(self, method, reply, body=None):
+        self.status_code = reply['status']
+        self.url = reply.get('url', '')
+        self.text = reply.get('text', '')
+        self.cached = reply.get('cached', False)
+        self.request = AgentRequest(method, body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def _send(socket_file, message, timeout=REQUEST_TIMEOUT):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(socket_file)
+        sock.settimeout(timeout)
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        reply = sock.makefile('rb').readline()
+    finally:
+        sock.close()
+    if not reply:
+        raise IOError('Agent closed the connection without replying')
+    return json.loads(reply.decode('utf-8'))
+
+
+class AgentClient(object):
+    def __init__(self, socket_file, key):
+        self.socket_file = socket_file
+        self.key = key
+
+    def api_request(self, method, path, data=None, headers=None,
+                    timeout=REQUEST_TIMEOUT):
+        """Returns an AgentResponse, or None when the agent couldn't reach
+        the framework itself and the caller can safely send the request
+        directly: it is a GET, or the agent never sent it. Otherwise the
+        agent's failure is returned with a status_code of 0, as a non
+        idempotent request may have been applied. Socket errors and replies
+        for a different framework are raised as IOError."""
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        reply = _send(self.socket_file, {'key': self.key,
+                                         'method': method,
+                                         'path': path,
+                                         'data': data,
+                                         'headers': headers}, timeout)
+        if 'error' in reply:
+            raise IOError(reply['error'])
+        if reply['status'] == 0 and (method.lower() == 'get' or
+                                     not reply.get('sent', True)):
+            return None
+        return AgentResponse(method, reply, data)
+
+    def stats(self):
+        return _send(self.socket_file, {'op': 'stats'}, CONNECT_TIMEOUT)
+
+    def stop(self):
+        return _send(self.socket_file, {'op': 'stop'}, CONNECT_TIMEOUT)
+
+
+class _AgentHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            reply = self.server.agent.handle(json.loads(line.decode('utf-8')))
+        except Exception as e:
+            reply = {'error': str(e)}
+        self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+class _AgentServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Agent(object):
+    """Serves api requests for other riak-mesos processes using ctx, which
+    must not route its own requests through an agent."""
+
+    def __init__(self, ctx, socket_file, ttl=DEFAULT_TTL):
+        self.ctx = ctx
+        self.socket_file = socket_file
+        self.ttl = ttl
+        self.key = ctx.agent_key()
+        self.server = None
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'cache_hits': 0, 'errors': 0}
+        self._started = monotonic()
+
+    def handle(self, message):
+        op = message.get('op', 'request')
+        if op == 'stats':
+            return self.stats()
+        if op == 'stop':
+            threading.Thread(target=self.server.shutdown).start()
+            return {'stopped': True}
+        if message.get('key') != self.key:
+            return {'error': 'Agent serves ' + self.key + ', not ' +
+                    str(message.get('key'))}
+        return self.request(message['method'], message['path'],
+                            message.get('data'), message.get('headers'))
+
+    def request(self, method, path, data=None, headers=None):
+        cacheable = is_cacheable(method, path, headers)
+        with self._lock:
+            self._stats['requests'] += 1
+            if cacheable and path in self._cache:
+                expires, reply = self._cache[path]
+                if monotonic() < expires:
+                    self._stats['cache_hits'] += 1
+                    return dict(reply, cached=True)
+                del self._cache[path]
+        kwargs = {}
+        if data is not None:
+            kwargs['data'] = data
+        if headers is not None:
+            kwargs['headers'] = headers
+        r = self.ctx.api_request(method, path, False, **kwargs)
+        reply = {'status': r.status_code, 'url': r.url, 'text': r.text,
+                 'cached': False}
+        if r.status_code == 0:
+            reply['sent'] = not r.url.startswith(NOT_SENT_URL)
+        with self._lock:
+            if r.status_code == 0:
+                self._stats['errors'] += 1
+            if method.lower() != 'get':
+                # Anything may have changed, don't serve stale listings
+                self._cache.clear()
+            elif cacheable and r.status_code == 200 and self.ttl > 0:
+                self._cache[path] = (monotonic() + self.ttl, reply)
+        return reply
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, cached_paths=len(self._cache))
+        stats['key'] = self.key
+        stats['uptime'] = round(monotonic() - self._started, 3)
+        if self.ctx.session is not None:
+            stats['connections'] = dict(
+                (host, {'opened': opened, 'requests': sent})
+                for host, (opened, sent) in
+                self.ctx.session.connection_stats().items())
+        return stats
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_file):
+            try:
+                _send(self.socket_file, {'op': 'stats'}, CONNECT_TIMEOUT)
+                listening = True
+            except (socket.error, IOError, ValueError):
+                listening = False
+            if listening:
+                raise IOError('An agent is already listening on ' +
+                              self.socket_file)
+            # Left behind by an agent that didn't exit cleanly
+            os.remove(self.socket_file)
+        socket_dir = os.path.dirname(self.socket_file)
+        if socket_dir and not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+        old_umask = os.umask(0o177)
+        try:
+            self.server = _AgentServer(self.socket_file, _AgentHandler)
+        finally:
+            os.umask(old_umask)
+        self.server.agent = self
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_file):
+                os.remove(self.socket_file)
@@ -0,0 +1,173 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos Service URL Cache and API Response Memo"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from os.path import expanduser
+
+from riak_mesos.util import monotonic
+
+DEFAULT_TTL = 300
+MEMO_FOREVER = float('inf')
+
+
+def default_cache_file():
+    return expanduser('~') + '/.config/riak-mesos/url-cache.json'
+
+
+class UrlCache(object):
+    """File backed cache of discovered framework / marathon / master URLs.
+
+    Entries are grouped by key (framework name and config file), expire
+    after ttl seconds, and the file is always replaced atomically so that
+    concurrent CLI processes never observe a partial write."""
+
+    def __init__(self, key, ttl=DEFAULT_TTL, cache_file=None):
+        self.key = key
+        self.ttl = ttl
+        self.cache_file = cache_file or default_cache_file()
+        self._entries = None
+
+    def _read(self):
+        try:
+            with open(self.cache_file) as data_file:
+                data = json.load(data_file)
+            if isinstance(data, dict):
+                return data
+        except (IOError, OSError, ValueError):
+            pass
+        return {}
+
+    def _write(self, data):
+        cache_dir = os.path.dirname(self.cache_file)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, tmp_file = tempfile.mkstemp(dir=cache_dir,
+                                            prefix='.url-cache.')
+            with os.fdopen(fd, 'w') as data_file:
+                json.dump(data, data_file)
+            _replace(tmp_file, self.cache_file)
+        except (IOError, OSError):
+            # The cache is only an optimization, never fail a command on it
+            pass
+
+    def get(self, service):
+        if self.ttl <= 0:
+            return None
+        if self._entries is None:
+            self._entries = self._read().get(self.key, {})
+        entry = self._entries.get(service)
+        if entry is None:
+            return None
+        if time.time() - entry.get('time', 0) > self.ttl:
+            return None
+        return entry.get('url')
+
+    def set(self, service, url):
+        if self.ttl <= 0:
+            return
+        data = self._read()
+        entries = data.setdefault(self.key, {})
+        entries[service] = {'url': url, 'time': time.time()}
+        self._write(data)
+        self._entries = entries
+
+    def invalidate(self, service=None, url=None):
+        """Removes the entry for service, or every entry whose URL is a
+        prefix of url."""
+        data = self._read()
+        entries = data.get(self.key, {})
+        stale = [s for s in entries
+                 if s == service or
+                 (url is not None and entries[s].get('url') and
+                  url.startswith(entries[s]['url']))]
+        self._entries = entries
+        if not stale:
+            return []
+        for s in stale:
+            del entries[s]
+        self._write(data)
+        return stale
+
+
+class ResponseMemo(object):
+    """Successful GET responses, kept for the lifetime of one command.
+
+    Each lookup says how old a response it will accept (max_age seconds), so
+    fields that never change, like a node's location, are fetched once while
+    its status is still fetched every time. Concurrent lookups of a path
+    share the request already in flight instead of sending their own."""
+
+    def __init__(self):
+        self.hits = 0
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, path, max_age, request):
+        """Returns a memoized response for path that is at most max_age
+        seconds old, or calls request() for a new one."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and monotonic() - entry[0] <= max_age:
+                self.hits += 1
+                return entry[1]
+            event = self._inflight.get(path)
+            if event is None:
+                self._inflight[path] = threading.Event()
+        if event is not None:
+            asked = monotonic()
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is not None and entry[0] >= asked:
+                    self.hits += 1
+                    return entry[1]
+            # The request in flight failed, try again independently
+            return request()
+        r = None
+        try:
+            r = request()
+            return r
+        finally:
+            with self._lock:
+                if r is not None and r.status_code == 200:
+                    self._entries[path] = (monotonic(), r)
+                self._inflight.pop(path).set()
+
+    def invalidate(self, prefix=None):
+        """Forgets every response, or those for paths starting with
+        prefix."""
+        with self._lock:
+            for path in list(self._entries):
+                if prefix is None or path.startswith(prefix):
+                    del self._entries[path]
+
+
+def _replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+        return
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # Windows / Python 2 can't rename over an existing file
+        os.remove(dst)
+        os.rename(src, dst)
@@ -18,22 +18,51 @@
 
 import logging
 import os
+import re
 import sys
+import threading
 import traceback
+from collections import OrderedDict
 from os.path import expanduser
 
 import click
-from dcos import config as dcos_config
-from dcos import errors as dcos_errors
-from dcos import subcommand as dcos_subcommand
-from dcos import http, marathon, mesos
-from kazoo.client import KazooClient
+from six.moves.urllib.parse import urlparse
 
 from riak_mesos import constants
+from riak_mesos.cache import (DEFAULT_TTL, MEMO_FOREVER, ResponseMemo,
+                              UrlCache)
 from riak_mesos.config import RiakMesosConfig
+from riak_mesos.retry import (DEFAULT_BREAKER_THRESHOLD, DEFAULT_RETRIES,
+                              DEFAULT_RETRY_BACKOFF, RetryPolicy)
+from riak_mesos.trace import Tracer, span
+from riak_mesos.util import (DEFAULT_POLL_MAX_INTERVAL,
+                             DEFAULT_POLL_MIN_INTERVAL, DeadlineExceeded,
+                             clamp_timeout, monotonic, race)
 
 CONTEXT_SETTINGS = dict(auto_envvar_prefix='RIAK_MESOS')
 
+# How old a memoized GET response api_request may return, by path, unless
+# the caller asks for something else with max_age
+API_MEMO_MAX_AGES = [
+    (re.compile(r'^riak/versions$'), MEMO_FOREVER)
+]
+
+# Seconds any one HTTP request may wait to connect or for data (0 disables)
+DEFAULT_REQUEST_TIMEOUT = 30
+# kazoo's default for connecting to zookeeper
+ZK_START_TIMEOUT = 15
+
+# Discovery probes every candidate URL at once, so a dead candidate is given
+# up on rather than retried
+DISCOVERY_TIMEOUT = 10
+DISCOVERY_RETRY = RetryPolicy(0)
+
+# Number of functions --profile prints, by cumulative time
+PROFILE_TOP = 25
+
+# dcos, kazoo and requests are slow to import, so they are only imported by
+# the code paths that need them (see tests/benchmarks/test_startup.py).
+
 
 class SubFailedRequest(object):
     def __init__(self, method):
@@ -59,6 +88,10 @@ class CliError(Exception):
 
 class RiakMesosDCOSStrategy(object):
     def __init__(self, ctx):
+        from dcos import config as dcos_config
+        from dcos import errors as dcos_errors
+        from dcos import subcommand as dcos_subcommand
+        from dcos import mesos
         self._master_url = None
         self._zk_url = None
         self._marathon_url = None
@@ -164,49 +197,40 @@ class RiakMesosClient(object):
     def framework_url(self):
         if self._framework_url is not None:
             return self._framework_url
-        _framework_url = self.ctx.config.get('framework-url')
-        if _framework_url != '':
-            _framework_url.rstrip('/')
-            _framework_url = 'http://' + _framework_url + '/'
-            r = self.ctx.http_request('get',
-                                      _framework_url + 'healthcheck',
-                                      False)
-            if r.status_code == 200:
-                self._framework_url = _framework_url
-                self.ctx.vlog("Setting framework URL to " +
-                              self._framework_url)
-                return self._framework_url
+        candidates = self.ctx.config.get_list('framework-url')
+        _framework_url = self._first_healthy(
+            ['http://' + c.rstrip('/') + '/' for c in candidates],
+            'healthcheck')
+        if _framework_url is not None:
+            self._framework_url = _framework_url
+            self.ctx.vlog("Setting framework URL to " +
+                          self._framework_url)
+            return self._framework_url
         return self.marathon_framework_url()
 
     def marathon_framework_url(self):
         client = self.ctx.marathon_client()
         tasks = client.get_tasks(self.ctx.framework)
-        for task in tasks:
-            if task['state'] != "TASK_RUNNING":
-                continue
-            host = task['host']
-            port = task['ports'][0]
-            _framework_url = 'http://' + host + ':' + str(port) + '/'
-            r = self.ctx.http_request('get',
-                                      _framework_url + 'healthcheck',
-                                      False)
-            if r.status_code == 200:
-                self._framework_url = _framework_url
-                self.ctx.vlog("Setting framework URL to " +
-                              self._framework_url)
-                return self._framework_url
+        candidates = ['http://' + task['host'] + ':' +
+                      str(task['ports'][0]) + '/'
+                      for task in tasks if task['state'] == "TASK_RUNNING"]
+        _framework_url = self._first_healthy(candidates, 'healthcheck')
+        if _framework_url is not None:
+            self._framework_url = _framework_url
+            self.ctx.vlog("Setting framework URL to " +
+                          self._framework_url)
+            return self._framework_url
         raise CliError("Unable to to find framework URL")
 
     def marathon_url(self):
         if self._marathon_url is not None:
             return self._marathon_url
-        _marathon = self.ctx.config.get('marathon')
-        if _marathon == '':
-            _marathon = 'marathon.mesos:8080'
-        _marathon = 'http://' + _marathon + '/'
-        r = self.ctx.http_request('get',
-                                  _marathon + 'ping', False)
-        if r.status_code == 200:
+        candidates = self.ctx.config.get_list('marathon')
+        if len(candidates) == 0:
+            candidates = ['marathon.mesos:8080']
+        _marathon = self._first_healthy(
+            ['http://' + c + '/' for c in candidates], 'ping')
+        if _marathon is not None:
             self._marathon_url = _marathon
             self.ctx.vlog("Setting marathon URL to " +
                           self._marathon_url)
@@ -216,18 +240,36 @@ class RiakMesosClient(object):
     def master_url(self):
         if self._master_url is not None:
             return self._master_url
-        _master = self.ctx.config.get('master')
-        if _master == '':
-            _master = 'leader.mesos:5050'
-        _master = 'http://' + _master + '/'
-        r = self.ctx.http_request('get', _master, False)
-        if r.status_code == 200:
+        candidates = self.ctx.config.get_list('master')
+        if len(candidates) == 0:
+            candidates = ['leader.mesos:5050']
+        _master = self._first_healthy(
+            ['http://' + c + '/' for c in candidates], '')
+        if _master is not None:
             self._master_url = _master
             self.ctx.vlog("Setting master URL to " +
                           self._master_url)
             return self._master_url
         raise CliError("Unable to to find master URL")
 
+    def _first_healthy(self, urls, path):
+        """Requests path from every candidate URL at once, returning the
+        first URL to respond with a 200, or None."""
+        if len(urls) == 0:
+            return None
+
+        def probe(ctx, url):
+            r = ctx.http_request('get', url + path, False,
+                                 timeout=DISCOVERY_TIMEOUT,
+                                 retry=DISCOVERY_RETRY)
+            return url if r.status_code == 200 else None
+
+        url, _ = race(self.ctx, probe, urls)
+        if url is None:
+            # A probe that ran out of time is just an unhealthy candidate
+            self.ctx.check_deadline('probing ' + ', '.join(urls))
+        return url
+
     def zk_url(self):
         if self._zk_url is not None:
             return self._zk_url
@@ -250,6 +292,9 @@ class Context(object):
         self.json = False
         self.flags_set = False
         self.attach = False
+        self.keep_alive = True
+        self.use_agent = True
+        self.close_registered = False
         # Paths
         self.home = os.getcwd()
         self.config_file = None
@@ -257,20 +302,98 @@ class Context(object):
         self.config = None
         # Conditional options
         self.framework = None
+        self.reset_args()
+        self.poll_min_interval = DEFAULT_POLL_MIN_INTERVAL
+        self.poll_max_interval = DEFAULT_POLL_MAX_INTERVAL
+        self.http_pool_size = constants.DEFAULT_POOL_SIZE
+        self.request_timeout = DEFAULT_REQUEST_TIMEOUT
+        self.retries = DEFAULT_RETRIES
+        self.retry_backoff = DEFAULT_RETRY_BACKOFF
+        self.breaker_threshold = DEFAULT_BREAKER_THRESHOLD
+        self.url_cache_ttl = DEFAULT_TTL
+        # RiakMesosClient
+        self.client = None
+        # UrlCache, keyed by framework name and config file
+        self.url_cache = None
+        self.service_urls = {}
+        # Guards client and service_urls, which concurrent requests reset
+        # when a URL stops answering, and keeps one thread at a time
+        # running discovery
+        self._url_lock = threading.Lock()
+        self._discovery_lock = threading.RLock()
+        # RiakMesosSession, shared by every HTTP request. Discovery probes
+        # send the first requests from several threads at once, so creating
+        # and resizing it is locked
+        self.session = None
+        self._session_lock = threading.Lock()
+        # KazooClient, started on first use and shared until close()
+        self.zk = None
+        self._zk_lock = threading.Lock()
+        # AgentClient, when a riak-mesos agent is listening on agent_socket
+        self.agent_socket = None
+        self.agent = None
+        # cProfile.Profile (--profile) and Tracer (--trace), which cover the
+        # whole process, including every shell / batch command
+        self.profiler = None
+        # cProfile only follows the thread that enabled it, so every thread
+        # started while profiling (map_concurrently / race workers etc.)
+        # gets its own, merged into the report
+        self._thread_profilers = []
+        self._profilers_lock = threading.Lock()
+        self.tracer = None
+        self.trace_file = None
+        self._command_span = None
+
+    def reset_args(self):
+        """Restores the per command options, so that commands run one after
+        another with the same Context (shell / batch) don't inherit each
+        other's --timeout, --concurrency etc."""
         self.cluster = 'default'
         self.node = None
         self.timeout = 60
-        # RiakMesosClient
-        self.client = None
+        self.concurrency = constants.DEFAULT_POOL_SIZE
+        self.zk_watch = False
+        # --deadline in seconds, and when it passes (monotonic)
+        self.deadline = None
+        self.deadline_at = None
+        # GET responses are only memoized for the duration of one command
+        self.memo = ResponseMemo()
+        # Drop the previous command's own -v, --json and --debug
+        if self.flags_set:
+            self.verbose, self.debug, self.json = self._flags
+            logging.getLogger().setLevel(self._log_level())
 
     def cli_error(self, message):
         raise CliError(message)
 
+    def remaining(self):
+        """Seconds left until --deadline, or None without one"""
+        if self.deadline_at is None:
+            return None
+        return self.deadline_at - monotonic()
+
+    def check_deadline(self, doing=None):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(self.deadline, doing)
+
+    def call_timeout(self, timeout=None, doing=None):
+        """Returns the timeout for one HTTP or zookeeper call: timeout (by
+        default --request-timeout) cut down to what is left of --deadline.
+        Raises DeadlineExceeded when nothing is left."""
+        self.check_deadline(doing)
+        if timeout is None and self.request_timeout > 0:
+            timeout = self.request_timeout
+        return clamp_timeout(timeout, self.remaining())
+
     def _init_flags(self, verbose, debug, info, version,
-                    config_schema, json, insecure_ssl, **kwargs):
-        # Exit immediately if any of these are found
+                    config_schema, json, insecure_ssl, no_keep_alive,
+                    no_agent, **kwargs):
         if self.flags_set:
+            self._init_command_flags(verbose, debug, json, insecure_ssl,
+                                     no_keep_alive, no_agent)
             return
+        # Exit immediately if any of these are found
         args = sys.argv[1:]
         if info or '--info' in args:
             click.echo('Start and manage Riak nodes in Mesos.')
@@ -293,19 +416,49 @@ class Context(object):
         self.json = True if self.json or '--json' in args else json
         self.debug = True if self.debug or '--debug' in args else debug
         self.attach = True if self.attach or '--attach' in args else False
-        # Configure logging for 3rd party libs
+        if no_keep_alive or '--no-keep-alive' in args:
+            self.keep_alive = False
+        if no_agent or '--no-agent' in args:
+            self.use_agent = False
         if self.debug:
-            logging.basicConfig(level=0)
             self.verbose = True
-        elif self.verbose:
-            logging.basicConfig(level=20)
-        else:
-            logging.basicConfig(level=50)
+        # Configure logging for 3rd party libs
+        logging.basicConfig(level=self._log_level())
         self.flags_set = True
+        self._flags = (self.verbose, self.debug, self.json)
         self.vlog("Insecure SSL Mode: " + str(self.insecure_ssl))
         self.vlog("Verbose Mode: " + str(self.verbose))
         self.vlog("Debug Mode: " + str(self.debug))
         self.vlog("JSON Mode: " + str(self.json))
+        self.vlog("HTTP Keep-Alive: " + str(self.keep_alive))
+
+    def _init_command_flags(self, verbose, debug, json, insecure_ssl,
+                            no_keep_alive, no_agent):
+        """Applies -v, --json and --debug given to one command run from
+        shell / batch, until reset_args() before the next command. The
+        connection flags are shared by every command, so they can only be
+        given to shell / batch itself."""
+        for flag, changed in [
+                ('--insecure-ssl', insecure_ssl and not self.insecure_ssl),
+                ('--no-keep-alive', no_keep_alive and self.keep_alive),
+                ('--no-agent', no_agent and self.use_agent)]:
+            if changed:
+                self.cli_error(flag + ' must be given to shell or batch, '
+                               'not to a single command.')
+        if verbose or debug:
+            self.verbose = True
+        if debug:
+            self.debug = True
+        if json:
+            self.json = True
+        logging.getLogger().setLevel(self._log_level())
+
+    def _log_level(self):
+        if self.debug:
+            return 0
+        if self.verbose:
+            return 20
+        return 50
 
     def init_args(self, home, config, framework, **kwargs):
         self._init_flags(**kwargs)
@@ -352,6 +505,88 @@ class Context(object):
         if 'timeout' in kwargs and kwargs['timeout'] is not None:
             self.timeout = kwargs['timeout']
 
+        if 'deadline' in kwargs and kwargs['deadline'] is not None:
+            self.deadline = kwargs['deadline']
+            self.deadline_at = monotonic() + self.deadline
+
+        if ('request_timeout' in kwargs and
+                kwargs['request_timeout'] is not None):
+            self.request_timeout = kwargs['request_timeout']
+
+        if ('poll_min_interval' in kwargs and
+                kwargs['poll_min_interval'] is not None):
+            self.poll_min_interval = kwargs['poll_min_interval']
+
+        if ('poll_max_interval' in kwargs and
+                kwargs['poll_max_interval'] is not None):
+            self.poll_max_interval = kwargs['poll_max_interval']
+        self.poll_max_interval = max(self.poll_max_interval,
+                                     self.poll_min_interval)
+
+        if 'zk_watch' in kwargs and kwargs['zk_watch']:
+            self.zk_watch = True
+
+        if 'concurrency' in kwargs and kwargs['concurrency'] is not None:
+            self.concurrency = max(kwargs['concurrency'], 1)
+
+        if ('http_pool_size' in kwargs and
+                kwargs['http_pool_size'] is not None):
+            self.http_pool_size = kwargs['http_pool_size']
+
+        if 'retries' in kwargs and kwargs['retries'] is not None:
+            self.retries = max(kwargs['retries'], 0)
+
+        if 'retry_backoff' in kwargs and kwargs['retry_backoff'] is not None:
+            self.retry_backoff = kwargs['retry_backoff']
+
+        if ('breaker_threshold' in kwargs and
+                kwargs['breaker_threshold'] is not None):
+            self.breaker_threshold = kwargs['breaker_threshold']
+
+        if ('url_cache_ttl' in kwargs and
+                kwargs['url_cache_ttl'] is not None):
+            self.url_cache_ttl = kwargs['url_cache_ttl']
+
+        if 'agent_socket' in kwargs and kwargs['agent_socket'] is not None:
+            self.agent_socket = kwargs['agent_socket']
+        if self.agent_socket is None:
+            self.agent_socket = expanduser('~') + \
+                '/.config/riak-mesos/agent.sock'
+
+        if 'profile' in kwargs and kwargs['profile']:
+            self.start_profiler()
+
+        if 'trace' in kwargs and kwargs['trace'] is not None:
+            self.start_tracer(kwargs['trace'])
+
+    def start_profiler(self):
+        if self.profiler is not None:
+            return
+        import cProfile
+        self.profiler = cProfile.Profile()
+        threading.setprofile(self._profile_thread)
+        self.profiler.enable()
+
+    def _profile_thread(self, frame, event, arg):
+        """Called for the first event in each new thread, replaces itself
+        with a cProfile.Profile for the thread"""
+        import cProfile
+        profiler = cProfile.Profile()
+        with self._profilers_lock:
+            self._thread_profilers.append(profiler)
+        profiler.enable()
+
+    def start_tracer(self, trace_file):
+        if self.tracer is not None:
+            return
+        self.trace_file = trace_file
+        self.tracer = Tracer()
+        self._command_span = self.tracer.span(
+            'riak-mesos ' + ' '.join(sys.argv[1:]), 'command')
+        self._command_span.__enter__()
+        if self.session is not None:
+            self.session.tracer = self.tracer
+
     def log(self, msg, *args):
         """Logs a message to stderr."""
         if args:
@@ -372,41 +607,201 @@ class Context(object):
             self.vlog('HTTP Status: ' + str(r.status_code))
             self.vlog('HTTP Response Text: ' + r.text)
 
+    def vlog_connections(self, url=None):
+        """Logs pooled connection counts per host only if debug is
+        enabled."""
+        if not self.debug or self.session is None:
+            return
+        stats = self.session.connection_stats()
+        for host in sorted(stats):
+            if (url is not None and
+                    host.rsplit(':', 1)[0] != urlparse(url).hostname):
+                continue
+            opened, sent = stats[host]
+            self.vlog('HTTP Connections (' + host + '): ' + str(opened) +
+                      ' opened, ' + str(sent) + ' requests')
+
+    def vlog_retries(self):
+        """Logs retries and circuit breaker state per host only if verbose
+        is enabled."""
+        if not self.verbose or self.session is None:
+            return
+        stats = self.session.retry_stats()
+        for host in sorted(stats):
+            host_stats = stats[host]
+            msg = ('HTTP Retries (' + host + '): ' +
+                   str(host_stats['retries']) + ' retries')
+            if 'breaker' in host_stats:
+                msg += (', circuit breaker ' + host_stats['breaker'] +
+                        ' (opened ' + str(host_stats['opened']) +
+                        ' times, ' + str(host_stats['rejected']) +
+                        ' requests rejected)')
+            self.vlog(msg)
+
     def vtraceback(self):
         if self.verbose:
             traceback.print_exc()
 
-    def _init_client(self):
+    def discovery_client(self):
+        """Returns the RiakMesosClient, creating it on first use and again
+        after invalidate_service_url has dropped it."""
+        with self._url_lock:
+            client = self.client
+        if client is not None:
+            return client
+        with self._discovery_lock:
+            with self._url_lock:
+                if self.client is not None:
+                    return self.client
+            client = self._new_client()
+            with self._url_lock:
+                self.client = client
+            return client
+
+    def _new_client(self):
         ctx = self
         if self.config_file is None:
             try:
-                _client = RiakMesosClient(ctx, RiakMesosDCOSStrategy)
-                self.client = _client
-                return
+                with span(self, 'dcos client', 'discovery'):
+                    return RiakMesosClient(ctx, RiakMesosDCOSStrategy)
+            except DeadlineExceeded:
+                raise
             except Exception as e:
-                self.vlog(e.message)
-        _client = RiakMesosClient(ctx)
-        self.client = _client
-        return
+                self.vlog(str(e))
+        with span(self, 'client', 'discovery'):
+            return RiakMesosClient(ctx)
 
     def get_framework_url(self):
-        if self.client is None:
-            self._init_client()
-        return self.client.framework_url()
-
-    def api_request(self, method, path, exit_on_failure=True, **kwargs):
-        return self.framework_request(method, 'api/v1/' + path,
-                                      exit_on_failure, **kwargs)
+        return self.service_url('framework')
+
+    def service_url(self, service):
+        """Returns the framework, marathon or master URL, skipping discovery
+        when a fresh entry exists in the URL cache. Safe to call from
+        several threads: only one of them runs discovery."""
+        with self._url_lock:
+            if service in self.service_urls:
+                return self.service_urls[service]
+        with self._discovery_lock:
+            with self._url_lock:
+                # Discovered by another thread while this one waited
+                if service in self.service_urls:
+                    return self.service_urls[service]
+            client = self.discovery_client()
+            with span(self, 'discover ' + service, 'discovery') as args:
+                with self._url_lock:
+                    if self.url_cache is None:
+                        key = str(self.framework) + ':' + \
+                            str(self.config_file)
+                        self.url_cache = UrlCache(key, self.url_cache_ttl)
+                    url = self.url_cache.get(service)
+                args['cached'] = url is not None
+                if url is not None:
+                    self.vlog('Using cached ' + service + ' URL ' + url)
+                else:
+                    url = getattr(client, service + '_url')()
+                    with self._url_lock:
+                        self.url_cache.set(service, url)
+                args['url'] = url
+            with self._url_lock:
+                self.service_urls[service] = url
+        return url
+
+    def invalidate_service_url(self, url):
+        with self._url_lock:
+            if self.url_cache is None:
+                return
+            stale = self.url_cache.invalidate(url=url)
+            for service, service_url in list(self.service_urls.items()):
+                if url.startswith(service_url):
+                    self.service_urls.pop(service, None)
+                    # Force discovery to run again in this process too
+                    self.client = None
+        if stale:
+            self.vlog('Removed cached URLs for: ' + ', '.join(stale))
+
+    def agent_key(self):
+        return str(self.framework) + ':' + str(self.config_file)
+
+    def api_request(self, method, path, exit_on_failure=True, max_age=None,
+                    **kwargs):
+        """Sends a request to the framework API. GET responses are memoized:
+        one no older than max_age seconds (by default 0 or the path's entry
+        in API_MEMO_MAX_AGES) is returned without a new request. Any other
+        method clears the memo."""
+        def request():
+            r = self.agent_request(method, path, **kwargs)
+            if r is not None:
+                if r.status_code == 0 and exit_on_failure:
+                    self.cli_error('Agent request ' + method.upper() + ' ' +
+                                   path + ' failed: ' + r.url)
+                return r
+            return self.framework_request(method, 'api/v1/' + path,
+                                          exit_on_failure, **kwargs)
+
+        if self.memo is None:
+            return request()
+        if method.lower() != 'get':
+            self.memo.invalidate()
+            return request()
+        if max_age is None:
+            max_age = 0
+            for pattern, path_max_age in API_MEMO_MAX_AGES:
+                if pattern.match(path):
+                    max_age = path_max_age
+                    break
+        key = path + ' ' + repr(sorted(kwargs.items()))
+        hits = self.memo.hits
+        r = self.memo.fetch(key, max_age, request)
+        if self.memo.hits > hits:
+            self.vlog('Using memoized response for GET ' + path)
+        return r
+
+    def agent_request(self, method, path, **kwargs):
+        """Sends an api request through a local riak-mesos agent, if one is
+        listening. Returns None when the request should be sent directly."""
+        if (not self.use_agent or self.agent_socket is None or
+                set(kwargs) - set(['data', 'headers']) or
+                not os.path.exists(self.agent_socket)):
+            return None
+        import socket
+        from riak_mesos.agent import AgentClient
+        if self.agent is None:
+            self.agent = AgentClient(self.agent_socket, self.agent_key())
+        from riak_mesos.agent import REQUEST_TIMEOUT
+        timeout = clamp_timeout(REQUEST_TIMEOUT, self.remaining())
+        try:
+            r = self.agent.api_request(method, path, timeout=timeout,
+                                       **kwargs)
+        except (socket.error, IOError, ValueError) as e:
+            # Don't retry a stale socket or another framework's agent
+            self.vlog('Not using agent at ' + self.agent_socket + ': ' +
+                      str(e))
+            self.use_agent = False
+            return None
+        if r is None:
+            self.vlog('Agent could not reach the framework, retrying '
+                      'directly')
+            return None
+        if r.status_code == 0:
+            # It may have been applied, so it isn't sent a second time
+            self.vlog('Agent could not reach the framework, not retrying ' +
+                      method.upper() + ' ' + path)
+            return r
+        self.vlog('Agent ' + ('cache hit' if r.cached else 'request') +
+                  ': ' + method.upper() + ' ' + path)
+        self.vlog_request(r)
+        return r
 
     def framework_request(self, method, path, exit_on_failure=True, **kwargs):
-        if self.client is None:
-            self._init_client()
+        self.discovery_client()
         try:
-            framework_url = self.client.framework_url()
+            framework_url = self.service_url('framework')
             return self.http_request(method,
                                      framework_url + path,
                                      exit_on_failure,
                                      **kwargs)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             if exit_on_failure:
                 raise e
@@ -416,12 +811,13 @@ class Context(object):
                                      'framework_url_not_available/' + path)
 
     def master_request(self, method, path, exit_on_failure=True, **kwargs):
-        if self.client is None:
-            self._init_client()
+        self.discovery_client()
         try:
-            master_url = self.client.master_url()
+            master_url = self.service_url('master')
             return self.http_request(method, master_url + path,
                                      exit_on_failure, **kwargs)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             if exit_on_failure:
                 raise e
@@ -431,52 +827,150 @@ class Context(object):
                                      'master_url_not_available/' + path)
 
     def node_request(self, method, node, path, exit_on_failure=True, **kwargs):
+        # A starting node answers 503, which isn't the framework failing
         return self.framework_request(method, 'riak/nodes/' + node + '/' +
-                                      path, exit_on_failure, **kwargs)
+                                      path, exit_on_failure, proxied=True,
+                                      **kwargs)
 
     def marathon_client(self):
-        if self.client is None:
-            self._init_client()
-        marathon_url = self.client.marathon_url()
-        return marathon.Client(marathon_url)
+        from dcos import marathon
+        marathon_url = self.service_url('marathon')
+        # The client keeps its timeout, so it's made again for each use
+        return marathon.Client(marathon_url,
+                               timeout=self.call_timeout(
+                                   doing='connecting to marathon'))
+
+    def http_session(self):
+        # Keep a pooled connection available for every concurrent worker
+        pool_size = max(self.http_pool_size, self.concurrency)
+        with self._session_lock:
+            if self.session is None:
+                from riak_mesos.session import RiakMesosSession
+                self.vlog('Creating HTTP session (pool size: ' +
+                          str(pool_size) + ', retries: ' +
+                          str(self.retries) + ')')
+                self.session = RiakMesosSession(
+                    pool_size, self.keep_alive, self.tracer,
+                    retry=RetryPolicy(self.retries, self.retry_backoff),
+                    breaker_threshold=self.breaker_threshold, log=self.vlog)
+            elif pool_size > self.session.pool_size:
+                self.vlog('Resizing HTTP session (pool size: ' +
+                          str(pool_size) + ')')
+                self.session.resize(pool_size)
+            return self.session
+
+    def close(self):
+        if self.session is not None:
+            self.vlog_connections()
+            self.vlog_retries()
+            self.session.close()
+            self.session = None
+        if self.zk is not None:
+            self.zk.stop()
+            self.zk.close()
+            self.zk = None
+        if self.tracer is not None:
+            self._command_span.__exit__(None, None, None)
+            self.tracer.write(self.trace_file)
+            self.vlog('Wrote trace to ' + self.trace_file)
+            self.tracer = None
+        if self.profiler is not None:
+            import pstats
+            threading.setprofile(None)
+            self.profiler.disable()
+            stats = pstats.Stats(self.profiler, stream=sys.stderr)
+            with self._profilers_lock:
+                profilers, self._thread_profilers = self._thread_profilers, []
+            for profiler in profilers:
+                stats.add(profiler)
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+            self.profiler = None
+
+    def zk_client(self):
+        with self._zk_lock:
+            if self.zk is None:
+                from kazoo.client import KazooClient
+                zk_url = self.discovery_client().zk_url()
+                self.vlog('Starting zookeeper session with ' + zk_url)
+                zk = KazooClient(hosts=zk_url)
+                with span(self, 'zookeeper connect', 'connect', url=zk_url):
+                    zk.start(timeout=self.call_timeout(
+                        ZK_START_TIMEOUT, 'connecting to zookeeper'))
+                self.zk = zk
+        return self.zk
 
     def zk_command(self, command, path):
-        if self.client is None:
-            self._init_client()
-        zk_url = self.client.zk_url()
+        """Runs a get, exists, children or delete command on path. When path
+        is a list of paths, the requests are pipelined with kazoo's async API
+        and an OrderedDict of path to result is returned."""
+        self.discovery_client()
         try:
-            zk = KazooClient(hosts=zk_url)
-            zk.start()
-            res = False
-            if command == 'get':
-                data, stat = zk.get(path)
-                res = data.decode("utf-8")
-            elif command == 'delete':
+            zk = self.zk_client()
+            if isinstance(path, (list, tuple)):
+                return self._zk_batch(zk, command, path)
+            if command == 'delete':
                 zk.delete(path, recursive=True)
-                res = 'Successfully deleted ' + path
-            zk.stop()
-            return res
+                return 'Successfully deleted ' + path
+            # The async API is used so that the wait can be timed out
+            return self._zk_batch(zk, command, [path])[path]
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             self.vlog(e)
             return False
 
+    def _zk_batch(self, zk, command, paths):
+        if command == 'get':
+            request = zk.get_async
+        elif command == 'exists':
+            request = zk.exists_async
+        elif command == 'children':
+            request = zk.get_children_async
+        else:
+            raise CliError('Unsupported batch zookeeper command ' + command)
+        # Send every request before waiting on any of the replies
+        pending = [(path, request(path)) for path in paths]
+        results = OrderedDict()
+        for path, async_result in pending:
+            timeout = self.call_timeout(doing='reading ' + path)
+            try:
+                value = async_result.get(timeout=timeout)
+                if command == 'get':
+                    value = value[0].decode("utf-8")
+                elif command == 'exists':
+                    value = value is not None
+                results[path] = value
+            except Exception as e:
+                self.vlog(str(path) + ': ' + repr(e))
+                results[path] = False
+        return results
+
     def http_request(self, method, url, exit_on_failure=True, **kwargs):
+        doing = method.upper() + ' ' + url
+        kwargs['timeout'] = self.call_timeout(kwargs.get('timeout'), doing)
         try:
             verify = True
             if self.insecure_ssl:
                 verify = False
-            r = http.request(method,
-                             url,
-                             verify=verify,
-                             is_success=_default_is_success,
-                             **kwargs)
+            r = self.http_session().request(method,
+                                            url,
+                                            verify=verify,
+                                            is_success=_default_is_success,
+                                            deadline=self.deadline_at,
+                                            **kwargs)
             self.vlog_request(r)
+            self.vlog_connections(url)
             if r.status_code == 404:
                 return FailedRequest(
                     404, method, url,
                     'Resource at ' + url + ' was not found (Status Code: 404)')
             return r
         except Exception as e:
+            import requests
+            if isinstance(e, (requests.exceptions.ConnectionError,
+                              requests.exceptions.Timeout)):
+                self.check_deadline(doing)
+                self.invalidate_service_url(url)
             if exit_on_failure:
                 raise e
             else:
@@ -522,7 +1016,55 @@ _common_options = [
     click.option('--json', is_flag=True,
                  help='Enables json output.'),
     click.option('--insecure-ssl', is_flag=True,
-                 help='Turns SSL verification off on HTTP requests')
+                 help='Turns SSL verification off on HTTP requests'),
+    click.option('--http-pool-size', type=int,
+                 help='Number of pooled HTTP connections kept per host.'),
+    click.option('--no-keep-alive', is_flag=True,
+                 help='Closes HTTP connections after every request.'),
+    click.option('--agent-socket',
+                 type=click.Path(dir_okay=False, resolve_path=True),
+                 help='Unix socket of the riak-mesos agent to send API '
+                      'requests through, if it is running.'),
+    click.option('--no-agent', is_flag=True,
+                 help='Never sends API requests through a riak-mesos '
+                      'agent.'),
+    click.option('--retries', type=int,
+                 help='Times to retry idempotent HTTP requests that fail '
+                      'to connect or get a 429, 502, 503 or 504 (default '
+                      + str(DEFAULT_RETRIES) + ').'),
+    click.option('--retry-backoff', type=float,
+                 help='Seconds before the first retry, doubling for each '
+                      'retry after it (default ' +
+                      str(DEFAULT_RETRY_BACKOFF) + ').'),
+    click.option('--breaker-threshold', type=int,
+                 help='Consecutive failures before requests to a host are '
+                      'rejected for a while (default ' +
+                      str(DEFAULT_BREAKER_THRESHOLD) + ', 0 disables).'),
+    click.option('--deadline', type=float,
+                 help='Seconds the whole command may take, including '
+                      'discovery, retries and waits.'),
+    click.option('--request-timeout', type=float,
+                 help='Seconds any one HTTP request may wait to connect or '
+                      'for data (default ' + str(DEFAULT_REQUEST_TIMEOUT) +
+                      ', 0 disables).'),
+    click.option('--url-cache-ttl', type=int,
+                 help='Seconds to cache discovered service URLs for '
+                      '(0 disables the cache).'),
+    click.option('--poll-min-interval', type=float,
+                 help='Shortest delay in seconds between wait-for-service '
+                      'checks.'),
+    click.option('--poll-max-interval', type=float,
+                 help='Longest delay in seconds between wait-for-service '
+                      'checks.'),
+    click.option('--profile', is_flag=True,
+                 help='Profiles the command, including its worker threads, '
+                      'and prints the functions it spent the most time in to '
+                      'stderr.'),
+    click.option('--trace',
+                 type=click.Path(dir_okay=False, writable=True,
+                                 resolve_path=True),
+                 help='Writes a Chrome trace event file of the command\'s '
+                      'HTTP requests, waits and service discovery.')
 ]
 
 
@@ -542,7 +1084,8 @@ class RiakMesosCLI(click.MultiCommand):
 
     def list_commands(self, ctx):
         # TODO: make this dynamically
-        rv = ['cluster', 'config', 'director', 'framework', 'node', 'riak']
+        rv = ['agent', 'batch', 'cluster', 'config', 'director', 'exporter',
+              'framework', 'node', 'riak', 'shell']
         # rv = []
         # for filename in os.listdir(cmd_folder):
         #     if filename.endswith('.py') and \
@@ -570,6 +1113,10 @@ def cli(ctx, **kwargs):
     """Command line utility for the Riak Mesos Framework / DCOS Service.
     This utility provides tools for modifying and accessing your Riak
     on Mesos installation."""
+    if not ctx.close_registered:
+        # Only the outermost invocation closes, not each shell / batch command
+        click.get_current_context().call_on_close(ctx.close)
+        ctx.close_registered = True
     ctx.init_args(**kwargs)
 
 
@@ -0,0 +1,78 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import socket
+
+import click
+
+from riak_mesos.agent import DEFAULT_TTL, Agent, AgentClient
+from riak_mesos.cli import pass_context
+
+
+@click.group()
+@pass_context
+def cli(ctx, **kwargs):
+    """Local agent that serves API requests for other riak-mesos
+    processes."""
+    ctx.init_args(**kwargs)
+
+
+@cli.command()
+@click.option('--ttl', type=float, default=DEFAULT_TTL,
+              help='Seconds to cache cluster / node lists and riak versions '
+                   'for (0 disables the cache).')
+@pass_context
+def start(ctx, ttl, **kwargs):
+    """Runs the agent in the foreground until it is stopped."""
+    ctx.init_args(**kwargs)
+    # The agent itself must always talk to the framework directly, and
+    # keeps its own cache rather than memoizing for its whole lifetime
+    ctx.use_agent = False
+    ctx.memo = None
+    agent = Agent(ctx, ctx.agent_socket, ttl)
+    ctx.log('Serving ' + agent.key + ' on ' + ctx.agent_socket)
+    try:
+        agent.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except (IOError, OSError) as e:
+        raise click.ClickException(str(e))
+
+
+@cli.command()
+@pass_context
+def status(ctx, **kwargs):
+    """Displays request, cache and connection counts of a running agent."""
+    ctx.init_args(**kwargs)
+    try:
+        stats = AgentClient(ctx.agent_socket, ctx.agent_key()).stats()
+    except (socket.error, IOError, ValueError) as e:
+        raise click.ClickException('No agent running on ' +
+                                   ctx.agent_socket + ': ' + str(e))
+    click.echo(json.dumps(stats))
+
+
+@cli.command()
+@pass_context
+def stop(ctx, **kwargs):
+    """Stops a running agent."""
+    ctx.init_args(**kwargs)
+    try:
+        AgentClient(ctx.agent_socket, ctx.agent_key()).stop()
+    except (socket.error, IOError, ValueError) as e:
+        raise click.ClickException('No agent running on ' +
+                                   ctx.agent_socket + ': ' + str(e))
+    click.echo('Stopped agent on ' + ctx.agent_socket)
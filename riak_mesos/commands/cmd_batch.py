@@ -0,0 +1,48 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import click
+
+from riak_mesos.cli import pass_context
+from riak_mesos.shell import run_command
+
+
+@click.command()
+@click.argument('batch_file', type=click.File('r'))
+@click.option('--stop-on-error', is_flag=True,
+              help='Stops at the first command that fails.')
+@pass_context
+def cli(ctx, batch_file, stop_on_error, **kwargs):
+    """Runs the riak-mesos commands in BATCH_FILE (one per line, - for stdin)
+    in a single process and reports the time taken by each."""
+    ctx.init_args(**kwargs)
+    total = 0
+    failed = 0
+    count = 0
+    for line in batch_file:
+        result = run_command(ctx, line)
+        if result is None:
+            continue
+        success, elapsed = result
+        count += 1
+        total += elapsed
+        if not success:
+            failed += 1
+            if stop_on_error:
+                break
+    ctx.log('Ran %d commands in %.3fs, %d failed' % (count, total, failed))
+    if failed > 0:
+        raise click.ClickException(str(failed) + ' of ' + str(count) +
+                                   ' commands failed')
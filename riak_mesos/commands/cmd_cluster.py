@@ -14,12 +14,21 @@
 # limitations under the License.
 
 import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 
 from riak_mesos.cli import pass_context
-from riak_mesos.util import (node_info, wait_for_node,
-                             wait_for_node_status_valid)
+from riak_mesos.stats import DEFAULT_HISTORY, StatsHistory, format_table
+from riak_mesos.util import (DeadlineExceeded, deadline, map_concurrently,
+                             monotonic, node_info, node_stats, node_transfers,
+                             wait, wait_for_cluster_restart,
+                             wait_for_cluster_transfers, wait_for_nodes,
+                             wait_for_nodes_started)
 
 
 @click.group()
@@ -35,11 +44,15 @@ def cli(ctx, **kwargs):
               help='Number of nodes to wait for.', default=1)
 @click.option('--timeout', type=int,
               help='Number of seconds to wait for a response.')
+@click.option('--concurrency', type=int,
+              help='Number of nodes to poll at the same time.')
+@click.option('--zk-watch', is_flag=True,
+              help='Waits on zookeeper metadata changes instead of polling.')
 @pass_context
 def wait_for_service(ctx, nodes, **kwargs):
-    """Iterates over all nodes in cluster and executes node wait-for-service.
-    Optionally waits until the number of nodes (specified by --nodes) at
-    minimum are joined to the cluster."""
+    """Polls all nodes in cluster at once until each is running, within a
+    single --timeout. Optionally waits until the number of nodes (specified
+    by --nodes) at minimum are joined to the cluster."""
     ctx.init_args(**kwargs)
     r = ctx.api_request('get', 'clusters/' + ctx.cluster + '/nodes')
     if r.status_code != 200:
@@ -47,38 +60,155 @@ def wait_for_service(ctx, nodes, **kwargs):
         return
     js = json.loads(r.text)
     ctx.vlog(nodes)
-    num_nodes = len(js['nodes'])
-    total_timeout = ctx.timeout
-    if num_nodes > 0:
-        ctx.timeout = max(total_timeout / num_nodes, 1)
-        for k in js['nodes']:
-            wait_for_node(ctx, k)
-        if num_nodes >= nodes:
-            # Okay, need to divide up the timeout properly
-            ctx.timeout = total_timeout
-            wait_for_node_status_valid(ctx, js['nodes'][0], nodes)
+    if len(js['nodes']) > 0:
+        wait_for_nodes(ctx, js['nodes'], nodes)
     else:
         click.echo("No nodes have been added to cluster " + ctx.cluster)
 
 
 @cli.command()
 @click.argument('cluster')
+@click.option('--concurrency', type=int,
+              help='Number of nodes to query at the same time.')
 @pass_context
 def endpoints(ctx, **kwargs):
     """Iterates over all nodes in cluster and prints connection information."""
     ctx.init_args(**kwargs)
     r = ctx.api_request('get', 'clusters/' +
                         ctx.cluster + '/nodes')
-    cluster_data = {}
+    cluster_data = OrderedDict()
     if r.status_code == 200:
         js = json.loads(r.text)
-        for k in js["nodes"]:
-            cluster_data[k] = node_info(ctx, k)
+        for k, data, error in map_concurrently(ctx, node_info, js["nodes"]):
+            if error is not None:
+                ctx.log('Unable to get info for node ' + k + ': ' +
+                        str(error))
+                data = {'error': str(error)}
+            cluster_data[k] = data
         click.echo(json.dumps(cluster_data))
     else:
         click.echo(r.text)
 
 
+@cli.command()
+@click.argument('cluster')
+@click.option('--watch', is_flag=True,
+              help='Keeps sampling every node, showing counters as per '
+                   'second rates.')
+@click.option('--interval', type=float, default=5,
+              help='Seconds between samples with --watch.')
+@click.option('--history', type=int, default=DEFAULT_HISTORY,
+              help='Samples kept per node with --watch, for the "total '
+                   '(avg)" rates.')
+@click.option('--format', 'output_format',
+              type=click.Choice(['table', 'ndjson']), default='table',
+              help='Output with --watch: a table redrawn every sample, or '
+                   'one JSON object per node per sample.')
+@click.option('--concurrency', type=int,
+              help='Number of nodes to query at the same time.')
+@pass_context
+def stats(ctx, watch, interval, history, output_format, **kwargs):
+    """Shows the statistics of every node in a cluster."""
+    ctx.init_args(**kwargs)
+    if not watch:
+        cluster_stats = OrderedDict()
+        for node, data, error in _sample_stats(ctx):
+            cluster_stats[node] = data if error is None else \
+                {'error': str(error)}
+        click.echo(json.dumps(cluster_stats))
+        return
+    samples = StatsHistory(history)
+    listed = []
+    try:
+        while True:
+            start = monotonic()
+            timestamp = time.time()
+            # One failed listing shouldn't end a long watch, keep sampling
+            # the nodes from the last one that worked
+            latest = _cluster_nodes(ctx, exit_on_failure=False)
+            if latest is not None:
+                listed = latest
+            errors = {}
+            nodes = []
+            for node, data, error in _sample_stats(ctx, listed):
+                nodes.append(node)
+                if error is not None:
+                    errors[node] = error
+                else:
+                    samples.add(node, start, data)
+            for node in samples.nodes():
+                if node not in nodes:
+                    samples.remove(node)
+            if output_format == 'ndjson':
+                for node in nodes:
+                    row = OrderedDict([('time', round(timestamp, 3)),
+                                       ('node', node)])
+                    if node in errors:
+                        row['error'] = str(errors[node])
+                    else:
+                        for column, value in samples.latest(node).items():
+                            if isinstance(value, float):
+                                value = round(value, 3)
+                            row[column] = value
+                    click.echo(json.dumps(row))
+            else:
+                if sys.stdout.isatty():
+                    click.clear()
+                window = max([samples.window(node) for node in nodes] + [0])
+                click.echo('Cluster ' + ctx.cluster + ': ' +
+                           str(len(nodes)) + ' nodes at ' +
+                           time.strftime('%H:%M:%S',
+                                         time.localtime(timestamp)) +
+                           ', averages over ' + str(int(window)) + 's')
+                for line in format_table(samples, nodes, errors):
+                    click.echo(line)
+                click.echo('')
+            remaining = ctx.remaining()
+            if remaining is not None and remaining <= interval:
+                return
+            time.sleep(max(interval - (monotonic() - start), 0))
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.argument('cluster')
+@click.option('-w-f-s', '--wait-for-service', is_flag=True,
+              help='Waits for transfers to complete on every node.')
+@click.option('--timeout', type=int,
+              help='Number of seconds to wait for a response.')
+@click.option('--concurrency', type=int,
+              help='Number of nodes to query at the same time.')
+@pass_context
+def transfers(ctx, wait_for_service, **kwargs):
+    """Gets the transfers status of every node in a cluster. With
+    --wait-for-service, polls all nodes at once until none have transfers
+    waiting or active, showing the totals and an estimated time to
+    completion."""
+    ctx.init_args(**kwargs)
+    if wait_for_service:
+        wait_for_cluster_transfers(ctx)
+        return
+    r = ctx.api_request('get', 'clusters/' + ctx.cluster + '/nodes')
+    if r.status_code != 200:
+        click.echo(r.text)
+        return
+    cluster_transfers = OrderedDict()
+    for node, data, error in map_concurrently(ctx, node_transfers,
+                                              json.loads(r.text)['nodes']):
+        if error is not None:
+            data = {'error': str(error)}
+        cluster_transfers[node] = data
+    click.echo(json.dumps(cluster_transfers))
+
+
+def _sample_stats(ctx, nodes=None):
+    """Fetches every node's stats at the same time"""
+    if nodes is None:
+        nodes = _cluster_nodes(ctx)
+    return map_concurrently(ctx, node_stats, nodes)
+
+
 @cli.command()
 @click.argument('cluster')
 @pass_context
@@ -214,14 +344,32 @@ def create(ctx, riak_version, **kwargs):
 
 @cli.command()
 @click.argument('cluster')
+@click.option('-w-f-s', '--wait-for-service', is_flag=True,
+              help='Waits for every node to restart and pass its ping, '
+                   'status, ringready and transfers checks.')
+@click.option('--timeout', type=int,
+              help='Number of seconds to wait for a response.')
+@click.option('--concurrency', type=int,
+              help='Number of nodes to probe at the same time.')
 @pass_context
-def restart(ctx, **kwargs):
-    """Performs a rolling restart on a cluster."""
+def restart(ctx, wait_for_service, **kwargs):
+    """Performs a rolling restart on a cluster. With --wait-for-service,
+    follows the restart until every node has come back healthy, within a
+    single --timeout."""
     ctx.init_args(**kwargs)
+    nodes = []
+    if wait_for_service:
+        r = ctx.api_request('get', 'clusters/' + ctx.cluster + '/nodes')
+        if r.status_code != 200:
+            click.echo(r.text)
+            return
+        nodes = json.loads(r.text)['nodes']
     r = ctx.api_request('post',
                         'clusters/' + ctx.cluster +
                         '/restart', data='')
     click.echo(r.text)
+    if r.status_code == 200 and len(nodes) > 0:
+        wait_for_cluster_restart(ctx, nodes)
 
 
 @cli.command()
@@ -239,11 +387,118 @@ def destroy(ctx, **kwargs):
 @click.argument('cluster')
 @click.option('--nodes', type=int, default=1,
               help='Number of nodes to add.')
+@click.option('--wait', is_flag=True,
+              help='Waits for the new nodes to be ready.')
+@click.option('--timeout', type=int,
+              help='Number of seconds to wait for the new nodes.')
+@click.option('--concurrency', type=int,
+              help='Number of requests to have in flight at the same time.')
 @pass_context
-def add_node(ctx, nodes, **kwargs):
+def add_node(ctx, nodes, wait, **kwargs):
     """Adds one or more (using --nodes) nodes."""
     ctx.init_args(**kwargs)
-    for x in range(0, nodes):
-        r = ctx.api_request('post', 'clusters/' +
-                            ctx.cluster + '/nodes', data='')
-        click.echo(r.text)
+    start = monotonic()
+    until = deadline(ctx)
+    claimed = set()
+    if wait:
+        existing = _cluster_nodes(ctx, exit_on_failure=False)
+        if existing is None:
+            ctx.cli_error('Unable to list the existing nodes, which --wait '
+                          'needs to tell the new nodes apart.')
+        claimed.update(existing)
+    lock = threading.Lock()
+    workers = max(1, min(ctx.concurrency, nodes))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def add(ctx, index):
+            r = ctx.api_request('post', 'clusters/' +
+                                ctx.cluster + '/nodes', data='',
+                                exit_on_failure=False)
+            if r.text:
+                click.echo(r.text)
+            else:
+                click.echo('Failed to add node, status_code: ' +
+                           str(r.status_code))
+            if not wait or r.status_code != 200:
+                return r, None
+            # Start waiting for this node while the rest are still being
+            # created
+            return r, executor.submit(_wait_for_new_node, ctx, claimed, lock,
+                                      until)
+
+        created = 0
+        waiting = []
+        for index, result, error in map_concurrently(ctx, add,
+                                                     list(range(nodes))):
+            if error is not None:
+                click.echo(str(error))
+                continue
+            r, future = result
+            if r.status_code == 200:
+                created += 1
+            if future is not None:
+                waiting.append(future)
+        summary = ('Created ' + str(created) + ' of ' + str(nodes) +
+                   ' nodes (' + str(nodes - created) + ' failed) in ' +
+                   _seconds(monotonic() - start) + '.')
+        if len(waiting) > 0:
+            ready = len([f for f in waiting if _new_node_ready(f)])
+            summary += (' ' + str(ready) + ' of ' + str(len(waiting)) +
+                        ' new nodes ready in ' +
+                        _seconds(monotonic() - start) + '.')
+    if nodes > 1 or wait:
+        click.echo(summary)
+
+
+def _new_node_ready(future):
+    """Whether a _wait_for_new_node future saw its node start, counting a
+    waiter that failed as not ready so the other nodes are still reported"""
+    try:
+        return future.result()
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        click.echo('Unable to wait for a new node: ' + str(e))
+        return False
+
+
+def _wait_for_new_node(ctx, claimed, lock, until):
+    """Waits for a node created by add-node to start. The create response
+    doesn't name the node, so this takes the first node in the cluster that
+    isn't in claimed yet. Returns whether the node started in time."""
+    found = []
+
+    def check():
+        nodes = _cluster_nodes(ctx, exit_on_failure=False)
+        if nodes is None:
+            return False, None
+        with lock:
+            for node in nodes:
+                if node not in claimed:
+                    claimed.add(node)
+                    found.append(node)
+                    return True, None
+        return False, len(nodes)
+
+    if not wait(ctx, check, until):
+        click.echo('New node did not appear in ' + str(ctx.timeout) +
+                   ' seconds.')
+        return False
+    return len(wait_for_nodes_started(ctx, found, until)) == 0
+
+
+def _cluster_nodes(ctx, exit_on_failure=True):
+    """Returns the cluster's node names. Without exit_on_failure, a failed
+    listing is logged and returns None."""
+    r = ctx.api_request('get', 'clusters/' + ctx.cluster + '/nodes',
+                        exit_on_failure=exit_on_failure)
+    if r.status_code == 200:
+        return json.loads(r.text)['nodes']
+    message = 'Failed to get nodes, status_code: ' + str(r.status_code)
+    if exit_on_failure:
+        ctx.cli_error(message)
+    ctx.log(message)
+    return None
+
+
+def _seconds(seconds):
+    return str(round(seconds, 1)) + ' seconds'
@@ -14,11 +14,12 @@
 # limitations under the License.
 
 import json
-import time
 
 import click
 
 from riak_mesos.cli import pass_context
+from riak_mesos.events import wait_for_marathon_app
+from riak_mesos.util import deadline, poll
 
 
 @click.group()
@@ -43,33 +44,42 @@ def config(ctx, **kwargs):
 @click.argument('cluster')
 @click.option('--timeout', type=int,
               help='Number of seconds to wait for a response.')
+@click.option('--events', is_flag=True,
+              help='Waits on Marathon\'s event stream instead of polling.')
 @pass_context
-def wait_for_service(ctx, **kwargs):
+def wait_for_service(ctx, events, **kwargs):
     """Waits --timeout seconds or until director is running"""
     ctx.init_args(**kwargs)
     ctx.config.from_marathon(ctx)
-    timeout = ctx.timeout
+    until = deadline(ctx)
     framework = ctx.framework
     app_name = "-".join((framework, ctx.cluster, 'director'))
     ctx.vlog('Waiting for director ' + app_name)
-    while timeout >= 0:
-        try:
-            if timeout == 0:
-                click.echo('Director did not respond in ' + str(ctx.timeout) +
-                           ' seconds.')
+    client = ctx.marathon_client()
+    state = {}
 
-            client = ctx.marathon_client()
+    def done():
+        try:
             app = client.get_app('/' + app_name)
-            if len(app['tasks']) == 0:
-                click.echo("Director is not installed.")
-                return
-            if app['tasksHealthy'] != 0:
-                click.echo("Director is ready.")
-                return
-        except:
-            pass
-        time.sleep(1)
-        timeout = timeout - 1
+        except Exception as e:
+            ctx.vlog(e)
+            return False
+        state['installed'] = len(app['tasks']) != 0
+        state['healthy'] = app['tasksHealthy'] != 0
+        return not state['installed'] or state['healthy']
+
+    ready = None
+    if events:
+        ready = wait_for_marathon_app(ctx, '/' + app_name, done, until)
+    if ready is None:
+        ready = poll(ctx, lambda: (done(), None), until)
+    if not ready:
+        click.echo('Director did not respond in ' + str(ctx.timeout) +
+                   ' seconds.')
+    elif not state['installed']:
+        click.echo("Director is not installed.")
+    else:
+        click.echo("Director is ready.")
     return
 
 
@@ -0,0 +1,51 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import click
+
+from riak_mesos.cli import pass_context
+from riak_mesos.exporter import DEFAULT_INTERVAL, DEFAULT_PORT, Exporter, serve
+
+
+@click.command()
+@click.option('--host', default='0.0.0.0',
+              help='Address to serve metrics on.')
+@click.option('--port', type=int, default=DEFAULT_PORT,
+              help='Port to serve metrics on (0 picks a free port).')
+@click.option('--interval', type=float, default=DEFAULT_INTERVAL,
+              help='Seconds to reuse fetched stats for, usually the scrape '
+                   'interval.')
+@click.option('--concurrency', type=int,
+              help='Number of nodes to query at the same time.')
+@pass_context
+def cli(ctx, host, port, interval, **kwargs):
+    """Serves every node's stats for Prometheus on /metrics."""
+    ctx.init_args(**kwargs)
+    # Like the agent, the exporter runs until it is stopped, so it talks to
+    # the framework directly and doesn't memoize for its whole lifetime
+    ctx.use_agent = False
+    ctx.memo = None
+    exporter = Exporter(ctx, interval)
+
+    def started(address):
+        ctx.log('Serving metrics on http://' + address[0] + ':' +
+                str(address[1]) + '/metrics')
+
+    try:
+        serve(exporter, host, port, started)
+    except KeyboardInterrupt:
+        pass
+    except (IOError, OSError) as e:
+        raise click.ClickException(str(e))
@@ -14,11 +14,14 @@
 # limitations under the License.
 
 import json
-import time
+import sys
 
 import click
 
+from riak_mesos import metadata
 from riak_mesos.cli import pass_context
+from riak_mesos.events import wait_for_marathon_app
+from riak_mesos.util import DeadlineExceeded, deadline, poll
 
 
 @click.group()
@@ -62,23 +65,30 @@ def status(ctx, **kwargs):
 @cli.command('wait-for-service')
 @click.option('--timeout', type=int,
               help='Number of seconds to wait for a response.')
+@click.option('--events', is_flag=True,
+              help='Waits on Marathon\'s event stream instead of polling.')
 @pass_context
-def wait_for_service(ctx, **kwargs):
+def wait_for_service(ctx, events, **kwargs):
     """Waits timeout seconds (default is 60) or until Framework is running.
     Specify timeout with --timeout."""
     ctx.init_args(**kwargs)
-    timeout = ctx.timeout
-    while timeout >= 0:
-        if timeout == 0:
-            click.echo('Riak Mesos Framework did not respond within ' +
-                       str(ctx.timeout) + ' seconds.')
-            return
+    until = deadline(ctx)
+
+    def healthy():
         r = ctx.framework_request('get', 'healthcheck', False)
-        if r.status_code == 200:
-            click.echo('Riak Mesos Framework is ready.')
-            return
-        time.sleep(1)
-        timeout = timeout - 1
+        return r.status_code == 200
+
+    ready = None
+    if events:
+        ready = wait_for_marathon_app(ctx, '/' + ctx.framework, healthy,
+                                      until)
+    if ready is None:
+        ready = poll(ctx, lambda: (healthy(), None), until)
+    if ready:
+        click.echo('Riak Mesos Framework is ready.')
+    else:
+        click.echo('Riak Mesos Framework did not respond within ' +
+                   str(ctx.timeout) + ' seconds.')
     return
 
 
@@ -98,16 +108,50 @@ def uninstall(ctx, **kwargs):
 @cli.command('clean-metadata')
 @click.option('-f', '--force', is_flag=True,
               help='Forcefully remove zookeeper data.')
+@click.option('--dry-run', is_flag=True,
+              help='Shows how many znodes and bytes would be removed.')
 @pass_context
-def clean_metadata(ctx, force, **kwargs):
+def clean_metadata(ctx, force, dry_run, **kwargs):
     """Deletes all metadata for the selected Riak Mesos Framework instance"""
     ctx.init_args(**kwargs)
-    fn = ctx.config.get('framework-name')
-    if force:
+    fn = ctx.config.get('framework-name') or ctx.framework
+    if not fn:
+        click.echo('Unable to determine the framework name.')
+        return
+    path = '/riak/frameworks/' + fn
+    if dry_run or force:
+        try:
+            zk = ctx.zk_client()
+            znodes = metadata.walk(zk, path, ctx.call_timeout)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            ctx.vlog(e)
+            click.echo("Unable to read framework zookeeper data.")
+            return
+        total_bytes = sum(size for p, depth, size in znodes)
+        summary = (str(len(znodes)) + ' znodes (' + str(total_bytes) +
+                   ' bytes) under ' + path)
+    if dry_run:
+        click.echo('Would remove ' + summary)
+    elif force:
         click.echo('\nRemoving zookeeper information\n')
-        result = ctx.zk_command('delete', '/riak/frameworks/' + fn)
+        if len(znodes) == 0:
+            click.echo('No framework zookeeper data found at ' + path)
+            return
+        with click.progressbar(length=len(znodes), file=sys.stderr,
+                               label='Deleting znodes') as bar:
+            failed = metadata.purge(zk, znodes, bar.update,
+                                    ctx.call_timeout)
+        if len(failed) > 0:
+            # Something was added or changed underneath, finish the job the
+            # slow way
+            ctx.vlog(str(len(failed)) + ' znodes were not removed in bulk')
+            result = ctx.zk_command('delete', path)
+        else:
+            result = 'Successfully deleted ' + path
         if result:
-            click.echo(result)
+            click.echo(result + ' (' + summary + ')')
         else:
             click.echo("Unable to remove framework zookeeper data.")
     else:
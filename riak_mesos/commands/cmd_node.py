@@ -14,9 +14,11 @@
 # limitations under the License.
 
 import json
+import time
 import click
 
 from riak_mesos.cli import pass_context
+from riak_mesos.logs import LineFilter, LogTail, parse_since
 from riak_mesos.util import (get_node_name, wait_for_node,
                              wait_for_node_transfers)
 
@@ -32,6 +34,8 @@ def cli(ctx, **kwargs):
 @click.argument('node')
 @click.option('--timeout', type=int,
               help='Number of seconds to wait for a response.')
+@click.option('--zk-watch', is_flag=True,
+              help='Waits on zookeeper metadata changes instead of polling.')
 @pass_context
 def wait_for_service(ctx, **kwargs):
     """Waits timeout seconds (default is 60) or until node is running.
@@ -110,6 +114,8 @@ def ringready(ctx, **kwargs):
               help='Waits for transfers to complete.')
 @click.option('--timeout', type=int,
               help='Number of seconds to wait for a response.')
+@click.option('--zk-watch', is_flag=True,
+              help='Waits on zookeeper metadata changes instead of polling.')
 @pass_context
 def transfers(ctx, wait_for_service, **kwargs):
     """Gets the transfers status for a node"""
@@ -217,22 +223,73 @@ def log(ctx, **kwargs):
               help='Log file to view.', default='console.log')
 @click.option('--lines', type=int, default=500,
               help='Number of log lines to view.')
+@click.option('-f', '--follow', is_flag=True,
+              help='Keeps printing new lines as they are logged.')
+@click.option('--since',
+              help='Only shows lines logged after a time (UTC, e.g. '
+                   '"2016-10-18 12:00:00") or in the last 30s, 10m, 2h, '
+                   '1d etc.')
+@click.option('--grep', 'pattern',
+              help='Only shows lines matching this regular expression.')
+@click.option('--interval', type=float, default=2,
+              help='Seconds between checks for new lines with --follow.')
 @pass_context
-def log_tail(ctx, log_file, lines, **kwargs):
+def log_tail(ctx, log_file, lines, follow, since, pattern, interval,
+             **kwargs):
     """Shows tail of log file for a node, filename with --file
-    and number of lines with --lines"""
+    and number of lines with --lines. With --follow, --since or --grep the
+    log lines are printed as plain text instead of JSON."""
     ctx.init_args(**kwargs)
     node_name = get_node_name(ctx, ctx.node)
-    r = ctx.framework_request('get', 'explore/clusters/' +
-                              ctx.cluster + '/nodes/' +
-                              node_name + '/log/files/' +
-                              log_file + '?rows=' + str(lines),
-                              headers={'Accept': '*/*'})
-    if r.status_code != 200:
-        click.echo('Failed to get log files, status_code: ' +
-                   str(r.status_code))
-    else:
-        click.echo(r.text)
+    path = ('explore/clusters/' + ctx.cluster + '/nodes/' + node_name +
+            '/log/files/' + log_file)
+    if not follow and since is None and pattern is None:
+        r = ctx.framework_request('get', path + '?rows=' + str(lines),
+                                  headers={'Accept': '*/*'})
+        if r.status_code != 200:
+            click.echo('Failed to get log files, status_code: ' +
+                       str(r.status_code))
+        else:
+            click.echo(r.text)
+        return
+    try:
+        line_filter = LineFilter(since and parse_since(since), pattern)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+    def fetch(rows):
+        r = ctx.framework_request('get', path + '?rows=' + str(rows),
+                                  exit_on_failure=not follow,
+                                  headers={'Accept': '*/*'})
+        if r.status_code != 200:
+            # Keep following while the node restarts
+            message = ('Failed to get log files, status_code: ' +
+                       str(r.status_code))
+            if follow:
+                ctx.vlog(message)
+            else:
+                click.echo(message)
+            return None
+        files = r.json()['files']
+        return files['total_lines'], files['lines']
+
+    tail = LogTail(fetch, lines)
+    try:
+        while True:
+            for line in tail.poll():
+                if line_filter.match(line):
+                    click.echo(line)
+            if tail.skipped > 0:
+                ctx.vlog('Skipped ' + str(tail.skipped) + ' lines logged '
+                         'faster than they could be fetched')
+                tail.skipped = 0
+            remaining = ctx.remaining()
+            if not follow or (remaining is not None and
+                              remaining <= interval):
+                return
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
 
 
 @log.command('list')
@@ -259,9 +316,8 @@ def log_list(ctx, **kwargs):
 def stats(ctx, **kwargs):
     """Shows the statistics for a node"""
     ctx.init_args(**kwargs)
-    r = ctx.framework_request('get', 'riak/nodes/' +
-                              ctx.node + '/stats',
-                              headers={'Accept': '*/*'})
+    r = ctx.node_request('get', ctx.node, 'stats',
+                         headers={'Accept': '*/*'})
     if r.status_code != 200:
         click.echo('Failed to get stats, status_code: ' +
                    str(r.status_code))
@@ -0,0 +1,47 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+
+import click
+from six.moves import input
+
+from riak_mesos.cli import pass_context
+from riak_mesos.shell import run_command
+
+
+@click.command()
+@pass_context
+def cli(ctx, **kwargs):
+    """Runs riak-mesos commands interactively in a single process. Global
+    options such as --config or --verbose are given to shell itself, and
+    -v, --json and --debug can also be given to a single command."""
+    ctx.init_args(**kwargs)
+    prompt = ''
+    if sys.stdin.isatty():
+        prompt = 'riak-mesos> '
+        ctx.log('Enter commands without the riak-mesos prefix, '
+                '"exit" to quit.')
+    while True:
+        try:
+            line = input(prompt)
+        except EOFError:
+            break
+        except KeyboardInterrupt:
+            click.echo('')
+            continue
+        if line.strip() in ['exit', 'quit']:
+            break
+        run_command(ctx, line)
@@ -150,7 +150,11 @@ class RiakMesosConfig(object):
                 mj['env']['RIAK_MESOS_DIRECTOR_PUBLIC'] = 'false'
         mj['env']['RIAK_MESOS_NAME'] = self.get('framework-name')
         mj['env']['RIAK_MESOS_ZK'] = self.get('zk')
-        mj['env']['RIAK_MESOS_MASTER'] = self.get('master')
+        master = self.get('master')
+        if isinstance(master, list):
+            # The scheduler takes one master, the CLI can try several
+            master = master[0] if len(master) > 0 else ''
+        mj['env']['RIAK_MESOS_MASTER'] = master
         mj['env']['RIAK_MESOS_USER'] = self.get('user')
         mj['env']['RIAK_MESOS_RESOURCE_URLS'] = json.dumps(
             self._get_config_value('resources'))
@@ -253,6 +257,14 @@ class RiakMesosConfig(object):
     def get(self, key, subkey=None):
         return self.get_any('riak', key, subkey)
 
+    def get_list(self, key):
+        """Returns a setting that may be a list or a comma separated string
+        (e.g. several marathon or master hosts) as a list"""
+        value = self.get(key)
+        if not isinstance(value, list):
+            value = value.split(',')
+        return [v.strip() for v in value if v.strip() != '']
+
     def get_any(self, key, subkey1, subkey2=None):
         if subkey2 is not None and subkey2 is not None:
             if (key in self._config and subkey1 in self._config[key] and
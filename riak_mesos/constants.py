@@ -15,3 +15,6 @@
 """DCOS Riak Constants"""
 
 version = '1.4.0'
+
+# Pooled HTTP connections per host, and default --concurrency
+DEFAULT_POOL_SIZE = 10
@@ -0,0 +1,97 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos Marathon Event Stream"""
+
+import json
+
+from riak_mesos.util import monotonic
+
+READINESS_EVENTS = ['health_status_changed_event', 'status_update_event']
+
+
+def open_event_stream(ctx, until, event_types=READINESS_EVENTS):
+    """Subscribes to Marathon's /v2/events server sent event stream. The read
+    timeout is the time left until the deadline, so a quiet stream can't
+    block past it."""
+    url = ctx.service_url('marathon') + 'v2/events?' + '&'.join(
+        'event_type=' + t for t in event_types)
+    remaining = max(until - monotonic(), 0.1)
+    r = ctx.http_session().request('get', url,
+                                   stream=True,
+                                   verify=not ctx.insecure_ssl,
+                                   timeout=(min(remaining, 10), remaining),
+                                   headers={'Accept': 'text/event-stream'})
+    if r.status_code != 200:
+        r.close()
+        raise Exception('Marathon event stream returned status ' +
+                        str(r.status_code))
+    ctx.vlog('Subscribed to Marathon events at ' + url)
+    return r
+
+
+def read_events(ctx, r, until):
+    """Yields (event_type, event) tuples from an open event stream until it
+    closes, goes quiet past the deadline, or the deadline passes."""
+    import requests
+    event_type = None
+    data = []
+    try:
+        # chunk_size=None hands back data as soon as it arrives
+        for line in r.iter_lines(chunk_size=None):
+            if not isinstance(line, str):
+                line = line.decode('utf-8')
+            if line.startswith('event:'):
+                event_type = line[6:].strip()
+            elif line.startswith('data:'):
+                data.append(line[5:].strip())
+            elif line == '' and len(data) > 0:
+                try:
+                    yield event_type, json.loads('\n'.join(data))
+                except ValueError:
+                    ctx.vlog('Ignoring malformed Marathon event')
+                event_type = None
+                data = []
+            if monotonic() >= until:
+                return
+    except requests.exceptions.RequestException as e:
+        ctx.vlog('Marathon event stream closed: ' + str(e))
+
+
+def wait_for_marathon_app(ctx, app_id, check, until):
+    """Runs check() once, then again every time Marathon reports a health or
+    status change for app_id, until it returns True or the deadline passes.
+    Returns None when the event stream is unavailable (or ends early) so the
+    caller can fall back to polling for the remaining time."""
+    try:
+        r = open_event_stream(ctx, until)
+    except Exception as e:
+        ctx.vlog('Unable to use Marathon events, polling instead: ' + str(e))
+        return None
+    try:
+        if check():
+            return True
+        for event_type, event in read_events(ctx, r, until):
+            if event.get('appId') != app_id:
+                continue
+            ctx.vlog('Received ' + str(event_type) + ' for ' + app_id)
+            if check():
+                return True
+    finally:
+        r.close()
+    if check():
+        return True
+    if monotonic() < until:
+        return None
+    return False
@@ -0,0 +1,213 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos Prometheus Exporter
+
+Serves the stats of every node in every cluster in the Prometheus text
+format. A scrape fetches all of the nodes' stats at the same time through
+the Context's pooled HTTP session, and the result is reused for any scrape
+within the next interval seconds.
+"""
+
+import json
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from six import integer_types
+from six.moves import BaseHTTPServer, socketserver
+
+from riak_mesos.util import map_concurrently, monotonic, node_stats
+
+DEFAULT_PORT = 9191
+DEFAULT_INTERVAL = 15
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'riak_'
+INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_]')
+# Stats ending in _total are counters (node_gets_total etc.), except these,
+# which are sizes in bytes that go down as well as up
+STAT_TYPES = {
+    'mem_total': 'gauge',
+    'memory_total': 'gauge'
+}
+
+
+class MetricTable(object):
+    """Maps riak stat names to Prometheus metric names and types. Each name
+    is converted the first time it is seen, so a scrape is a dict lookup
+    per stat. STAT_TYPES overrides the type guessed from the name."""
+
+    def __init__(self):
+        self._names = {}
+
+    def lookup(self, stat):
+        if stat not in self._names:
+            name = PREFIX + INVALID_NAME_CHARS.sub('_', stat)
+            kind = STAT_TYPES.get(
+                stat, 'counter' if name.endswith('_total') else 'gauge')
+            self._names[stat] = (name, kind)
+        return self._names[stat]
+
+
+def _number(value):
+    """Returns value if it is a numeric stat (not a bool, string, list of
+    ring members etc.), otherwise None"""
+    if (isinstance(value, bool) or
+            not isinstance(value, integer_types + (float,))):
+        return None
+    return value
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n') + '"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def render(table, samples):
+    """Returns the Prometheus text for samples, a list of (labels, stats)
+    tuples where labels is a list of (name, value) pairs"""
+    metrics = OrderedDict()
+    for labels, stats in samples:
+        label_text = _labels(labels)
+        for stat, value in stats.items():
+            value = _number(value)
+            if value is None:
+                continue
+            name, kind = table.lookup(stat)
+            if name not in metrics:
+                metrics[name] = (kind, [])
+            metrics[name][1].append(name + label_text + ' ' +
+                                    _format_value(value))
+    lines = []
+    for name, (kind, values) in metrics.items():
+        lines.append('# TYPE ' + name + ' ' + kind)
+        lines.extend(values)
+    return '\n'.join(lines) + '\n'
+
+
+class Exporter(object):
+    def __init__(self, ctx, interval=DEFAULT_INTERVAL):
+        self.ctx = ctx
+        self.interval = interval
+        self.table = MetricTable()
+        self.scrapes = 0
+        self._text = None
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def metrics(self):
+        """Returns the cached metrics text, fetching it again if it is older
+        than interval. Concurrent scrapes wait for one fetch."""
+        with self._lock:
+            if (self._text is None or
+                    monotonic() - self._fetched_at >= self.interval):
+                self._text = self.fetch()
+                self._fetched_at = monotonic()
+            return self._text
+
+    def fetch(self):
+        ctx = self.ctx
+        start = monotonic()
+        self.scrapes += 1
+        r = ctx.api_request('get', 'clusters', exit_on_failure=False)
+        clusters = []
+        if r.status_code == 200:
+            clusters = json.loads(r.text)['clusters']
+        nodes = []
+        for cluster in clusters:
+            r = ctx.api_request('get', 'clusters/' + cluster + '/nodes',
+                                exit_on_failure=False)
+            if r.status_code == 200:
+                nodes.extend((cluster, node)
+                             for node in json.loads(r.text)['nodes'])
+
+        def fetch_node(ctx, item):
+            return node_stats(ctx, item[1])
+
+        samples = []
+        up = []
+        for (cluster, node), stats, error in map_concurrently(
+                ctx, fetch_node, nodes):
+            labels = [('cluster', cluster), ('node', node)]
+            up.append((labels, {'mesos_node_up': int(error is None)}))
+            if error is None:
+                samples.append((labels, stats))
+        exporter_stats = {
+            'mesos_exporter_clusters': len(clusters),
+            'mesos_exporter_nodes': len(nodes),
+            'mesos_exporter_scrape_duration_seconds':
+                round(monotonic() - start, 6),
+            'mesos_exporter_last_scrape_timestamp_seconds':
+                round(time.time(), 3),
+            'mesos_exporter_scrapes_total': self.scrapes
+        }
+        return render(self.table, up + samples + [([], exporter_stats)])
+
+
+class _ExporterHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self._send(404, 'Not found, try /metrics\n', 'text/plain')
+            return
+        try:
+            text = self.server.exporter.metrics()
+        except Exception as e:
+            self.server.exporter.ctx.vtraceback()
+            self._send(500, str(e) + '\n', 'text/plain')
+            return
+        self._send(200, text, CONTENT_TYPE)
+
+    def _send(self, status, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.exporter.ctx.vlog(format, *args)
+
+
+class _ExporterServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(exporter, host, port, on_start=None):
+    """Serves exporter's metrics on http://host:port/metrics until
+    interrupted. on_start is called with the bound (host, port)."""
+    server = _ExporterServer((host, port), _ExporterHandler)
+    server.exporter = exporter
+    if on_start is not None:
+        on_start(server.server_address[:2])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,758 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos Fake Server
+
+An in-process stand-in for the Riak Mesos Framework, Marathon and Mesos
+master HTTP APIs, for testing and benchmarking the CLI without a Mesos
+cluster. All three APIs are served from one port, so a config file with
+framework-url, marathon and master all pointing at it is enough:
+
+    python -m riak_mesos.fake_server --port 18080 --nodes 5 \\
+        --latency 0.05 --error-rate 0.01 --write-config fake.json
+    riak-mesos cluster wait-for-service default --config fake.json
+
+Nodes become started --start-delay seconds after they are added or
+restarted, and hand off partitions for --transfer-time seconds after that.
+A cluster restart restarts its nodes --restart-interval seconds apart.
+Request counts are served as JSON from /fake/stats, and cleared by
+/fake/reset.
+"""
+
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import click
+from six.moves import BaseHTTPServer, queue, socketserver
+from six.moves.urllib.parse import parse_qs, urlparse
+
+DEFAULT_RIAK_VERSION = 'riak-kv-2-1-4'
+RIAK_VERSIONS = ['riak-kv-2-1-4', 'riak-ts-1-5-0']
+LOG_FILES = ['console.log', 'error.log', 'crash.log']
+RESOURCES = ['scheduler', 'executor', 'node', 'patches', 'explorer',
+             'director']
+# Partitions a new node reports as waiting to hand off or active
+TRANSFER_PARTITIONS = 8
+
+
+def _dumps(value):
+    # Matches the framework's compact JSON, e.g. {"success":true}
+    return json.dumps(value, separators=(',', ':'))
+
+
+class FakeError(Exception):
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+
+class FakeNode(object):
+    def __init__(self, cluster, name, index, now):
+        self.cluster = cluster
+        self.name = name
+        self.node_name = name + '@127.0.0.1'
+        self.http_port = 10000 + index * 2
+        self.pb_port = 10001 + index * 2
+        self.started_at = now
+        self.bucket_types = OrderedDict([('default', {'n_val': 3})])
+
+    def status(self, state, now):
+        # A node restarted later in a rolling restart is still started
+        if self.started_at <= now < self.started_at + state.start_delay:
+            return 'starting'
+        return 'started'
+
+    def transfers(self, state, now):
+        # The partitions hand off one at a time, evenly over transfer_time
+        ready = self.started_at + state.start_delay
+        if ready <= now < ready + state.transfer_time:
+            remaining = int(math.ceil(TRANSFER_PARTITIONS *
+                                      (1 - (now - ready) /
+                                       state.transfer_time)))
+            return {'waiting_to_handoff': [self.node_name] * (remaining - 1),
+                    'active': [self.node_name]}
+        return {'waiting_to_handoff': [], 'active': []}
+
+    def json(self, state, now):
+        return {
+            'name': self.name,
+            'status': self.status(state, now),
+            'location': {
+                'node_name': self.node_name,
+                'hostname': '127.0.0.1',
+                'http_port': self.http_port,
+                'pb_port': self.pb_port
+            }
+        }
+
+    def stats(self, state, now):
+        # Counters grow steadily from when the node started
+        uptime = max(now - self.started_at - state.start_delay, 0)
+        gets = int(uptime * 100)
+        puts = int(uptime * 40)
+        return {
+            'nodename': self.node_name,
+            'node_gets': min(gets, 6000),
+            'node_gets_total': gets,
+            'node_puts': min(puts, 2400),
+            'node_puts_total': puts,
+            'node_get_fsm_time_mean': 1500,
+            'node_get_fsm_time_95': 3000,
+            'node_get_fsm_time_99': 6000,
+            'node_put_fsm_time_mean': 2500,
+            'node_put_fsm_time_95': 5000,
+            'node_put_fsm_time_99': 9000,
+            'read_repairs_total': int(uptime * 2),
+            'handoff_timeouts': 0,
+            'memory_total': 100000000 + gets * 10,
+            'ring_members': [n.node_name for n in
+                             state.clusters[self.cluster].nodes.values()],
+            'riak_kv_version': '2.1.4'
+        }
+
+    def log_lines(self, state, now):
+        count = int(max(now - self.started_at, 0) * state.log_rate)
+        return [time.strftime('%Y-%m-%d %H:%M:%S',
+                              time.gmtime(self.started_at +
+                                          i / float(state.log_rate))) +
+                '.000 [info] <0.%d.0> fake log line %d' % (i, i)
+                for i in range(count)]
+
+
+class FakeCluster(object):
+    def __init__(self, name, riak_version=DEFAULT_RIAK_VERSION):
+        self.name = name
+        self.riak_version = riak_version
+        self.nodes = OrderedDict()
+        self.next_node = 1
+        # riak.conf and advanced.config, by API name
+        self.configs = {}
+
+    def add_node(self, state, now):
+        name = 'riak-' + self.name + '-' + str(self.next_node)
+        self.nodes[name] = FakeNode(self.name, name, len(state.all_nodes()),
+                                    now)
+        self.next_node += 1
+        return self.nodes[name]
+
+
+class FakeApp(object):
+    def __init__(self, app, ports, now):
+        self.app = app
+        self.ports = ports
+        self.added_at = now
+
+    def json(self, state, now):
+        healthy = now >= self.added_at + state.start_delay
+        task = {
+            'id': self.app['id'].strip('/') + '.fake-task-1',
+            'appId': self.app['id'],
+            'host': '127.0.0.1',
+            'ports': self.ports,
+            'state': 'TASK_RUNNING' if healthy else 'TASK_STAGING'
+        }
+        return dict(self.app, tasks=[task], tasksRunning=int(healthy),
+                    tasksHealthy=int(healthy),
+                    instances=self.app.get('instances', 1))
+
+
+class FakeState(object):
+    """Framework, Marathon and master state shared by every request"""
+
+    def __init__(self, framework='riak', clusters=('default',), nodes=3,
+                 start_delay=0, transfer_time=0, restart_interval=0,
+                 log_rate=10, port=0):
+        self.framework = framework
+        self.start_delay = start_delay
+        self.transfer_time = transfer_time
+        self.restart_interval = restart_interval
+        self.log_rate = log_rate
+        self.lock = threading.RLock()
+        self.port = port
+        self.clusters = OrderedDict()
+        self.apps = OrderedDict()
+        self.frameworks = [{'name': framework, 'id': 'fake-framework-0001'}]
+        self.subscribers = []
+        # Existing nodes start out started
+        now = time.time() - start_delay - transfer_time
+        for cluster in clusters:
+            self.clusters[cluster] = FakeCluster(cluster)
+            for i in range(nodes):
+                self.clusters[cluster].add_node(self, now)
+
+    def all_nodes(self):
+        return [node for cluster in self.clusters.values()
+                for node in cluster.nodes.values()]
+
+    def framework_app(self, now):
+        return FakeApp({
+            'id': '/' + self.framework,
+            'instances': 1,
+            'env': {
+                'RIAK_MESOS_NAME': self.framework,
+                'RIAK_MESOS_ZK': '127.0.0.1:2181',
+                'RIAK_MESOS_MASTER': '127.0.0.1:' + str(self.port),
+                'RIAK_MESOS_RESOURCE_URLS': _dumps(self.resources())
+            }
+        }, [self.port], now)
+
+    def resources(self):
+        return dict((r, 'http://127.0.0.1:' + str(self.port) + '/fake/' + r +
+                     '.tar.gz') for r in RESOURCES)
+
+    def publish(self, event_type, event):
+        for subscriber in list(self.subscribers):
+            subscriber.put((event_type, event))
+
+    def cluster(self, name):
+        if name not in self.clusters:
+            raise FakeError(404, 'Cluster ' + name + ' not found')
+        return self.clusters[name]
+
+    def node(self, cluster, name):
+        nodes = self.cluster(cluster).nodes
+        if name not in nodes:
+            raise FakeError(404, 'Node ' + name + ' not found')
+        return nodes[name]
+
+    def node_by_name(self, name):
+        for node in self.all_nodes():
+            if name in (node.name, node.node_name):
+                return node
+        raise FakeError(404, 'Node ' + name + ' not found')
+
+    def app(self, app_id):
+        app_id = '/' + app_id.strip('/')
+        if app_id not in self.apps:
+            raise FakeError(404, _dumps({
+                'message': "App '" + app_id + "' does not exist"}))
+        return self.apps[app_id]
+
+
+SUCCESS = _dumps({'success': True})
+
+
+class FakeApi(object):
+    """Route handlers, each called with (state, now, match, body, query)
+    and returning a (status, body) tuple."""
+
+    def healthcheck(self, state, now, m, body, query):
+        return 200, 'OK'
+
+    def riak_versions(self, state, now, m, body, query):
+        return 200, _dumps({'riak_versions': RIAK_VERSIONS})
+
+    def clusters(self, state, now, m, body, query):
+        return 200, _dumps({'clusters': list(state.clusters)})
+
+    def set_clusters(self, state, now, m, body, query):
+        return 200, SUCCESS
+
+    def cluster(self, state, now, m, body, query):
+        cluster = state.cluster(m.group('cluster'))
+        return 200, _dumps({cluster.name: {
+            'riak_version': cluster.riak_version,
+            'nodes': list(cluster.nodes),
+            'generation': cluster.next_node - 1
+        }})
+
+    def create_cluster(self, state, now, m, body, query):
+        name = m.group('cluster')
+        if name in state.clusters:
+            return 200, _dumps({'success': False, 'error': 'exists'})
+        version = DEFAULT_RIAK_VERSION
+        if body:
+            version = json.loads(body).get('riak_version', version)
+        state.clusters[name] = FakeCluster(name, version)
+        return 200, SUCCESS
+
+    def destroy_cluster(self, state, now, m, body, query):
+        state.cluster(m.group('cluster'))
+        del state.clusters[m.group('cluster')]
+        return 200, SUCCESS
+
+    def restart_cluster(self, state, now, m, body, query):
+        nodes = state.cluster(m.group('cluster')).nodes.values()
+        for i, node in enumerate(nodes):
+            node.started_at = now + i * state.restart_interval
+        return 200, SUCCESS
+
+    def cluster_config(self, state, now, m, body, query):
+        cluster = state.cluster(m.group('cluster'))
+        if m.group('config') not in cluster.configs:
+            raise FakeError(404, 'Not set')
+        return 200, cluster.configs[m.group('config')]
+
+    def set_cluster_config(self, state, now, m, body, query):
+        cluster = state.cluster(m.group('cluster'))
+        cluster.configs[m.group('config')] = body
+        return 200, SUCCESS
+
+    def delete_cluster_config(self, state, now, m, body, query):
+        cluster = state.cluster(m.group('cluster'))
+        if m.group('config') not in cluster.configs:
+            raise FakeError(404, 'Not set')
+        del cluster.configs[m.group('config')]
+        return 200, SUCCESS
+
+    def nodes(self, state, now, m, body, query):
+        cluster = state.cluster(m.group('cluster'))
+        return 200, _dumps({'nodes': list(cluster.nodes)})
+
+    def add_node(self, state, now, m, body, query):
+        state.cluster(m.group('cluster')).add_node(state, now)
+        return 200, SUCCESS
+
+    def node(self, state, now, m, body, query):
+        node = state.node(m.group('cluster'), m.group('node'))
+        return 200, _dumps({node.name: node.json(state, now)})
+
+    def remove_node(self, state, now, m, body, query):
+        state.node(m.group('cluster'), m.group('node'))
+        del state.clusters[m.group('cluster')].nodes[m.group('node')]
+        return 200, SUCCESS
+
+    def node_status(self, state, now, m, body, query):
+        cluster = state.cluster(m.group('cluster'))
+        state.node(cluster.name, m.group('node'))
+        members = [{'id': n.node_name, 'status': 'valid'}
+                   for n in cluster.nodes.values()
+                   if n.status(state, now) == 'started']
+        return 200, _dumps({'status': {
+            'nodes': members, 'valid': len(members), 'leaving': 0,
+            'exiting': 0, 'joining': 0, 'down': 0}})
+
+    def node_aae(self, state, now, m, body, query):
+        state.node(m.group('cluster'), m.group('node'))
+        return 200, _dumps({'aae': {}})
+
+    def node_ringready(self, state, now, m, body, query):
+        cluster = state.cluster(m.group('cluster'))
+        state.node(cluster.name, m.group('node'))
+        # Like riak-admin ringready, not ready while any node is down
+        return 200, _dumps({'ringready': {
+            'ready': all(n.status(state, now) == 'started'
+                         for n in cluster.nodes.values()),
+            'nodes': [n.node_name for n in cluster.nodes.values()]}})
+
+    def node_transfers(self, state, now, m, body, query):
+        node = state.node(m.group('cluster'), m.group('node'))
+        return 200, _dumps({'transfers': node.transfers(state, now)})
+
+    def bucket_types(self, state, now, m, body, query):
+        node = state.node(m.group('cluster'), m.group('node'))
+        return 200, _dumps({'bucket_types': [
+            {'id': t, 'props': props}
+            for t, props in node.bucket_types.items()]})
+
+    def set_bucket_type(self, state, now, m, body, query):
+        node = state.node(m.group('cluster'), m.group('node'))
+        props = json.loads(body or '{}')
+        node.bucket_types[m.group('type')] = props.get('props', props)
+        return 200, SUCCESS
+
+    def node_ping(self, state, now, m, body, query):
+        node = state.node_by_name(m.group('node'))
+        if node.status(state, now) != 'started':
+            raise FakeError(503, 'Node ' + node.name + ' is not started')
+        return 200, 'OK'
+
+    def node_stats(self, state, now, m, body, query):
+        node = state.node_by_name(m.group('node'))
+        if node.status(state, now) != 'started':
+            raise FakeError(503, 'Node ' + node.name + ' is not started')
+        return 200, _dumps(node.stats(state, now))
+
+    def log_files(self, state, now, m, body, query):
+        state.cluster(m.group('cluster'))
+        state.node_by_name(m.group('node'))
+        return 200, _dumps({'files': [{'id': f} for f in LOG_FILES]})
+
+    def log_file(self, state, now, m, body, query):
+        state.cluster(m.group('cluster'))
+        node = state.node_by_name(m.group('node'))
+        if m.group('file') not in LOG_FILES:
+            raise FakeError(404, 'Log file ' + m.group('file') +
+                            ' not found')
+        lines = []
+        if m.group('file') == 'console.log':
+            lines = node.log_lines(state, now)
+        rows = int(query.get('rows', ['1000'])[0])
+        return 200, _dumps({'files': {
+            'id': m.group('file'),
+            'total_lines': len(lines),
+            'lines': lines[-rows:] if rows > 0 else []}})
+
+    def marathon_ping(self, state, now, m, body, query):
+        return 200, 'pong'
+
+    def marathon_info(self, state, now, m, body, query):
+        return 200, _dumps({'name': 'marathon', 'version': '1.3.6'})
+
+    def apps(self, state, now, m, body, query):
+        return 200, _dumps({'apps': [a.json(state, now)
+                                     for a in state.apps.values()]})
+
+    def add_app(self, state, now, m, body, query):
+        app = json.loads(body)
+        app['id'] = '/' + app['id'].strip('/')
+        if app['id'] in state.apps:
+            return 409, _dumps({'message': 'An app with id [' + app['id'] +
+                                ' already exists.'})
+        if app['id'] == '/' + state.framework:
+            ports = [state.port]
+        else:
+            ports = [31000 + len(state.apps) * 3 + i for i in range(3)]
+        state.apps[app['id']] = FakeApp(app, ports, now)
+        state.publish('deployment_success', {'appId': app['id']})
+        _schedule_health_event(state, app['id'])
+        return 201, _dumps(app)
+
+    def app(self, state, now, m, body, query):
+        app = state.app(m.group('app'))
+        return 200, _dumps({'app': app.json(state, now)})
+
+    def remove_app(self, state, now, m, body, query):
+        app = state.app(m.group('app'))
+        del state.apps[app.app['id']]
+        state.publish('app_terminated_event', {'appId': app.app['id']})
+        return 200, _dumps({'deploymentId': 'fake-deployment'})
+
+    def app_tasks(self, state, now, m, body, query):
+        app = state.app(m.group('app'))
+        return 200, _dumps({'tasks': app.json(state, now)['tasks']})
+
+    def tasks(self, state, now, m, body, query):
+        return 200, _dumps({'tasks': [t for a in state.apps.values()
+                                      for t in a.json(state, now)['tasks']]})
+
+    def master(self, state, now, m, body, query):
+        return 200, 'OK'
+
+    def master_state(self, state, now, m, body, query):
+        return 200, _dumps({'frameworks': state.frameworks})
+
+    def master_teardown(self, state, now, m, body, query):
+        framework_id = parse_qs(body or '').get('frameworkId', [''])[0]
+        state.frameworks = [f for f in state.frameworks
+                            if f['id'] != framework_id]
+        return 200, ''
+
+
+def _schedule_health_event(state, app_id):
+    def publish():
+        if app_id in state.apps:
+            state.publish('health_status_changed_event',
+                          {'appId': app_id, 'alive': True})
+    timer = threading.Timer(state.start_delay, publish)
+    timer.daemon = True
+    timer.start()
+
+
+_CLUSTER = r'^/api/v1/clusters/(?P<cluster>[^/]+)'
+_NODE = _CLUSTER + r'/nodes/(?P<node>[^/]+)'
+_CONFIG = r'/(?P<config>config|advancedConfig)$'
+_EXPLORE_NODE = r'^/explore/clusters/(?P<cluster>[^/]+)/nodes/(?P<node>[^/]+)'
+
+_ROUTES = [
+    ('GET', r'^/healthcheck$', 'healthcheck'),
+    ('GET', r'^/api/v1/riak/versions$', 'riak_versions'),
+    ('GET', r'^/api/v1/clusters$', 'clusters'),
+    ('PUT', r'^/api/v1/clusters$', 'set_clusters'),
+    ('GET', _CLUSTER + r'$', 'cluster'),
+    ('DELETE', _CLUSTER + r'$', 'destroy_cluster'),
+    ('POST', _CLUSTER + r'/create$', 'create_cluster'),
+    ('POST', _CLUSTER + r'/restart$', 'restart_cluster'),
+    ('GET', _CLUSTER + _CONFIG, 'cluster_config'),
+    ('PUT', _CLUSTER + _CONFIG, 'set_cluster_config'),
+    ('DELETE', _CLUSTER + _CONFIG, 'delete_cluster_config'),
+    ('GET', _CLUSTER + r'/nodes$', 'nodes'),
+    ('POST', _CLUSTER + r'/nodes$', 'add_node'),
+    ('GET', _NODE + r'$', 'node'),
+    ('DELETE', _NODE + r'$', 'remove_node'),
+    ('GET', _NODE + r'/status$', 'node_status'),
+    ('GET', _NODE + r'/aae$', 'node_aae'),
+    ('GET', _NODE + r'/ringready$', 'node_ringready'),
+    ('GET', _NODE + r'/transfers$', 'node_transfers'),
+    ('GET', _NODE + r'/types$', 'bucket_types'),
+    ('POST', _NODE + r'/types/(?P<type>[^/]+)$', 'set_bucket_type'),
+    ('GET', r'^/riak/nodes/(?P<node>[^/]+)/ping$', 'node_ping'),
+    ('GET', r'^/riak/nodes/(?P<node>[^/]+)/stats$', 'node_stats'),
+    ('GET', _EXPLORE_NODE + r'/log/files$', 'log_files'),
+    ('GET', _EXPLORE_NODE + r'/log/files/(?P<file>[^/]+)$', 'log_file'),
+    ('GET', r'^/ping$', 'marathon_ping'),
+    ('GET', r'^/v2/info$', 'marathon_info'),
+    ('GET', r'^/v2/apps$', 'apps'),
+    ('POST', r'^/v2/apps$', 'add_app'),
+    ('GET', r'^/v2/apps(?P<app>/.+)/tasks$', 'app_tasks'),
+    ('GET', r'^/v2/apps(?P<app>/.+)$', 'app'),
+    ('DELETE', r'^/v2/apps(?P<app>/.+)$', 'remove_app'),
+    ('GET', r'^/v2/tasks$', 'tasks'),
+    ('GET', r'^/$', 'master'),
+    ('GET', r'^/master/state.json$', 'master_state'),
+    ('POST', r'^/master/teardown$', 'master_teardown')
+]
+ROUTES = [(method, re.compile(pattern), handler)
+          for method, pattern, handler in _ROUTES]
+
+
+class _FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, don't let Nagle's algorithm and
+    # delayed ACKs add 40ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        if self.server.fake.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+    def _send(self, status, body, content_type='application/json',
+              headers=None):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        if method == 'GET' and url.path == '/v2/events':
+            return self._events(fake)
+        if url.path == '/fake/stats':
+            return self._send(200, _dumps(fake.stats()))
+        if url.path == '/fake/reset':
+            fake.reset_stats()
+            return self._send(200, SUCCESS)
+        for route_method, pattern, handler in ROUTES:
+            m = pattern.match(url.path)
+            if m is not None and route_method == method:
+                break
+        else:
+            fake.count(method, None)
+            return self._send(404, 'Not found: ' + method + ' ' + url.path,
+                              'text/plain')
+        fake.count(method, handler)
+        delay, fail = fake.inject(url.path)
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            headers = None
+            if fake.retry_after is not None:
+                headers = {'Retry-After': str(fake.retry_after)}
+            return self._send(503, _dumps({'error': 'injected failure'}),
+                              headers=headers)
+        with fake.state.lock:
+            try:
+                status, text = getattr(fake.api, handler)(
+                    fake.state, time.time(), m, body, parse_qs(url.query))
+            except FakeError as e:
+                status, text = e.status, e.body
+        content_type = 'application/json'
+        if not text.startswith(('{', '[')):
+            content_type = 'text/plain'
+        self._send(status, text, content_type)
+
+    def _events(self, fake):
+        """Serves Marathon's /v2/events server sent event stream"""
+        fake.count('GET', 'events')
+        events = queue.Queue()
+        fake.state.subscribers.append(events)
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            # Like Marathon, stream the events as chunks of an endless body
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.flush()
+            while not fake.stopped.is_set():
+                try:
+                    event_type, event = events.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                event = dict(event, eventType=event_type)
+                chunk = ('event: ' + event_type + '\ndata: ' + _dumps(event) +
+                         '\n\n').encode('utf-8')
+                self.wfile.write(('%x\r\n' % len(chunk)).encode('ascii') +
+                                 chunk + b'\r\n')
+                self.wfile.flush()
+        except (IOError, OSError):
+            pass
+        finally:
+            fake.state.subscribers.remove(events)
+            self.close_connection = True
+
+
+class _FakeHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeServer(object):
+    """Serves the fake APIs from a background thread.
+
+    latency is added to every request (plus up to jitter more), and
+    error_rate of the requests whose path matches error_paths get a 503,
+    with a Retry-After header if retry_after is set. The same seed always
+    injects the same sequence of delays and errors."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0,
+                 error_rate=0, error_paths=None, retry_after=None, seed=None,
+                 verbose=False, **state_args):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_paths = re.compile(error_paths) if error_paths else None
+        self.retry_after = retry_after
+        self.verbose = verbose
+        self.api = FakeApi()
+        self.stopped = threading.Event()
+        self._random = random.Random(seed)
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._server = _FakeHTTPServer((host, port), _FakeHandler)
+        self._server.fake = self
+        self.host, self.port = self._server.server_address[:2]
+        self.state = FakeState(port=self.port, **state_args)
+        now = time.time() - self.state.start_delay
+        self.state.apps['/' + self.state.framework] = \
+            self.state.framework_app(now)
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.host + ':' + str(self.port)
+
+    def config(self):
+        """A riak-mesos config file that points everything at this
+        server."""
+        return {'riak': {'framework-name': self.state.framework,
+                         'framework-url': self.address,
+                         'marathon': self.address,
+                         'master': self.address,
+                         'zk': '127.0.0.1:2181'},
+                'resources': self.state.resources()}
+
+    def count(self, method, handler):
+        with self._lock:
+            self._counts[method + ' ' + str(handler)] += 1
+
+    def inject(self, path):
+        """Returns the delay and whether to fail a request for path."""
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = (self.error_rate > 0 and
+                    (self.error_paths is None or
+                     self.error_paths.search(path) is not None) and
+                    self._random.random() < self.error_rate)
+        return delay, fail
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return {'requests': sum(counts.values()), 'routes': counts}
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self.stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', help='Address to listen on.')
+@click.option('--port', type=int, default=0,
+              help='Port to listen on (default is any free port).')
+@click.option('--framework', default='riak', help='Framework name.')
+@click.option('--cluster', 'clusters', multiple=True,
+              help='Cluster to create at startup (repeatable, default is '
+                   '"default").')
+@click.option('--nodes', type=int, default=3,
+              help='Number of started nodes in each cluster.')
+@click.option('--start-delay', type=float, default=0,
+              help='Seconds before new or restarted nodes are started.')
+@click.option('--transfer-time', type=float, default=0,
+              help='Seconds new nodes report transfers for once started.')
+@click.option('--restart-interval', type=float, default=0,
+              help='Seconds between restarting each node of a cluster.')
+@click.option('--log-rate', type=float, default=10,
+              help='Lines per second written to each console.log.')
+@click.option('--latency', type=float, default=0,
+              help='Seconds added to every request.')
+@click.option('--jitter', type=float, default=0,
+              help='Up to this many more seconds added to every request.')
+@click.option('--error-rate', type=float, default=0,
+              help='Fraction of requests that fail with a 503.')
+@click.option('--error-paths',
+              help='Only inject errors into paths matching this regex.')
+@click.option('--retry-after', type=int,
+              help='Retry-After seconds sent with injected errors.')
+@click.option('--seed', type=int, help='Random seed for injected faults.')
+@click.option('--write-config', type=click.File('w'),
+              help='Writes a riak-mesos config file for this server.')
+@click.option('-v', '--verbose', is_flag=True, help='Logs every request.')
+def main(host, port, clusters, write_config, **kwargs):
+    """Runs fake Riak Mesos Framework, Marathon and Mesos master APIs."""
+    server = FakeServer(host, port, clusters=clusters or ('default',),
+                        **kwargs)
+    if write_config is not None:
+        json.dump(server.config(), write_config)
+        write_config.close()
+    click.echo('Serving fake framework, marathon and master APIs on ' +
+               server.address, err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos Node Log Tailing"""
+
+import re
+import time
+
+# Riak's console.log lines start with e.g. 2016-10-18 12:00:00.000
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+TIMESTAMP = re.compile(r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d')
+AGE = re.compile(r'^(\d+(?:\.\d+)?)([smhd])$')
+AGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# Rows asked for per poll once following: enough for twice the last poll's
+# new lines, within these bounds
+MIN_FOLLOW_ROWS = 10
+MAX_FOLLOW_ROWS = 10000
+
+
+def parse_since(value):
+    """Returns the log timestamp (UTC) that --since refers to: either an
+    age such as 30s, 10m, 2h or 1d, or a time such as 2016-10-18 12:00:00.
+    Raises ValueError for anything else."""
+    m = AGE.match(value)
+    if m is not None:
+        seconds = float(m.group(1)) * AGE_UNITS[m.group(2)]
+        return time.strftime(TIMESTAMP_FORMAT,
+                             time.gmtime(time.time() - seconds))
+    value = value.replace('T', ' ')
+    time.strptime(value, TIMESTAMP_FORMAT)
+    return value
+
+
+class LineFilter(object):
+    """Drops lines logged before since, or that don't match the regex
+    pattern. Lines without a timestamp (e.g. the rest of a multi-line
+    report) go with the line before them."""
+
+    def __init__(self, since=None, pattern=None):
+        self.since = since
+        self.pattern = re.compile(pattern) if pattern is not None else None
+        self._recent = since is None
+
+    def match(self, line):
+        if self.since is not None and TIMESTAMP.match(line):
+            self._recent = line[:19] >= self.since
+        if not self._recent:
+            return False
+        return self.pattern is None or self.pattern.search(line) is not None
+
+
+class LogTail(object):
+    """Follows a log file through an API that only returns its last rows
+    lines (plus its total length), asking for no more rows than were
+    likely added since the last poll.
+
+    fetch(rows) returns (total_lines, lines), or None if the file couldn't
+    be read this time."""
+
+    def __init__(self, fetch, rows):
+        self.fetch = fetch
+        self.rows = rows
+        self.total = None
+        self.skipped = 0
+
+    def poll(self):
+        """Returns the lines added since the last poll, or the last rows
+        lines on the first poll."""
+        result = self.fetch(self.rows)
+        if result is None:
+            return []
+        total, lines = result
+        new = self._count_new(total, lines)
+        if new > len(lines) and len(lines) < total:
+            # More was written than was asked for, so ask for all of it
+            result = self.fetch(min(new + MIN_FOLLOW_ROWS, MAX_FOLLOW_ROWS))
+            if result is not None:
+                total, lines = result
+                new = self._count_new(total, lines)
+        if new > len(lines):
+            self.skipped += new - len(lines)
+            new = len(lines)
+        if self.total is None:
+            # The first poll's lines are the backlog, not the logging rate
+            new_rows = MIN_FOLLOW_ROWS
+        else:
+            new_rows = new * 2
+        self.total = total
+        self.rows = min(MAX_FOLLOW_ROWS, max(MIN_FOLLOW_ROWS, new_rows))
+        return lines[len(lines) - new:]
+
+    def _count_new(self, total, lines):
+        if self.total is None:
+            return len(lines)
+        if total < self.total:
+            # Rotated or truncated, so the whole file is new
+            return total
+        return total - self.total
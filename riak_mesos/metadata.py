@@ -0,0 +1,88 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos Framework Zookeeper Metadata"""
+
+from riak_mesos.util import zk_result
+
+# Keeps each multi request well under zookeeper's 1MB jute.maxbuffer
+MAX_TRANSACTION_OPS = 100
+MAX_IN_FLIGHT = 1000
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def walk(zk, root, call_timeout=None):
+    """Lists root and every znode below it as (path, depth, data_length)
+    tuples. The tree is walked a level at a time, with the get_children
+    requests for a whole level pipelined over the session. Each reply is
+    waited on for no longer than call_timeout allows (see
+    util.zk_result)."""
+    from kazoo.exceptions import NoNodeError
+    znodes = []
+    level = [root]
+    depth = 0
+    while len(level) > 0:
+        next_level = []
+        for chunk in _chunks(level, MAX_IN_FLIGHT):
+            pending = [(path, zk.get_children_async(path, include_data=True))
+                       for path in chunk]
+            for path, result in pending:
+                try:
+                    children, stat = zk_result(result, call_timeout,
+                                               'listing ' + path)
+                except NoNodeError:
+                    # Removed while walking
+                    continue
+                znodes.append((path, depth, stat.dataLength))
+                next_level.extend(path.rstrip('/') + '/' + child
+                                  for child in children)
+        level = next_level
+        depth += 1
+    return znodes
+
+
+def purge(zk, znodes, progress=None, call_timeout=None):
+    """Deletes znodes (as returned by walk) deepest first, in multi-op
+    transactions of up to MAX_TRANSACTION_OPS deletes. Zookeeper applies a
+    session's requests in order, so all transactions are sent before
+    waiting on any result. Returns the paths that could not be deleted,
+    including those whose transaction wasn't answered in time."""
+    ordered = [path for path, depth, size in
+               sorted(znodes, key=lambda z: z[1], reverse=True)]
+    pending = []
+    for chunk in _chunks(ordered, MAX_TRANSACTION_OPS):
+        transaction = zk.transaction()
+        for path in chunk:
+            transaction.delete(path)
+        pending.append((chunk, transaction.commit_async()))
+    failed = []
+    for chunk, result in pending:
+        # Outside the try, so that running out of --deadline isn't taken
+        # for a failed transaction
+        timeout = None
+        if call_timeout is not None:
+            timeout = call_timeout(doing='deleting znodes')
+        try:
+            results = result.get(timeout=timeout)
+        except Exception:
+            results = [False]
+        if any(r is not True for r in results):
+            failed.extend(chunk)
+        if progress is not None:
+            progress(len(chunk))
+    return failed
@@ -0,0 +1,131 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos HTTP Retries and Circuit Breaker"""
+
+import random
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+from riak_mesos.util import monotonic
+
+# Retried when the request can safely be sent twice
+IDEMPOTENT_METHODS = frozenset(['DELETE', 'GET', 'HEAD', 'OPTIONS', 'PUT',
+                                'TRACE'])
+# Responses that are worth waiting out, e.g. during scheduler failover
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.25
+MAX_RETRY_BACKOFF = 5.0
+# Retry-After is honored, but a CLI shouldn't sit idle for longer than this
+MAX_RETRY_AFTER = 30.0
+# Consecutive failures before a host's breaker opens (0 disables it), and
+# how long it stays open before a single trial request is let through
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 10.0
+
+
+class RetryPolicy(object):
+    """Decides whether and when to resend a failed request"""
+
+    def __init__(self, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_RETRY_BACKOFF,
+                 max_backoff=MAX_RETRY_BACKOFF):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, method, attempt):
+        return (attempt < self.retries and
+                method.upper() in IDEMPOTENT_METHODS)
+
+    def delay(self, attempt, retry_after=None):
+        """Exponential backoff with jitter, or the server's Retry-After if
+        that is longer."""
+        delay = min(self.max_backoff, self.backoff * (2 ** min(attempt, 16)))
+        delay = random.uniform(delay / 2, delay)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, MAX_RETRY_AFTER))
+        return delay
+
+
+def retry_after(response):
+    """Returns the seconds a response's Retry-After header asks for, which
+    may be given as seconds or an HTTP date, or None."""
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, mktime_tz(date) - time.time())
+
+
+class CircuitBreaker(object):
+    """Tracks one host's consecutive failures. Once threshold is reached the
+    breaker opens and requests are rejected without being sent, until
+    reset_timeout has passed and a trial request succeeds."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD,
+                 reset_timeout=DEFAULT_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN and
+                    monotonic() - self._opened_at >= self.reset_timeout):
+                self.state = self.HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_in(self):
+        """Seconds until the next trial request is let through"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0
+            return max(0, self.reset_timeout -
+                       (monotonic() - self._opened_at))
+
+    def record(self, success):
+        with self._lock:
+            if success:
+                self.failures = 0
+                self.state = self.CLOSED
+                return
+            self.failures += 1
+            if (self.state == self.HALF_OPEN or
+                    (self.state == self.CLOSED and
+                     self.failures >= self.threshold)):
+                self.state = self.OPEN
+                self.opened += 1
+                self._opened_at = monotonic()
@@ -0,0 +1,269 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos Pooled HTTP Session"""
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import (HTTPConnectionPool,
+                                                      HTTPSConnectionPool)
+from six.moves.urllib.parse import urlparse
+
+from riak_mesos.constants import DEFAULT_POOL_SIZE
+from riak_mesos.retry import (DEFAULT_BREAKER_RESET, RETRY_STATUSES,
+                              CircuitBreaker, RetryPolicy, retry_after)
+from riak_mesos.trace import NULL_SPAN
+from riak_mesos.util import clamp_timeout, monotonic
+
+
+class HTTPError(Exception):
+    def __init__(self, response):
+        self.response = response
+
+    def __str__(self):
+        return ('Error while fetching [' + self.response.url + ']: HTTP ' +
+                str(self.response.status_code) + ': ' +
+                str(self.response.reason))
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request to a host whose circuit breaker
+    is open"""
+
+    def __init__(self, host, retry_in):
+        requests.exceptions.ConnectionError.__init__(
+            self, 'Circuit breaker for ' + host + ' is open after repeated '
+            'failures, retrying in ' + ('%.1f' % retry_in) + 's')
+        self.host = host
+
+
+class RiakMesosSession(object):
+    """Wraps a requests.Session so that every request made by a Context
+    reuses the same connection pool (and TLS session) per host.
+
+    Requests with idempotent methods that fail to connect, time out or get a
+    retryable status are retried according to retry, and each host gets a
+    CircuitBreaker (unless breaker_threshold is 0) so that a long fan-out
+    stops sending requests to a host that keeps failing."""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, keep_alive=True,
+                 tracer=None, retry=None, breaker_threshold=0,
+                 breaker_reset=DEFAULT_BREAKER_RESET, log=None):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.tracer = tracer
+        self.retry = retry if retry is not None else RetryPolicy(0)
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.log = log
+        self._breakers = {}
+        self._retries = {}
+        self._adapter = self._new_adapter()
+        self._session = requests.Session()
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+        if not keep_alive:
+            self._session.headers['Connection'] = 'close'
+        # Authorization headers obtained through the DCOS auth flow, by host
+        self._auth = {}
+        self._lock = threading.Lock()
+
+    def resize(self, pool_size):
+        """Swaps in a larger connection pool, e.g. when a later shell / batch
+        command asks for more --concurrency than the first one did."""
+        if pool_size <= self.pool_size:
+            return
+        old_adapter = self._adapter
+        self.pool_size = pool_size
+        self._adapter = self._new_adapter()
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+        old_adapter.close()
+
+    def _new_adapter(self):
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size)
+        if self.tracer is not None:
+            adapter.poolmanager.pool_classes_by_scheme = {
+                'http': _traced_pool(HTTPConnectionPool, self.tracer),
+                'https': _traced_pool(HTTPSConnectionPool, self.tracer)
+            }
+        return adapter
+
+    def request(self, method, url, is_success=None, retry=None,
+                deadline=None, proxied=False, **kwargs):
+        """Sends a request, retrying it according to retry if given, or
+        else the session's RetryPolicy. If deadline (monotonic) is given,
+        each attempt's timeout is cut down to the time left, and a retry
+        that couldn't be sent before it isn't attempted.
+
+        proxied means the host passes on another server's response (e.g.
+        the framework's riak/nodes/<node>/ping), so its status says nothing
+        about the host: it is neither retried nor counted by the host's
+        breaker. Connection errors and timeouts still are."""
+        if retry is None:
+            retry = self.retry
+        host = urlparse(url).netloc
+        breaker = self._breaker(host)
+        timeout = kwargs.pop('timeout', None)
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(host, breaker.retry_in())
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - monotonic()
+            try:
+                r = self._traced_request(
+                    method, url, attempt,
+                    timeout=clamp_timeout(timeout, remaining), **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                if breaker is not None:
+                    breaker.record(False)
+                delay = retry.delay(attempt)
+                if not self._should_retry(retry, method, attempt, delay,
+                                          deadline):
+                    raise
+                reason = str(e)
+            else:
+                if breaker is not None:
+                    breaker.record(proxied or r.status_code < 500)
+                if proxied or r.status_code not in RETRY_STATUSES:
+                    break
+                delay = retry.delay(attempt, retry_after(r))
+                if not self._should_retry(retry, method, attempt, delay,
+                                          deadline):
+                    break
+                reason = 'HTTP ' + str(r.status_code)
+                r.close()
+            with self._lock:
+                self._retries[host] = self._retries.get(host, 0) + 1
+            if self.log is not None:
+                self.log('Retrying ' + method.upper() + ' ' + url + ' in ' +
+                         ('%.2f' % delay) + 's (' + reason + ')')
+            span = NULL_SPAN
+            if self.tracer is not None:
+                span = self.tracer.span('retry sleep', 'wait', url=url,
+                                        attempt=attempt)
+            with span:
+                time.sleep(delay)
+            attempt += 1
+        if is_success is not None and not is_success(r.status_code):
+            raise HTTPError(r)
+        return r
+
+    def _should_retry(self, retry, method, attempt, delay, deadline):
+        return (retry.should_retry(method, attempt) and
+                (deadline is None or monotonic() + delay < deadline))
+
+    def _breaker(self, host):
+        if self.breaker_threshold <= 0:
+            return None
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.breaker_threshold,
+                                                      self.breaker_reset)
+            return self._breakers[host]
+
+    def _traced_request(self, method, url, attempt, **kwargs):
+        span = NULL_SPAN
+        if self.tracer is not None:
+            span = self.tracer.span(method.upper() + ' ' + url, 'http',
+                                    method=method.upper(), url=url,
+                                    attempt=attempt)
+        with span as args:
+            r = self._request(method, url, **kwargs)
+            args['status'] = r.status_code
+            if not kwargs.get('stream'):
+                args['bytes'] = len(r.content)
+        return r
+
+    def _request(self, method, url, **kwargs):
+        if 'headers' not in kwargs:
+            kwargs['headers'] = {'Accept': 'application/json'}
+        host = urlparse(url).netloc
+        with self._lock:
+            auth = self._auth.get(host)
+        if auth is not None:
+            kwargs['headers'] = dict(kwargs['headers'], Authorization=auth)
+        if kwargs.get('verify') is False:
+            requests.packages.urllib3.disable_warnings()
+        r = self._session.request(method, url, **kwargs)
+        if r.status_code == 401:
+            r = self._authenticate(method, url, **kwargs)
+        return r
+
+    def _authenticate(self, method, url, **kwargs):
+        # The DCOS CLI knows how to prompt for / load ACS credentials, so let
+        # it perform the handshake once and reuse the resulting header.
+        from dcos import http
+        r = http.request(method, url, is_success=lambda status: True,
+                         **kwargs)
+        auth = r.request.headers.get('Authorization')
+        if auth is not None:
+            with self._lock:
+                self._auth[urlparse(url).netloc] = auth
+        return r
+
+    def connection_stats(self):
+        """Returns {'host:port': (connections_opened, requests_sent)}"""
+        stats = {}
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            if pool is None:
+                continue
+            name = pool.host + ':' + str(pool.port)
+            opened, sent = stats.get(name, (0, 0))
+            stats[name] = (opened + pool.num_connections,
+                           sent + pool.num_requests)
+        return stats
+
+    def retry_stats(self):
+        """Returns {'host:port': {'retries', 'breaker', 'failures', 'opened',
+        'rejected'}} for every host that was retried or has a breaker"""
+        stats = {}
+        with self._lock:
+            for host, retries in self._retries.items():
+                stats[host] = {'retries': retries}
+            for host, breaker in self._breakers.items():
+                stats.setdefault(host, {'retries': 0}).update({
+                    'breaker': breaker.state,
+                    'failures': breaker.failures,
+                    'opened': breaker.opened,
+                    'rejected': breaker.rejected
+                })
+        return stats
+
+    def close(self):
+        self._session.close()
+
+
+def _traced_pool(pool_cls, tracer):
+    """Returns a pool_cls whose connections record a span for connecting
+    (DNS lookup, TCP and TLS handshakes)."""
+    connection_cls = pool_cls.ConnectionCls
+
+    class TracedConnection(connection_cls):
+        def connect(self):
+            with tracer.span('connect ' + self.host + ':' + str(self.port),
+                             'connect', host=self.host, port=self.port):
+                return connection_cls.connect(self)
+
+    return type('Traced' + pool_cls.__name__, (pool_cls,),
+                {'ConnectionCls': TracedConnection})
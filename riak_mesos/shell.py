@@ -0,0 +1,75 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos Shell / Batch Mode"""
+
+import shlex
+
+import click
+
+from riak_mesos.cli import cli
+from riak_mesos.trace import span
+from riak_mesos.util import monotonic
+
+NESTED_COMMANDS = ['batch', 'shell']
+
+
+def parse_command(line):
+    """Splits a command line into arguments, dropping a leading riak-mesos
+    (or dcos riak) and any # comment."""
+    args = shlex.split(line, comments=True)
+    if len(args) > 0 and args[0] == 'dcos':
+        args = args[1:]
+    if len(args) > 0 and args[0] in ['riak-mesos', 'riak']:
+        args = args[1:]
+    return args
+
+
+def run_command(ctx, line):
+    """Runs one riak-mesos command line in this process with the shared ctx,
+    so the config, discovered URLs and HTTP pool are reused. Returns a
+    (success, seconds) tuple, or None for a blank line."""
+    try:
+        args = parse_command(line)
+    except ValueError as e:
+        ctx.log('Error: ' + str(e))
+        return False, 0
+    if len(args) == 0:
+        return None
+    if args[0] in NESTED_COMMANDS:
+        ctx.log('Error: ' + args[0] + ' can\'t be run from shell or batch.')
+        return False, 0
+    ctx.reset_args()
+    success = True
+    start = monotonic()
+    try:
+        with span(ctx, 'riak-mesos ' + ' '.join(args), 'command'):
+            cli.main(args=args, prog_name='riak-mesos', obj=ctx,
+                     standalone_mode=False)
+    except click.ClickException as e:
+        e.show()
+        success = False
+    except click.Abort:
+        ctx.log('Aborted!')
+        success = False
+    except SystemExit as e:
+        success = e.code in [None, 0]
+    except Exception as e:
+        ctx.log('Error: ' + str(e))
+        ctx.vtraceback()
+        success = False
+    elapsed = monotonic() - start
+    ctx.log('[%.3fs] %s%s' % (elapsed, ' '.join(args),
+                              '' if success else ' (failed)'))
+    return success, elapsed
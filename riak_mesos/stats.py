@@ -0,0 +1,171 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos Node Stats Sampling"""
+
+import math
+from array import array
+from collections import OrderedDict
+
+# (column, riak stat, kind): counters are shown as per second rates, gauges
+# (latencies are in microseconds) as sampled and megabytes converted from
+# bytes
+FIELDS = [
+    ('gets/s', 'node_gets_total', 'counter'),
+    ('puts/s', 'node_puts_total', 'counter'),
+    ('get_mean', 'node_get_fsm_time_mean', 'gauge'),
+    ('get_99', 'node_get_fsm_time_99', 'gauge'),
+    ('put_mean', 'node_put_fsm_time_mean', 'gauge'),
+    ('put_99', 'node_put_fsm_time_99', 'gauge'),
+    ('repairs/s', 'read_repairs_total', 'counter'),
+    ('handoff_timeouts/s', 'handoff_timeouts', 'counter'),
+    ('memory_mb', 'memory_total', 'megabytes')
+]
+NAN = float('nan')
+DEFAULT_HISTORY = 720
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def _rate(v0, v1, t0, t1):
+    # A counter that went backwards was reset by a restart
+    if math.isnan(v0) or math.isnan(v1) or v1 < v0 or t1 <= t0:
+        return None
+    return (v1 - v0) / (t1 - t0)
+
+
+class StatsHistory(object):
+    """Keeps the last capacity samples of FIELDS for each node in one flat
+    array of doubles per node (a timestamp then one value per field), so
+    memory stays fixed however long a cluster is watched."""
+
+    def __init__(self, capacity=DEFAULT_HISTORY, fields=FIELDS):
+        self.capacity = max(capacity, 2)
+        self.fields = fields
+        self.width = len(fields) + 1
+        self._samples = OrderedDict()
+        self._count = {}
+
+    def add(self, node, timestamp, stats):
+        if node not in self._samples:
+            self._samples[node] = array(
+                'd', [NAN]) * (self.capacity * self.width)
+            self._count[node] = 0
+        samples = self._samples[node]
+        start = (self._count[node] % self.capacity) * self.width
+        samples[start] = timestamp
+        for i, (column, stat, kind) in enumerate(self.fields):
+            samples[start + i + 1] = _number(stats.get(stat))
+        self._count[node] += 1
+
+    def nodes(self):
+        return list(self._samples)
+
+    def remove(self, node):
+        self._samples.pop(node, None)
+        self._count.pop(node, None)
+
+    def _sample(self, node, age):
+        """Returns the sample age samples before the latest one"""
+        start = ((self._count[node] - 1 - age) % self.capacity) * self.width
+        return self._samples[node][start:start + self.width]
+
+    def sample_count(self, node):
+        return min(self._count.get(node, 0), self.capacity)
+
+    def latest(self, node, window=1):
+        """Returns an OrderedDict of column to value for node's latest
+        sample. Counters are the rate over the last window samples (the
+        whole history if window is None), and None until there are two
+        samples."""
+        row = OrderedDict()
+        count = self.sample_count(node)
+        if count == 0:
+            return row
+        if window is None:
+            window = count - 1
+        last = self._sample(node, 0)
+        first = self._sample(node, min(window, count - 1))
+        for i, (column, stat, kind) in enumerate(self.fields):
+            if kind == 'counter':
+                value = _rate(first[i + 1], last[i + 1], first[0], last[0])
+            elif math.isnan(last[i + 1]):
+                value = None
+            elif kind == 'megabytes':
+                value = last[i + 1] / (1024 * 1024)
+            else:
+                value = last[i + 1]
+            row[column] = value
+        return row
+
+    def window(self, node):
+        """Seconds between node's oldest and latest samples"""
+        count = self.sample_count(node)
+        if count < 2:
+            return 0
+        return self._sample(node, 0)[0] - self._sample(node, count - 1)[0]
+
+
+def format_table(history, nodes, errors=None):
+    """Returns the lines of a table with the latest sample of each of
+    nodes (or its error), and total rows with the cluster's rates over the
+    last sample and over the whole history."""
+    columns = [column for column, stat, kind in history.fields]
+    counters = [column for column, stat, kind in history.fields
+                if kind == 'counter']
+    widths = [max(len(node) for node in list(nodes) + ['total (avg)'])]
+    widths += [max(len(column), 8) for column in columns]
+    lines = [_row(['node'] + columns, widths)]
+    total = dict((column, 0) for column in counters)
+    average = dict((column, 0) for column in counters)
+    for node in nodes:
+        if errors is not None and node in errors:
+            lines.append(_row([node, 'error: ' + str(errors[node])],
+                              widths[:2]))
+            continue
+        row = history.latest(node)
+        lines.append(_row([node] + [row.get(column) for column in columns],
+                          widths))
+        window = history.latest(node, None)
+        for column in counters:
+            total[column] = _add(total[column], row.get(column))
+            average[column] = _add(average[column], window.get(column))
+    lines.append(_row(['total'] + [total.get(column) for column in columns],
+                      widths))
+    lines.append(_row(['total (avg)'] +
+                      [average.get(column) for column in columns], widths))
+    return lines
+
+
+def _add(total, value):
+    if total is None or value is None:
+        return None
+    return total + value
+
+
+def _row(values, widths):
+    cells = []
+    for i, (value, width) in enumerate(zip(values, widths)):
+        if value is None:
+            value = '-'
+        elif isinstance(value, float):
+            value = '%.1f' % value
+        cells.append(str(value).ljust(width) if i == 0
+                     else str(value).rjust(width))
+    return '  '.join(cells)
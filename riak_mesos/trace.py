@@ -0,0 +1,112 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos Command Tracing
+
+Records spans (HTTP requests, connection set up, wait loop iterations,
+service discovery) and writes them in Chrome's trace event format, which can
+be loaded in chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import json
+import os
+import threading
+import time
+
+# The same clock as riak_mesos.util.monotonic, which can't be imported here
+# because util itself records spans
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class _Span(object):
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = monotonic()
+        return self.args
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self.args['error'] = repr(exc_value)
+        self.tracer.add(self.name, self.cat, self.start, monotonic(),
+                        self.args)
+        return False
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+    """Collects complete ('X') trace events from any thread"""
+
+    def __init__(self):
+        self.events = []
+        self._start = monotonic()
+        self._pid = os.getpid()
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, cat, **args):
+        """Returns a context manager that records name from when it is
+        entered until it exits. It yields the span's args dict, so details
+        only known at the end (a status code, a size) can be added."""
+        return _Span(self, name, cat, args)
+
+    def add(self, name, cat, start, end, args):
+        thread = threading.current_thread()
+        with self._lock:
+            if thread.ident not in self._threads:
+                self._threads[thread.ident] = (len(self._threads) + 1,
+                                               thread.name)
+            tid = self._threads[thread.ident][0]
+            self.events.append({
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': int((start - self._start) * 1000000),
+                'dur': int((end - start) * 1000000),
+                'pid': self._pid,
+                'tid': tid,
+                'args': args
+            })
+
+    def write(self, trace_file):
+        with self._lock:
+            events = [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid,
+                       'tid': tid, 'args': {'name': name}}
+                      for tid, name in self._threads.values()]
+            events.extend(self.events)
+        with open(trace_file, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def span(ctx, name, cat, **args):
+    """Returns ctx's tracer span, or a no-op one when tracing is off"""
+    tracer = getattr(ctx, 'tracer', None)
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.span(name, cat, **args)
@@ -0,0 +1,83 @@
+#
+#    Copyright (C) 2016 Basho Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Riak Mesos Cluster Transfers Progress"""
+
+from collections import deque
+
+# Seconds of samples the drain rate is measured over, so the estimate
+# follows the current rate rather than the average since the start
+DEFAULT_RATE_WINDOW = 120
+
+
+def count_transfers(transfers_json):
+    """Returns the (waiting, active) counts from a node's transfers
+    response"""
+    transfers = transfers_json['transfers']
+    return (len(transfers['waiting_to_handoff']),
+            len(transfers['active']))
+
+
+class DrainEstimate(object):
+    """Estimates when the remaining transfers will reach zero from how fast
+    they have been going down. Samples older than window seconds are
+    dropped, and the estimate starts over when the remaining count goes up
+    (e.g. another node joined and more handoffs were queued)."""
+
+    def __init__(self, window=DEFAULT_RATE_WINDOW):
+        self.window = window
+        self._samples = deque()
+
+    def add(self, timestamp, remaining):
+        if len(self._samples) > 0 and remaining > self._samples[-1][1]:
+            self._samples.clear()
+        self._samples.append((timestamp, remaining))
+        while (len(self._samples) > 2 and
+               timestamp - self._samples[1][0] >= self.window):
+            self._samples.popleft()
+
+    def rate(self):
+        """Transfers completed per second, or None until some have"""
+        if len(self._samples) < 2:
+            return None
+        (t0, v0), (t1, v1) = self._samples[0], self._samples[-1]
+        if v1 >= v0 or t1 <= t0:
+            return None
+        return float(v0 - v1) / (t1 - t0)
+
+    def eta(self):
+        """Seconds until no transfers remain, or None if unknown"""
+        if len(self._samples) == 0:
+            return None
+        remaining = self._samples[-1][1]
+        if remaining == 0:
+            return 0
+        rate = self.rate()
+        if rate is None:
+            return None
+        return remaining / rate
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return 'unknown'
+    if 0 < seconds < 1:
+        return '<1s'
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return str(seconds) + 's'
+    if seconds < 3600:
+        return str(seconds // 60) + 'm' + str(seconds % 60).zfill(2) + 's'
+    return (str(seconds // 3600) + 'h' +
+            str(seconds % 3600 // 60).zfill(2) + 'm')
@@ -16,25 +16,291 @@
 # limitations under the License.
 
 import json
+import random
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import click
+from six.moves import queue
 
+from riak_mesos.trace import span
+from riak_mesos.transfers import (DrainEstimate, count_transfers,
+                                  format_duration)
 
-def wait_for_node(ctx, node):
-    timeout = ctx.timeout
-    while timeout >= 0:
-        if timeout == 0:
-            click.echo('Node ' + node + ' did not respond in ' +
-                       str(ctx.timeout) + ' seconds.')
+# time.monotonic is not available on Python 2
+monotonic = getattr(time, 'monotonic', time.time)
+
+DEFAULT_POLL_MIN_INTERVAL = 0.5
+DEFAULT_POLL_MAX_INTERVAL = 5.0
+# Re-check now and then in case a ZooKeeper watch is lost on reconnect
+WATCH_RECHECK_INTERVAL = 30
+# What a node has to pass to count as healthy after a restart
+HEALTH_PROBES = ['ping', 'status', 'ringready', 'transfers']
+# The probes that show a node itself has gone down. ringready and transfers
+# cover the whole cluster, so they fail on every node while any one of them
+# restarts, and only gate a node coming back.
+DOWN_PROBES = ['ping', 'status']
+
+
+class DeadlineExceeded(click.ClickException):
+    """Raised once a command has used up its --deadline"""
+
+    def __init__(self, seconds, doing=None):
+        message = 'Deadline of ' + str(seconds) + 's exceeded'
+        if doing is not None:
+            message += ' while ' + doing
+        click.ClickException.__init__(self, message)
+
+
+def deadline(ctx):
+    """Returns when a wait should give up: after --timeout, or when the
+    command's --deadline passes if that is sooner"""
+    until = monotonic() + ctx.timeout
+    if ctx.deadline_at is not None:
+        until = min(until, ctx.deadline_at)
+    return until
+
+
+def clamp_timeout(timeout, remaining):
+    """Cuts a requests style timeout (seconds, a (connect, read) tuple or
+    None for no timeout) down to remaining seconds, unless remaining is
+    None"""
+    if remaining is None:
+        return timeout
+    remaining = max(remaining, 0.001)
+    if timeout is None:
+        return remaining
+    if isinstance(timeout, tuple):
+        return tuple(min(t, remaining) if t is not None else remaining
+                     for t in timeout)
+    return min(timeout, remaining)
+
+
+def poll(ctx, check, until):
+    """Calls check() until it reports done or the monotonic deadline until
+    passes. check returns a (done, state) tuple. The first check runs
+    immediately; after that the delay doubles from ctx.poll_min_interval up
+    to ctx.poll_max_interval (with jitter), and resets to the minimum
+    whenever state changes, so progress is followed closely while a stalled
+    wait backs off. Returns True if check reported done in time."""
+    attempt = 0
+    last_state = None
+    iteration = 0
+    while True:
+        with span(ctx, 'poll check', 'wait', iteration=iteration) as args:
+            done, state = check()
+            args['done'] = done
+            args['state'] = repr(state)
+        if done:
+            return True
+        if state != last_state:
+            attempt = 0
+        last_state = state
+        remaining = until - monotonic()
+        if remaining <= 0:
+            return False
+        delay = min(ctx.poll_max_interval,
+                    ctx.poll_min_interval * (2 ** min(attempt, 16)))
+        delay = random.uniform(max(ctx.poll_min_interval, delay / 2), delay)
+        with span(ctx, 'poll sleep', 'wait', iteration=iteration):
+            time.sleep(min(delay, remaining))
+        attempt += 1
+        iteration += 1
+
+
+def zk_metadata_path(ctx):
+    return '/riak/frameworks/' + ctx.framework
+
+
+def zk_result(async_result, call_timeout=None, doing=None):
+    """Waits for a kazoo async result. call_timeout(doing=...) returns how
+    long a reply may take, e.g. Context.call_timeout, which also raises
+    DeadlineExceeded once --deadline has passed."""
+    if call_timeout is None:
+        return async_result.get()
+    return async_result.get(timeout=call_timeout(doing=doing))
+
+
+def watch_tree(zk, path, watcher, depth, call_timeout=None):
+    """Sets data (or creation) watches on path and, up to depth levels
+    below it, child and data watches on every znode."""
+    doing = 'watching ' + path
+    try:
+        if (zk_result(zk.exists_async(path, watch=watcher), call_timeout,
+                      doing) is None or depth == 0):
             return
+        children = zk_result(zk.get_children_async(path, watch=watcher),
+                             call_timeout, doing)
+    except DeadlineExceeded:
+        raise
+    except Exception:
+        # Deleted while walking, the parent's child watch covers it, or
+        # zookeeper didn't answer in time and the recheck interval does
+        return
+    for child in children:
+        watch_tree(zk, path + '/' + child, watcher, depth - 1, call_timeout)
+
+
+def watch(ctx, check, until):
+    """Like poll, but instead of sleeping between checks it blocks until
+    ZooKeeper reports a change under the framework metadata tree, so the
+    scheduler's HTTP API is only queried when something has changed. Falls
+    back to poll if ZooKeeper can't be reached."""
+    try:
+        zk = ctx.zk_client()
+    except Exception as e:
+        ctx.vlog('Unable to watch zookeeper, polling instead: ' + str(e))
+        return poll(ctx, check, until)
+    changed = threading.Event()
+    path = zk_metadata_path(ctx)
+
+    def watcher(event):
+        changed.set()
+
+    iteration = 0
+    while True:
+        changed.clear()
+        with span(ctx, 'watch check', 'wait', iteration=iteration) as args:
+            # Arm the watches before checking so no change can be missed
+            watch_tree(zk, path, watcher, 2, ctx.call_timeout)
+            done, state = check()
+            args['done'] = done
+            args['state'] = repr(state)
+        if done:
+            return True
+        remaining = until - monotonic()
+        if remaining <= 0:
+            return False
+        with span(ctx, 'watch wait', 'wait', iteration=iteration) as args:
+            changed.wait(min(remaining, WATCH_RECHECK_INTERVAL))
+            args['changed'] = changed.is_set()
+        iteration += 1
+        if changed.is_set():
+            ctx.vlog('Framework metadata changed under ' + path)
+
+
+def wait(ctx, check, until):
+    """Waits for check using zookeeper watches if ctx.zk_watch is set,
+    otherwise by polling. Raises DeadlineExceeded if it gave up because the
+    command's --deadline passed."""
+    if ctx.zk_watch:
+        done = watch(ctx, check, until)
+    else:
+        done = poll(ctx, check, until)
+    if (not done and ctx.deadline_at is not None and
+            monotonic() >= ctx.deadline_at):
+        raise DeadlineExceeded(ctx.deadline, 'waiting')
+    return done
+
+
+def map_concurrently(ctx, fn, items):
+    """Calls fn(ctx, item) for every item on a pool of at most
+    ctx.concurrency threads. Returns a list of (item, result, error) tuples
+    in the same order as items; an exception raised for one item is
+    returned as its error instead of discarding the other results, except
+    DeadlineExceeded, which is raised once --deadline has passed."""
+    results = []
+    if len(items) == 0:
+        return results
+    workers = max(1, min(ctx.concurrency, len(items)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fn, ctx, item) for item in items]
+        for item, future in zip(items, futures):
+            try:
+                results.append((item, future.result(), None))
+            except DeadlineExceeded:
+                for pending in futures:
+                    pending.cancel()
+                raise
+            except Exception as e:
+                ctx.vlog('Request for ' + str(item) + ' failed: ' + str(e))
+                results.append((item, None, e))
+    return results
+
+
+def race(ctx, fn, items):
+    """Calls fn(ctx, item) for every item at once and returns (item, result)
+    for the first call to return something other than None, or (None, None)
+    if none do. The calls that lose are abandoned rather than waited for:
+    they run on daemon threads and their results are ignored."""
+    if len(items) == 1:
+        return items[0], fn(ctx, items[0])
+    results = queue.Queue()
+
+    def run(item):
+        try:
+            result = fn(ctx, item)
+        except Exception as e:
+            ctx.vlog(str(item) + ' failed: ' + str(e))
+            result = None
+        results.put((item, result))
+
+    for item in items:
+        thread = threading.Thread(target=run, args=(item,))
+        thread.daemon = True
+        thread.start()
+    for _ in items:
+        item, result = results.get()
+        if result is not None:
+            return item, result
+    return None, None
+
+
+def wait_for_node(ctx, node, until=None):
+    def check():
         node_data = node_info(ctx, node)
-        if node_data['alive'] and node_data['status'] == 'started':
-            click.echo('Node ' + node + ' is ready.')
-            return
-        time.sleep(1)
-        timeout = timeout - 1
-    return
+        done = node_data['alive'] and node_data['status'] == 'started'
+        return done, (node_data['alive'], node_data['status'])
+
+    if wait(ctx, check, until or deadline(ctx)):
+        click.echo('Node ' + node + ' is ready.')
+        return True
+    click.echo('Node ' + node + ' did not respond in ' +
+               str(ctx.timeout) + ' seconds.')
+    return False
+
+
+def wait_for_nodes(ctx, nodes, num_nodes):
+    """Polls all nodes at the same time until every node is started and at
+    least num_nodes are valid cluster members. ctx.timeout is a single
+    deadline shared by all nodes, not a per node allowance."""
+    until = deadline(ctx)
+    if len(wait_for_nodes_started(ctx, nodes, until)) > 0:
+        return False
+    if len(nodes) < num_nodes:
+        return True
+    return wait_for_node_status_valid(ctx, nodes[0], num_nodes, until)
+
+
+def wait_for_nodes_started(ctx, nodes, until=None):
+    """Polls all nodes at the same time until every node is started.
+    Returns the nodes that didn't start in time."""
+    pending = list(nodes)
+    workers = max(1, min(ctx.concurrency, len(pending)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def check():
+            futures = dict((executor.submit(node_info, ctx, node), node)
+                           for node in pending)
+            for future in as_completed(futures):
+                node = futures[future]
+                try:
+                    node_data = future.result()
+                except Exception as e:
+                    ctx.vlog('Unable to get info for node ' + node + ': ' +
+                             str(e))
+                    continue
+                if node_data['alive'] and node_data['status'] == 'started':
+                    click.echo('Node ' + node + ' is ready.')
+                    pending.remove(node)
+            return len(pending) == 0, len(pending)
+
+        if not wait(ctx, check, until or deadline(ctx)):
+            for node in pending:
+                click.echo('Node ' + node + ' did not respond in ' +
+                           str(ctx.timeout) + ' seconds.')
+    return pending
 
 
 def node_info(ctx, node):
@@ -48,9 +314,7 @@ def node_info(ctx, node):
     pb_port = str(node_json[node]['location']['pb_port'])
     direct_host = node_json[node]['location']['hostname']
     # mesos_dns_cluster = fw + '-' + cluster + '.' + fw + '.mesos'
-    r = ctx.node_request('get', node, 'ping', False,
-                         headers={'Accept': '*/*'})
-    alive = r.status_code == 200
+    alive = node_ping(ctx, node)
     node_data = {
         'http_direct': direct_host + ':' + http_port,
         # 'http_mesos_dns': mesos_dns_cluster + ':' + http_port,
@@ -62,21 +326,35 @@ def node_info(ctx, node):
     return node_data
 
 
-def wait_for_node_status_valid(ctx, node, num_nodes):
-    timeout = ctx.timeout
-    while timeout >= 0:
-        if timeout == 0:
-            click.echo('Cluster ' + ctx.cluster + ' did not respond with ' +
-                       str(num_nodes) + ' valid nodes in ' +
-                       str(ctx.timeout) + ' seconds.')
-            return
-        status = node_status(ctx, node)
-        if status['status']['valid'] >= num_nodes:
-            click.echo('Cluster ' + ctx.cluster + ' is ready.')
-            return
-        time.sleep(1)
-        timeout = timeout - 1
-    return
+def node_ping(ctx, node):
+    """Returns whether node answers its ping. A node that is down is an
+    answer, and the callers poll, so the ping isn't retried."""
+    from riak_mesos.retry import RetryPolicy
+    r = ctx.node_request('get', node, 'ping', False,
+                         headers={'Accept': '*/*'}, retry=RetryPolicy(0))
+    return r.status_code == 200
+
+
+def node_stats(ctx, node):
+    r = ctx.node_request('get', node, 'stats', headers={'Accept': '*/*'})
+    if r.status_code != 200:
+        ctx.cli_error('Failed to get stats, status_code: ' +
+                      str(r.status_code))
+    return json.loads(r.text)
+
+
+def wait_for_node_status_valid(ctx, node, num_nodes, until=None):
+    def check():
+        valid = node_status(ctx, node)['status']['valid']
+        return valid >= num_nodes, valid
+
+    if wait(ctx, check, until or deadline(ctx)):
+        click.echo('Cluster ' + ctx.cluster + ' is ready.')
+        return True
+    click.echo('Cluster ' + ctx.cluster + ' did not respond with ' +
+               str(num_nodes) + ' valid nodes in ' +
+               str(ctx.timeout) + ' seconds.')
+    return False
 
 
 def node_status(ctx, node):
@@ -86,30 +364,163 @@ def node_status(ctx, node):
     return node_json
 
 
-def wait_for_node_transfers(ctx, node):
-    timeout = ctx.timeout
-    while timeout >= 0:
-        if timeout == 0:
-            click.echo('Node ' + node + ' transfers did not complete in ' +
-                       str(ctx.timeout) + 'seconds.')
-            return
-        r = ctx.api_request('get', 'clusters/' + ctx.cluster +
-                            '/nodes/' + node + '/transfers')
-        node_json = json.loads(r.text)
-        waiting = len(node_json['transfers']['waiting_to_handoff'])
-        active = len(node_json['transfers']['active'])
-        if timeout % 5 == 0 and timeout != ctx.timeout:
-            click.echo(r.text)
-        if waiting == 0 and active == 0:
-            click.echo('Node ' + node + ' transfers complete.')
-            return
-        time.sleep(1)
-        timeout = timeout - 1
-    return
+def node_transfers(ctx, node):
+    r = ctx.api_request('get', 'clusters/' + ctx.cluster +
+                        '/nodes/' + node + '/transfers')
+    if r.status_code != 200:
+        ctx.cli_error('Failed to get transfers, status_code: ' +
+                      str(r.status_code))
+    return json.loads(r.text)
+
+
+def wait_for_node_transfers(ctx, node, until=None):
+    last = []
+
+    def check():
+        node_json = node_transfers(ctx, node)
+        waiting, active = count_transfers(node_json)
+        # Only show the transfers when they have changed since last time
+        if len(last) > 0 and last[-1] != (waiting, active):
+            click.echo(json.dumps(node_json))
+        last.append((waiting, active))
+        return waiting == 0 and active == 0, (waiting, active)
+
+    if wait(ctx, check, until or deadline(ctx)):
+        click.echo('Node ' + node + ' transfers complete.')
+        return True
+    click.echo('Node ' + node + ' transfers did not complete in ' +
+               str(ctx.timeout) + ' seconds.')
+    return False
+
+
+def wait_for_cluster_transfers(ctx, until=None):
+    """Polls every node's transfers at the same time until none are
+    waiting or active on any node, within a single --timeout. Prints the
+    cluster's totals and an estimated time to completion whenever they
+    change."""
+    estimate = DrainEstimate()
+    last = []
+
+    def check():
+        r = ctx.api_request('get', 'clusters/' + ctx.cluster + '/nodes')
+        if r.status_code != 200:
+            ctx.cli_error('Failed to get nodes, status_code: ' +
+                          str(r.status_code))
+        nodes = json.loads(r.text)['nodes']
+        waiting = active = 0
+        failed = []
+        for node, node_json, error in map_concurrently(
+                ctx, node_transfers, nodes):
+            if error is not None:
+                failed.append(node)
+                continue
+            node_waiting, node_active = count_transfers(node_json)
+            waiting += node_waiting
+            active += node_active
+        estimate.add(monotonic(), waiting + active)
+        state = (waiting, active, len(nodes), tuple(failed))
+        if last != [state]:
+            line = (str(waiting) + ' waiting, ' + str(active) +
+                    ' active transfers on ' + str(len(nodes)) + ' nodes')
+            if len(failed) > 0:
+                line += ' (unable to reach ' + ', '.join(failed) + ')'
+            if waiting + active > 0:
+                line += ', ETA ' + format_duration(estimate.eta())
+            click.echo(line)
+        last[:] = [state]
+        done = waiting == 0 and active == 0 and len(failed) == 0
+        return done, state
+
+    if wait(ctx, check, until or deadline(ctx)):
+        click.echo('Cluster ' + ctx.cluster + ' transfers complete.')
+        return True
+    click.echo('Cluster ' + ctx.cluster + ' transfers did not complete in ' +
+               str(ctx.timeout) + ' seconds.')
+    return False
+
+
+def node_health(ctx, node):
+    """Probes node's ping, status (started, according to the framework),
+    ringready and transfers at the same time. Returns the names of the
+    probes that aren't healthy yet, e.g. ['ping', 'status'] while the node
+    is down."""
+    from riak_mesos.retry import RetryPolicy
+    # A failing probe is an answer, the next check will ask again
+    no_retry = RetryPolicy(0)
+
+    def probe(ctx, name):
+        if name == 'ping':
+            return node_ping(ctx, node)
+        path = 'clusters/' + ctx.cluster + '/nodes/' + node
+        if name != 'status':
+            path += '/' + name
+        r = ctx.api_request('get', path, exit_on_failure=False,
+                            retry=no_retry)
+        if r.status_code != 200:
+            return False
+        if name == 'status':
+            return json.loads(r.text)[node]['status'] == 'started'
+        if name == 'ringready':
+            return json.loads(r.text)['ringready']['ready']
+        return count_transfers(json.loads(r.text)) == (0, 0)
+
+    return [name for name, healthy, error
+            in map_concurrently(ctx, probe, HEALTH_PROBES)
+            if error is not None or not healthy]
+
+
+def wait_for_cluster_restart(ctx, nodes, until=None):
+    """Follows a restart of nodes, probing all of them at the same time
+    until each has gone down (a DOWN_PROBES probe failed) and come back
+    with every HEALTH_PROBES probe healthy. The scheduler may restart the
+    nodes one after another, so a node that hasn't gone down yet is still
+    waited for. Prints what each restarting node is waiting for when that
+    changes, and how long each node took from going down to healthy."""
+    start = monotonic()
+    down_at = {}
+    waiting_for = {}
+    restarted = OrderedDict()
+
+    def check():
+        pending = [node for node in nodes if node not in restarted]
+        for node, unhealthy, error in map_concurrently(ctx, node_health,
+                                                       pending):
+            if error is not None:
+                unhealthy = HEALTH_PROBES
+            if node not in down_at:
+                if not any(probe in unhealthy for probe in DOWN_PROBES):
+                    continue
+                down_at[node] = monotonic()
+            if len(unhealthy) > 0:
+                if waiting_for.get(node) != unhealthy:
+                    click.echo('Node ' + node + ' is waiting for ' +
+                               ', '.join(unhealthy) + '.')
+                waiting_for[node] = unhealthy
+            else:
+                restarted[node] = monotonic() - down_at[node]
+                click.echo('Node ' + node + ' restarted in ' +
+                           str(round(restarted[node], 1)) + ' seconds.')
+        state = tuple((node, tuple(waiting_for.get(node, [])))
+                      for node in nodes if node not in restarted)
+        return len(restarted) == len(nodes), state
+
+    if wait(ctx, check, until or deadline(ctx)):
+        click.echo('Cluster ' + ctx.cluster + ' restarted in ' +
+                   str(round(monotonic() - start, 1)) + ' seconds.')
+        return True
+    for node in nodes:
+        if node not in restarted and node not in down_at:
+            click.echo('Node ' + node + ' was not seen restarting in ' +
+                       str(ctx.timeout) + ' seconds.')
+        elif node not in restarted:
+            click.echo('Node ' + node + ' did not become healthy in ' +
+                       str(ctx.timeout) + ' seconds.')
+    return False
 
 
 def get_node_name(ctx, node):
+    # The location of a node never changes, any earlier response will do
     r = ctx.api_request('get', 'clusters/' + ctx.cluster +
-                        '/nodes/' + node)
+                        '/nodes/' + node, max_age=float('inf'))
     node_json = json.loads(r.text)
     return node_json[node]['location']['node_name']
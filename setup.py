@@ -86,7 +86,9 @@ setup(
         'dcos>=0.4.6,<0.4.12',
         'kazoo',
         'click',
-        'futures'
+        'futures',
+        'requests',
+        'six'
     ],
 
     # List additional groups of dependencies here (e.g. development
@@ -0,0 +1,211 @@
+"""Command benchmarks for the riak-mesos CLI against fake clusters.
+
+Each command is run in a fresh process against riak_mesos.fake_server with
+1, 10, 100 and 1000 nodes, recording wall time, the number of requests the
+fake server saw and the process's peak RSS. Results are written to
+BENCHMARK_RESULTS (default benchmark-results.json) and compared with
+baseline.json next to this file.
+
+Only a rise in request counts fails a run. Wall time and peak RSS depend on
+the machine the baseline was recorded on, so they are reported as warnings
+unless BENCHMARK_STRICT=1 is set.
+
+Run directly to print a table, or to refresh the baseline:
+
+    python tests/benchmarks/test_commands.py [--update-baseline]
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import warnings
+
+import pytest
+from six.moves.urllib.request import Request, urlopen
+
+from riak_mesos.fake_server import FakeServer
+from riak_mesos.util import monotonic
+
+SIZES = [1, 10, 100, 1000]
+COMMANDS = [
+    ['cluster', 'endpoints', 'default'],
+    ['cluster', 'wait-for-service', 'default', '--timeout', '120'],
+    ['cluster', 'list'],
+    ['framework', 'teardown'],
+    ['config', 'marathon'],
+    ['director', 'endpoints', 'default']
+]
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'baseline.json')
+MAX_REQUESTS_FACTOR = 1.1
+# Wall time and memory vary between machines, so these only fail a run with
+# BENCHMARK_STRICT=1
+MAX_TIME_FACTOR = 3.0
+TIME_SLACK_SECONDS = 1.0
+MAX_RSS_FACTOR = 1.5
+STRICT = os.environ.get('BENCHMARK_STRICT', '') not in ['', '0']
+
+
+class FakeCluster(object):
+    """A fake server with nodes nodes, and a riak-mesos config and home
+    directory for running commands against it"""
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.server = FakeServer(nodes=nodes).start()
+        self.home = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.home, 'config.json')
+        with open(self.config_file, 'w') as f:
+            json.dump(self.server.config(), f)
+        # Give director endpoints something to find
+        urlopen(Request('http://' + self.server.address + '/v2/apps',
+                        json.dumps({'id': '/riak-default-director'})
+                        .encode('utf-8'),
+                        {'Content-Type': 'application/json'})).read()
+
+    def run(self, command):
+        """Runs riak-mesos command, returning (returncode, output, seconds,
+        max_rss_kb). Every run rediscovers the framework URL, so request
+        counts don't depend on what ran before."""
+        args = (['riak-mesos'] + command +
+                ['--config', self.config_file, '--no-agent',
+                 '--url-cache-ttl', '0'])
+        env = dict(os.environ, HOME=self.home)
+        with tempfile.TemporaryFile() as out:
+            start = monotonic()
+            process = subprocess.Popen(args, stdout=out, stderr=out, env=env)
+            pid, status, usage = os.wait4(process.pid, 0)
+            seconds = monotonic() - start
+            process.returncode = os.WEXITSTATUS(status)
+            out.seek(0)
+            output = out.read().decode('utf-8')
+        max_rss_kb = usage.ru_maxrss
+        if sys.platform == 'darwin':
+            max_rss_kb //= 1024
+        return process.returncode, output, seconds, max_rss_kb
+
+    def benchmark(self, command):
+        self.server.reset_stats()
+        returncode, output, seconds, max_rss_kb = self.run(command)
+        return {
+            'command': ' '.join(command[:2]),
+            'nodes': self.nodes,
+            'returncode': returncode,
+            'seconds': round(seconds, 3),
+            'requests': self.server.stats()['requests'],
+            'max_rss_kb': max_rss_kb,
+            'output': output
+        }
+
+    def close(self):
+        self.server.stop()
+        shutil.rmtree(self.home)
+
+
+def load_baseline():
+    try:
+        with open(BASELINE_FILE) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_results(results, results_file):
+    with open(results_file, 'w') as f:
+        json.dump([dict((k, v) for k, v in r.items() if k != 'output')
+                   for r in results], f, indent=2, sort_keys=True)
+
+
+def _expected(result, baseline):
+    return baseline.get(result['command'], {}).get(str(result['nodes']))
+
+
+def regressions(result, baseline):
+    """Returns a description of each way result makes more requests than
+    baseline"""
+    expected = _expected(result, baseline)
+    if expected is None:
+        return []
+    found = []
+    if result['requests'] > expected['requests'] * MAX_REQUESTS_FACTOR:
+        found.append('%d requests (baseline %d)' %
+                     (result['requests'], expected['requests']))
+    return found
+
+
+def slowdowns(result, baseline):
+    """Returns a description of each way result is slower or uses more
+    memory than baseline"""
+    expected = _expected(result, baseline)
+    if expected is None:
+        return []
+    found = []
+    if result['seconds'] > (expected['seconds'] * MAX_TIME_FACTOR +
+                            TIME_SLACK_SECONDS):
+        found.append('%.3fs (baseline %.3fs)' %
+                     (result['seconds'], expected['seconds']))
+    if result['max_rss_kb'] > expected['max_rss_kb'] * MAX_RSS_FACTOR:
+        found.append('%d KB peak RSS (baseline %d KB)' %
+                     (result['max_rss_kb'], expected['max_rss_kb']))
+    return found
+
+
+RESULTS = []
+
+
+@pytest.fixture(scope='module', params=SIZES)
+def cluster(request):
+    cluster = FakeCluster(request.param)
+    yield cluster
+    cluster.close()
+
+
+@pytest.fixture(scope='module', autouse=True)
+def results_file():
+    yield
+    write_results(RESULTS, os.environ.get('BENCHMARK_RESULTS',
+                                          'benchmark-results.json'))
+
+
+@pytest.mark.skipif(not hasattr(os, 'wait4'), reason='needs os.wait4')
+@pytest.mark.parametrize('command', COMMANDS,
+                         ids=[' '.join(c[:2]) for c in COMMANDS])
+def test_command(cluster, command):
+    result = cluster.benchmark(command)
+    RESULTS.append(result)
+    assert result['returncode'] == 0, result['output']
+    baseline = load_baseline()
+    assert regressions(result, baseline) == []
+    slower = slowdowns(result, baseline)
+    if STRICT:
+        assert slower == []
+    for found in slower:
+        warnings.warn('%s with %d nodes: %s' % (result['command'],
+                                                result['nodes'], found))
+
+
+if __name__ == '__main__':
+    results = []
+    for nodes in SIZES:
+        fake = FakeCluster(nodes)
+        try:
+            for command in COMMANDS:
+                results.append(fake.benchmark(command))
+                print('%-25s %5d nodes %8.3fs %6d requests %8d KB' % (
+                    results[-1]['command'], nodes, results[-1]['seconds'],
+                    results[-1]['requests'], results[-1]['max_rss_kb']))
+        finally:
+            fake.close()
+    write_results(results, os.environ.get('BENCHMARK_RESULTS',
+                                          'benchmark-results.json'))
+    if '--update-baseline' in sys.argv[1:]:
+        baseline = {}
+        for result in results:
+            baseline.setdefault(result['command'], {})[
+                str(result['nodes'])] = dict(
+                    (k, result[k])
+                    for k in ['seconds', 'requests', 'max_rss_kb'])
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
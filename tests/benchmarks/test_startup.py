@@ -0,0 +1,91 @@
+"""Startup time regression benchmark for the riak-mesos CLI.
+
+Run directly for a breakdown of the slowest imports:
+
+    python tests/benchmarks/test_startup.py
+"""
+import glob
+import os
+import subprocess
+import sys
+
+# Only needed once a command talks to DCOS, Marathon, ZooKeeper or HTTP
+DEFERRED_MODULES = ['dcos', 'kazoo', 'requests', 'urllib3']
+# Generous ceiling, the goal is to catch a slow import creeping back in
+MAX_IMPORT_SECONDS = 0.5
+
+# Loaded for every subcommand of their group, e.g. framework config
+COMMAND_MODULES = sorted(
+    os.path.basename(path)[:-3] for path in glob.glob(os.path.join(
+        os.path.dirname(__file__), '..', '..', 'riak_mesos', 'commands',
+        'cmd_*.py')))
+
+MEASURE = '''
+import sys, time
+start = time.time()
+import %s
+print(time.time() - start)
+print(' '.join(sorted(sys.modules)))
+'''
+
+
+def measure_import(module='riak_mesos.cli'):
+    """Returns (seconds, modules) for importing module in a fresh
+    interpreter"""
+    out = subprocess.check_output([sys.executable, '-c', MEASURE % module])
+    seconds, modules = out.decode('utf-8').strip().split('\n')
+    return float(seconds), modules.split(' ')
+
+
+def import_breakdown(module='riak_mesos.cli'):
+    """Returns [(cumulative_us, name)] from -X importtime (Python 3.7+),
+    slowest first"""
+    if sys.version_info < (3, 7):
+        return []
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    times = []
+    for line in stderr.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        times.append((int(fields[1]), fields[2].strip()))
+    return sorted(times, reverse=True)
+
+
+def test_cli_import_defers_heavy_modules():
+    seconds, modules = measure_import()
+    loaded = [m for m in modules if m.split('.')[0] in DEFERRED_MODULES]
+    assert loaded == []
+    for cumulative_us, name in import_breakdown():
+        assert name.split('.')[0] not in DEFERRED_MODULES
+
+
+def test_command_imports_defer_heavy_modules():
+    assert len(COMMAND_MODULES) > 0
+    for command in COMMAND_MODULES:
+        seconds, modules = measure_import('riak_mesos.commands.' +
+                                          command)
+        loaded = [m for m in modules if m.split('.')[0] in DEFERRED_MODULES]
+        assert (command, loaded) == (command, [])
+
+
+def test_cli_import_time():
+    seconds, modules = measure_import()
+    assert seconds < MAX_IMPORT_SECONDS
+
+
+def test_version_does_not_need_dcos():
+    out = subprocess.check_output(
+        [sys.executable, '-c', 'import sys; from riak_mesos.cli import cli; '
+         'sys.argv = ["riak-mesos", "--version"]; cli()'])
+    assert out.startswith(b'Riak Mesos Framework Version')
+
+
+if __name__ == '__main__':
+    seconds, modules = measure_import()
+    print('import riak_mesos.cli: %.1f ms' % (seconds * 1000))
+    for cumulative_us, name in import_breakdown()[:15]:
+        print('%10.1f ms  %s' % (cumulative_us / 1000.0, name))
@@ -0,0 +1,192 @@
+import threading
+from collections import defaultdict, namedtuple
+
+from kazoo.exceptions import NodeExistsError, NoNodeError, NotEmptyError
+
+ZnodeStat = namedtuple('ZnodeStat', ['version', 'dataLength', 'numChildren'])
+WatchedEvent = namedtuple('WatchedEvent', ['type', 'state', 'path'])
+
+
+class FakeAsyncResult(object):
+    def __init__(self, fn, *args):
+        self.value = None
+        self.exception = None
+        try:
+            self.value = fn(*args)
+        except Exception as e:
+            self.exception = e
+
+    def get(self, block=True, timeout=None):
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+
+class FakeTransaction(object):
+    """Applies delete operations in order, all or nothing"""
+
+    def __init__(self, zk):
+        self.zk = zk
+        self.operations = []
+
+    def delete(self, path, version=-1):
+        self.operations.append(path)
+
+    def _commit(self):
+        self.zk.calls['multi'] += 1
+        with self.zk._lock:
+            remaining = set(self.zk._data)
+            for path in self.operations:
+                children = self.zk._children(path)
+                if path not in remaining or \
+                        any(path.rstrip('/') + '/' + c in remaining
+                            for c in children):
+                    return [NotEmptyError(path)] * len(self.operations)
+                remaining.remove(path)
+            for path in self.operations:
+                self.zk.delete(path)
+        return [True] * len(self.operations)
+
+    def commit_async(self):
+        return FakeAsyncResult(self._commit)
+
+    def commit(self):
+        return self._commit()
+
+
+class FakeZooKeeper(object):
+    """In-process stand-in for kazoo.client.KazooClient, supporting the
+    subset of the API used by riak-mesos (including one-shot watches)."""
+
+    def __init__(self, hosts=None):
+        self.hosts = hosts
+        self.connected = False
+        self.calls = defaultdict(int)
+        self._data = {'/': b''}
+        self._versions = {'/': 0}
+        self._data_watches = defaultdict(set)
+        self._child_watches = defaultdict(set)
+        self._lock = threading.RLock()
+
+    def start(self, timeout=15):
+        self.connected = True
+
+    def stop(self):
+        self.connected = False
+
+    def close(self):
+        pass
+
+    def _children(self, path):
+        prefix = path.rstrip('/') + '/'
+        return sorted(p[len(prefix):] for p in self._data
+                      if p.startswith(prefix) and p != prefix and
+                      '/' not in p[len(prefix):])
+
+    def _stat(self, path):
+        return ZnodeStat(self._versions[path], len(self._data[path]),
+                         len(self._children(path)))
+
+    def _fire(self, watches, event_type, path):
+        for watch in watches:
+            watch(WatchedEvent(event_type, 'CONNECTED', path))
+
+    def _parent(self, path):
+        return path.rsplit('/', 1)[0] or '/'
+
+    def exists(self, path, watch=None):
+        self.calls['exists'] += 1
+        with self._lock:
+            if watch is not None:
+                self._data_watches[path].add(watch)
+            if path not in self._data:
+                return None
+            return self._stat(path)
+
+    def get(self, path, watch=None):
+        self.calls['get'] += 1
+        with self._lock:
+            if path not in self._data:
+                raise NoNodeError(path)
+            if watch is not None:
+                self._data_watches[path].add(watch)
+            return self._data[path], self._stat(path)
+
+    def get_children(self, path, watch=None, include_data=False):
+        self.calls['get_children'] += 1
+        with self._lock:
+            if path not in self._data:
+                raise NoNodeError(path)
+            if watch is not None:
+                self._child_watches[path].add(watch)
+            if include_data:
+                return self._children(path), self._stat(path)
+            return self._children(path)
+
+    def exists_async(self, path, watch=None):
+        return FakeAsyncResult(self.exists, path, watch)
+
+    def get_async(self, path, watch=None):
+        return FakeAsyncResult(self.get, path, watch)
+
+    def get_children_async(self, path, watch=None, include_data=False):
+        return FakeAsyncResult(self.get_children, path, watch, include_data)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def create(self, path, value=b'', makepath=False):
+        self.calls['create'] += 1
+        with self._lock:
+            if path in self._data:
+                raise NodeExistsError(path)
+            parent = self._parent(path)
+            if parent not in self._data:
+                if not makepath:
+                    raise NoNodeError(parent)
+                self.create(parent, makepath=True)
+            self._data[path] = value
+            self._versions[path] = 0
+            data_watches = self._data_watches.pop(path, set())
+            child_watches = self._child_watches.pop(parent, set())
+        self._fire(data_watches, 'CREATED', path)
+        self._fire(child_watches, 'CHILD', parent)
+        return path
+
+    def ensure_path(self, path):
+        if self.exists(path) is None:
+            self.create(path, makepath=True)
+        return True
+
+    def set(self, path, value):
+        self.calls['set'] += 1
+        with self._lock:
+            if path not in self._data:
+                raise NoNodeError(path)
+            self._data[path] = value
+            self._versions[path] += 1
+            watches = self._data_watches.pop(path, set())
+            stat = self._stat(path)
+        self._fire(watches, 'CHANGED', path)
+        return stat
+
+    def delete(self, path, version=-1, recursive=False):
+        self.calls['delete'] += 1
+        with self._lock:
+            if path not in self._data:
+                raise NoNodeError(path)
+            children = self._children(path)
+            if children and not recursive:
+                raise NotEmptyError(path)
+        for child in children:
+            self.delete(path.rstrip('/') + '/' + child, recursive=True)
+        with self._lock:
+            del self._data[path]
+            del self._versions[path]
+            watches = (self._data_watches.pop(path, set()) |
+                       self._child_watches.pop(path, set()))
+            parent_watches = self._child_watches.pop(self._parent(path),
+                                                     set())
+        self._fire(watches, 'DELETED', path)
+        self._fire(parent_watches, 'CHILD', self._parent(path))
+        return True
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import pytest
+
+from riak_mesos.agent import Agent, AgentClient
+from test_util import FakeContext
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, url, text):
+        self.status_code = status_code
+        self.url = url
+        self.text = text
+
+
+class FakeApiContext(FakeContext):
+    def __init__(self):
+        FakeContext.__init__(self)
+        self.session = None
+        self.requests = []
+        self.failure_url = None
+
+    def agent_key(self):
+        return 'riak:None'
+
+    def api_request(self, method, path, exit_on_failure=True, **kwargs):
+        self.requests.append((method, path))
+        if self.failure_url is not None:
+            return FakeResponse(0, self.failure_url + path, '')
+        return FakeResponse(200, 'http://framework/api/v1/' + path,
+                            '{"requests": %d}' % len(self.requests))
+
+
+@pytest.fixture
+def agent():
+    tmp_dir = tempfile.mkdtemp()
+    agent = Agent(FakeApiContext(), os.path.join(tmp_dir, 'agent.sock'))
+    thread = threading.Thread(target=agent.serve_forever)
+    thread.start()
+    while agent.server is None or not os.path.exists(agent.socket_file):
+        time.sleep(0.01)
+    yield agent
+    AgentClient(agent.socket_file, agent.key).stop()
+    thread.join()
+    shutil.rmtree(tmp_dir)
+
+
+def test_agent_caches_listings(agent):
+    client = AgentClient(agent.socket_file, 'riak:None')
+    first = client.api_request('get', 'clusters')
+    assert first.status_code == 200 and not first.cached
+    second = client.api_request('get', 'clusters')
+    assert second.cached and second.json() == first.json()
+    assert client.api_request('get', 'clusters/default/nodes/n1').text == \
+        '{"requests": 2}'
+    client.api_request('post', 'clusters/default/nodes', data='')
+    assert not client.api_request('get', 'clusters').cached
+    assert client.stats()['cache_hits'] == 1
+    assert len(agent.ctx.requests) == 4
+
+
+def test_agent_rejects_other_frameworks(agent):
+    with pytest.raises(IOError):
+        AgentClient(agent.socket_file, 'other:None').api_request(
+            'get', 'clusters')
+    assert agent.ctx.requests == []
+
+
+def test_agent_failures_are_only_retried_when_safe(agent):
+    client = AgentClient(agent.socket_file, 'riak:None')
+    # Timed out: a GET can be sent again, a POST may have been applied
+    agent.ctx.failure_url = 'http://framework/api/v1/'
+    assert client.api_request('get', 'clusters') is None
+    r = client.api_request('post', 'clusters/default/nodes', data='')
+    assert r.status_code == 0
+    # The framework was never found, so nothing was sent
+    agent.ctx.failure_url = 'framework_url_not_available/'
+    assert client.api_request('post', 'clusters/default/nodes',
+                              data='') is None
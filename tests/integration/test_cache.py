@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+
+from riak_mesos.cache import MEMO_FOREVER, ResponseMemo, UrlCache
+
+
+def test_url_cache(tmpdir):
+    cache_file = str(tmpdir.join('riak-mesos', 'url-cache.json'))
+    cache = UrlCache('riak:/etc/riak-mesos/config.json', 60, cache_file)
+    assert cache.get('framework') is None
+    cache.set('framework', 'http://host:1234/')
+    cache.set('marathon', 'http://marathon.mesos:8080/')
+    assert os.listdir(os.path.dirname(cache_file)) == ['url-cache.json']
+    other = UrlCache('riak:/etc/riak-mesos/config.json', 60, cache_file)
+    assert other.get('framework') == 'http://host:1234/'
+    assert UrlCache('riak2:None', 60, cache_file).get('framework') is None
+    assert other.invalidate(url='http://host:1234/healthcheck') == \
+        ['framework']
+    assert other.get('framework') is None
+    assert other.get('marathon') == 'http://marathon.mesos:8080/'
+
+
+def test_url_cache_ttl(tmpdir):
+    cache_file = str(tmpdir.join('url-cache.json'))
+    with open(cache_file, 'w') as data_file:
+        json.dump({'riak:None': {'master': {
+            'url': 'http://leader.mesos:5050/',
+            'time': time.time() - 120}}}, data_file)
+    assert UrlCache('riak:None', 60, cache_file).get('master') is None
+    assert UrlCache('riak:None', 300, cache_file).get('master') == \
+        'http://leader.mesos:5050/'
+    assert UrlCache('riak:None', 0, cache_file).get('master') is None
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+
+def test_response_memo():
+    memo = ResponseMemo()
+    calls = []
+
+    def request():
+        calls.append(1)
+        return FakeResponse(200, str(len(calls)))
+
+    path = 'clusters/default/nodes/riak-default-1'
+    assert memo.fetch(path, 0, request).text == '1'
+    assert memo.fetch(path, 0, request).text == '2'
+    assert memo.fetch(path, MEMO_FOREVER, request).text == '2'
+    memo.invalidate('clusters/default')
+    assert memo.fetch(path, MEMO_FOREVER, request).text == '3'
+    assert memo.fetch('riak/versions', 60,
+                      lambda: FakeResponse(404, '')).status_code == 404
+    assert memo.fetch('riak/versions', 60, request).text == '4'
+    assert memo.hits == 1
+
+
+def test_response_memo_coalesces_requests():
+    memo = ResponseMemo()
+    calls = []
+
+    def request():
+        calls.append(1)
+        time.sleep(0.2)
+        return FakeResponse(200, 'nodes')
+
+    results = []
+    threads = [threading.Thread(
+        target=lambda: results.append(memo.fetch('clusters', 0, request)))
+        for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert [r.text for r in results] == ['nodes'] * 5
+
+
+def test_service_url_threads(tmpdir):
+    from riak_mesos.cli import Context
+    discovered = []
+
+    class FakeClient(object):
+        def framework_url(self):
+            discovered.append(1)
+            time.sleep(0.05)
+            return 'http://framework/'
+
+    ctx = Context()
+    ctx.url_cache = UrlCache('riak:None', 0, str(tmpdir.join('cache.json')))
+    ctx._new_client = FakeClient
+    errors = []
+
+    def run(invalidate):
+        try:
+            for i in range(20):
+                ctx.service_url('framework')
+                if invalidate:
+                    ctx.invalidate_service_url('http://framework/api/v1/')
+        except Exception as e:
+            errors.append(e)
+
+    def run_all(invalidate):
+        threads = [threading.Thread(target=run, args=(invalidate,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    run_all(True)
+    assert errors == []
+    # Threads that find discovery running wait for its result
+    ctx.invalidate_service_url('http://framework/api/v1/')
+    del discovered[:]
+    run_all(False)
+    assert discovered == [1]
+
+
+def test_http_session_threads(monkeypatch):
+    import riak_mesos.session
+    from riak_mesos.cli import Context
+    created = []
+
+    class SlowSession(riak_mesos.session.RiakMesosSession):
+        def __init__(self, *args, **kwargs):
+            created.append(1)
+            time.sleep(0.05)
+            super(SlowSession, self).__init__(*args, **kwargs)
+
+    monkeypatch.setattr(riak_mesos.session, 'RiakMesosSession', SlowSession)
+    ctx = Context()
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(
+        ctx.http_session())) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert created == [1]
+    assert len(set(id(session) for session in sessions)) == 1
+    ctx.close()
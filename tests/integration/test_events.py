@@ -0,0 +1,157 @@
+import threading
+import time
+
+import requests
+
+from riak_mesos.events import read_events, wait_for_marathon_app
+from riak_mesos.fake_server import FakeServer
+from riak_mesos.util import monotonic, poll
+
+
+class FakeStream(object):
+    def __init__(self, lines, status_code=200):
+        self.lines = lines
+        self.status_code = status_code
+        self.closed = False
+
+    def iter_lines(self, chunk_size=None):
+        for line in self.lines:
+            yield line
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession(object):
+    def __init__(self, stream):
+        self.stream = stream
+
+    def request(self, method, url, **kwargs):
+        return self.stream
+
+
+class EventContext(object):
+    def __init__(self, marathon_url, session=None):
+        self.marathon_url = marathon_url
+        self.session = session or requests.Session()
+        self.insecure_ssl = False
+        self.timeout = 5
+        self.poll_min_interval = 0.01
+        self.poll_max_interval = 0.05
+        self.logs = []
+
+    def service_url(self, service):
+        return self.marathon_url
+
+    def http_session(self):
+        return self.session
+
+    def vlog(self, msg, *args):
+        self.logs.append(msg)
+
+
+def _event(event_type, *data):
+    return ([b'event: ' + event_type] +
+            [b'data: ' + d for d in data] + [b''])
+
+
+def test_read_events():
+    lines = (_event(b'status_update_event', b'{"appId": "/a",',
+                    b' "taskStatus": "TASK_RUNNING"}') +
+             _event(b'health_status_changed_event', b'{not json') +
+             [b': keep-alive', b''] +
+             _event(b'health_status_changed_event',
+                    b'{"appId": "/b", "alive": true}'))
+    ctx = EventContext('http://127.0.0.1:1/')
+    events = list(read_events(ctx, FakeStream(lines), monotonic() + 10))
+    assert events == [
+        ('status_update_event',
+         {'appId': '/a', 'taskStatus': 'TASK_RUNNING'}),
+        ('health_status_changed_event', {'appId': '/b', 'alive': True})]
+    assert ctx.logs == ['Ignoring malformed Marathon event']
+
+
+def test_read_events_deadline():
+    def lines():
+        while True:
+            time.sleep(0.01)
+            for line in _event(b'status_update_event', b'{}'):
+                yield line
+
+    stream = FakeStream(lines())
+    start = monotonic()
+    events = list(read_events(EventContext(''), stream, start + 0.2))
+    assert len(events) > 0
+    assert monotonic() - start < 0.5
+
+
+def test_wait_for_marathon_app():
+    fake = FakeServer(start_delay=0.2).start()
+    try:
+        ctx = EventContext('http://' + fake.address + '/')
+        checks = []
+
+        def check():
+            checks.append(monotonic())
+            return len(checks) == 3
+
+        def publish():
+            while len(fake.state.subscribers) == 0:
+                time.sleep(0.01)
+            # Only events for the app being waited on run check() again
+            fake.state.publish('status_update_event', {'appId': '/other'})
+            fake.state.publish('status_update_event', {'appId': '/app'})
+            fake.state.publish('health_status_changed_event',
+                               {'appId': '/other', 'alive': True})
+            fake.state.publish('health_status_changed_event',
+                               {'appId': '/app', 'alive': True})
+
+        thread = threading.Thread(target=publish)
+        thread.start()
+        assert wait_for_marathon_app(ctx, '/app', check, monotonic() + 5)
+        thread.join()
+        assert len(checks) == 3
+        assert fake.stats()['routes']['GET events'] == 1
+    finally:
+        fake.stop()
+
+
+def test_wait_for_marathon_app_stream_ends_early():
+    lines = _event(b'health_status_changed_event',
+                   b'{"appId": "/app", "alive": false}')
+    stream = FakeStream(lines)
+    ctx = EventContext('http://127.0.0.1:1/', FakeSession(stream))
+    checks = []
+
+    def check():
+        checks.append(1)
+        return len(checks) >= 5
+
+    until = monotonic() + 5
+    # Once at the start, once for the event and once when the stream ends
+    assert wait_for_marathon_app(ctx, '/app', check, until) is None
+    assert len(checks) == 3
+    assert stream.closed
+    # The caller falls back to polling for the time that is left
+    assert poll(ctx, lambda: (check(), None), until)
+    assert len(checks) == 5
+
+
+def test_wait_for_marathon_app_unavailable():
+    stream = FakeStream([], status_code=404)
+    ctx = EventContext('http://127.0.0.1:1/', FakeSession(stream))
+    checks = []
+    assert wait_for_marathon_app(ctx, '/app', lambda: checks.append(1),
+                                 monotonic() + 5) is None
+    assert checks == []
+    assert stream.closed
+    assert 'polling instead' in ctx.logs[-1]
+
+
+def test_wait_for_marathon_app_deadline():
+    lines = _event(b'status_update_event', b'{"appId": "/app"}')
+    ctx = EventContext('http://127.0.0.1:1/', FakeSession(FakeStream(lines)))
+    assert wait_for_marathon_app(ctx, '/app', lambda: False,
+                                 monotonic() - 1) is False
+    # Past the deadline the stream is dropped without reading more events
+    assert not any(log.startswith('Received') for log in ctx.logs)
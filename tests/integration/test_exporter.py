@@ -0,0 +1,35 @@
+from riak_mesos.exporter import MetricTable, render
+
+
+def test_metric_table():
+    table = MetricTable()
+    assert table.lookup('node_gets_total') == ('riak_node_gets_total',
+                                               'counter')
+    assert table.lookup('vnode.gets-99') == ('riak_vnode_gets_99', 'gauge')
+    assert table.lookup('memory_total') == ('riak_memory_total', 'gauge')
+    assert table.lookup('vnode.gets-99') is table.lookup('vnode.gets-99')
+
+
+def test_render():
+    samples = [
+        ([('node', 'n1')], {'node_gets_total': 10, 'mem_mb': 1.5,
+                            'ring_members': ['n1', 'n2'],
+                            'connected': True, 'nodename': 'n1'}),
+        ([('node', 'n"2')], {'node_gets_total': 20,
+                             'mem_mb': float('nan')}),
+        ([], {'mesos_exporter_scrapes_total': 1})
+    ]
+    text = render(MetricTable(), samples)
+    # One TYPE line per metric, followed by all of its series
+    blocks = sorted(block.splitlines()
+                    for block in text.strip().split('# TYPE ')[1:])
+    assert blocks == [
+        ['riak_mem_mb gauge',
+         'riak_mem_mb{node="n1"} 1.5',
+         'riak_mem_mb{node="n\\"2"} NaN'],
+        ['riak_mesos_exporter_scrapes_total counter',
+         'riak_mesos_exporter_scrapes_total 1'],
+        ['riak_node_gets_total counter',
+         'riak_node_gets_total{node="n1"} 10',
+         'riak_node_gets_total{node="n\\"2"} 20']
+    ]
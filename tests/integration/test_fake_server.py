@@ -0,0 +1,413 @@
+import json
+import os
+import re
+import subprocess
+import time
+
+import pytest
+from six.moves.urllib.request import urlopen
+
+from common import exec_command as _c
+from riak_mesos.fake_server import FakeServer
+
+
+@pytest.fixture
+def fake(tmpdir):
+    server = FakeServer(nodes=3, start_delay=0.5).start()
+    config_file = str(tmpdir.join('config.json'))
+    with open(config_file, 'w') as f:
+        json.dump(server.config(), f)
+    env = dict(os.environ, HOME=str(tmpdir))
+
+    def riak_mesos(*args, **kwargs):
+        return _c(['riak-mesos'] + list(args) +
+                  ['--config', config_file, '--no-agent'], env=env, **kwargs)
+
+    server.riak_mesos = riak_mesos
+    yield server
+    server.stop()
+
+
+def test_cluster_commands(fake):
+    c, o, e = fake.riak_mesos('cluster', 'list')
+    assert c == 0
+    assert json.loads(o.decode('utf-8'))['clusters'] == ['default']
+    c, o, e = fake.riak_mesos('cluster', 'add-node', 'default')
+    assert o.strip() == b'{"success":true}'
+    c, o, e = fake.riak_mesos('cluster', 'wait-for-service', 'default',
+                              '--timeout', '10')
+    assert c == 0
+    assert b'Node riak-default-4 is ready.' in o
+    assert b'Cluster default is ready.' in o
+    assert fake.stats()['routes']['POST add_node'] == 1
+
+
+def test_node_commands(fake):
+    c, o, e = fake.riak_mesos('node', 'info', 'riak-default-1')
+    js = json.loads(o.decode('utf-8'))
+    assert js['riak-default-1']['status'] == 'started'
+    c, o, e = fake.riak_mesos('node', 'log', 'tail', 'riak-default-1',
+                              '--lines', '5')
+    assert len(json.loads(o.decode('utf-8'))['files']['lines']) == 5
+    c, o, e = fake.riak_mesos('framework', 'teardown')
+    assert o.strip() == b'Finished teardown.'
+    assert fake.state.frameworks == []
+
+
+def test_error_injection(fake):
+    fake.error_rate = 1
+    fake.error_paths = None
+    c, o, e = fake.riak_mesos('node', 'status', 'riak-default-1', '-v')
+    assert c != 0
+    assert b'HTTP 503: Service Unavailable' in e
+
+
+def test_trace_and_profile(fake, tmpdir):
+    trace_file = str(tmpdir.join('trace.json'))
+    c, o, e = fake.riak_mesos('cluster', 'wait-for-service', 'default',
+                              '--trace', trace_file, '--profile')
+    assert c == 0
+    assert b'cumulative' in e
+    with open(trace_file) as f:
+        events = json.load(f)['traceEvents']
+    cats = set(event.get('cat') for event in events)
+    assert set(['command', 'discovery', 'http', 'connect']) <= cats
+    http = [event for event in events if event.get('cat') == 'http']
+    assert all(event['args']['status'] == 200 for event in http)
+    # Work done on worker threads shows up in the profile too
+    c, o, e = fake.riak_mesos('cluster', 'endpoints', 'default', '--profile')
+    assert c == 0
+    assert b'(node_info)' in e
+
+
+def test_retries(fake):
+    fake.error_rate = 1
+    fake.error_paths = re.compile('clusters$')
+    fake.retry_after = 1
+    c, o, e = fake.riak_mesos('cluster', 'list', '--retries', '2', '-v')
+    assert c != 0
+    assert fake.stats()['routes']['GET clusters'] == 3
+    assert e.count(b'Retrying GET http://' + fake.address.encode('utf-8') +
+                   b'/api/v1/clusters in 1.00s (HTTP 503)') == 2
+    assert b': 2 retries, circuit breaker closed' in e
+
+
+def test_circuit_breaker(fake):
+    fake.error_rate = 1
+    fake.error_paths = re.compile('clusters$')
+    c, o, e = fake.riak_mesos('cluster', 'list', '--breaker-threshold', '2',
+                              '--retry-backoff', '0.01', '-v')
+    assert c != 0
+    assert fake.stats()['routes']['GET clusters'] == 2
+    assert b'Circuit breaker for ' + fake.address.encode('utf-8') + \
+        b' is open' in e
+    assert b'circuit breaker open (opened 1 times, 1 requests rejected)' in e
+
+
+def test_starting_nodes_dont_trip_the_breaker(fake):
+    fake.state.start_delay = 2
+    for i in range(2):
+        fake.riak_mesos('cluster', 'add-node', 'default')
+    fake.riak_mesos('cluster', 'restart', 'default')
+    c, o, e = fake.riak_mesos('cluster', 'wait-for-service', 'default',
+                              '--timeout', '20', '--breaker-threshold', '2',
+                              '-v')
+    assert c == 0
+    assert len(re.findall(b'Node riak-default-. is ready', o)) == 5
+    # The framework passes on the starting nodes' 503s, it isn't failing
+    assert b'Retrying' not in e
+    assert b'0 retries, circuit breaker closed (opened 0 times' in e
+    assert b'Removed cached URLs' not in e
+
+
+def test_discovery_race(fake, tmpdir):
+    slow = FakeServer(latency=5).start()
+    config = fake.config()
+    # A slow candidate and one that refuses connections are listed first
+    config['riak']['framework-url'] = [slow.address, '127.0.0.1:1',
+                                       fake.address]
+    config['riak']['marathon'] = '127.0.0.1:1, ' + fake.address
+    config['riak']['master'] = [fake.address, slow.address]
+    config_file = str(tmpdir.join('race.json'))
+    with open(config_file, 'w') as f:
+        json.dump(config, f)
+    env = dict(os.environ, HOME=str(tmpdir))
+    for command in [['cluster', 'list'], ['config', 'marathon']]:
+        start = time.time()
+        c, o, e = _c(['riak-mesos'] + command +
+                     ['--config', config_file, '--no-agent',
+                      '--url-cache-ttl', '0'], env=env)
+        assert c == 0
+        assert time.time() - start < 5
+    assert json.loads(o.decode('utf-8'))['env']['RIAK_MESOS_MASTER'] == \
+        fake.address
+    assert fake.stats()['routes']['GET healthcheck'] == 1
+    assert fake.stats()['routes']['GET marathon_ping'] == 1
+    slow.stop()
+
+
+def test_deadline(fake):
+    fake.state.start_delay = 60
+    fake.riak_mesos('cluster', 'add-node', 'default')
+    start = time.time()
+    c, o, e = fake.riak_mesos('cluster', 'wait-for-service', 'default',
+                              '--deadline', '1')
+    assert c != 0
+    assert time.time() - start < 3
+    assert e.strip() == b'Error: Deadline of 1.0s exceeded while waiting'
+    fake.latency = 5
+    start = time.time()
+    c, o, e = fake.riak_mesos('cluster', 'list', '--deadline', '1',
+                              '--url-cache-ttl', '0')
+    assert c != 0
+    assert time.time() - start < 3
+    assert e.strip() == (b'Error: Deadline of 1.0s exceeded while GET http://'
+                         + fake.address.encode('utf-8') + b'/healthcheck')
+    # Fan-outs over every node fail instead of reporting per node errors
+    fake.latency = 0.4
+    c, o, e = fake.riak_mesos('cluster', 'endpoints', 'default',
+                              '--deadline', '1')
+    assert c != 0
+    assert e.startswith(b'Error: Deadline of 1.0s exceeded while GET ')
+    assert b'"error"' not in o
+
+
+def test_log_tail_follow(fake):
+    fake.state.log_rate = 20
+    c, o, e = fake.riak_mesos('node', 'log', 'tail', 'riak-default-1',
+                              '--lines', '5', '--follow', '--interval', '0.2',
+                              '--deadline', '2', '--grep', r'line \d*0$')
+    assert c == 0
+    numbers = [int(line.rsplit(' ', 1)[1])
+               for line in o.decode('utf-8').splitlines()]
+    assert len(numbers) > 3
+    assert numbers == list(range(numbers[0], numbers[-1] + 10, 10))
+
+
+def test_cluster_stats_watch(fake):
+    c, o, e = fake.riak_mesos('cluster', 'stats', 'default', '--watch',
+                              '--interval', '0.5', '--deadline', '1.2',
+                              '--format', 'ndjson')
+    assert c == 0
+    rows = [json.loads(line) for line in o.decode('utf-8').splitlines()]
+    assert len(rows) >= 6 and len(rows) % 3 == 0
+    assert rows[0]['gets/s'] is None and rows[0]['get_mean'] == 1500
+    assert 50 < rows[-1]['gets/s'] < 150
+    # A failed node listing doesn't end the watch
+    fake.error_rate = 0.5
+    fake.error_paths = re.compile('/nodes$')
+    c, o, e = fake.riak_mesos('cluster', 'stats', 'default', '--watch',
+                              '--interval', '0.2', '--deadline', '3',
+                              '--format', 'ndjson', '--retries', '0')
+    assert c == 0
+    assert b'Traceback' not in e
+    assert b'Failed to get nodes' in e
+    assert fake.stats()['routes']['GET nodes'] >= 10
+
+
+def test_exporter(fake, tmpdir):
+    config_file = str(tmpdir.join('config.json'))
+    process = subprocess.Popen(
+        ['riak-mesos', 'exporter', '--port', '0', '--interval', '60',
+         '--config', config_file, '--no-agent'],
+        stderr=subprocess.PIPE, env=dict(os.environ, HOME=str(tmpdir)))
+    try:
+        line = process.stderr.readline().decode('utf-8')
+        url = re.search(r'http://\S+', line).group(0)
+        url = url.replace('0.0.0.0', '127.0.0.1')
+        fake.reset_stats()
+        first = urlopen(url).read().decode('utf-8')
+        second = urlopen(url).read().decode('utf-8')
+        assert first == second
+        assert fake.stats()['routes']['GET node_stats'] == 3
+        assert ('riak_node_gets_total{cluster="default",'
+                'node="riak-default-1"}') in first
+        assert ('riak_mesos_node_up{cluster="default",'
+                'node="riak-default-3"} 1') in first
+        assert '\nriak_mesos_exporter_scrapes_total 1\n' in first
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_cluster_transfers_wait(fake):
+    fake.state.transfer_time = 3
+    c, o, e = fake.riak_mesos('cluster', 'add-node', 'default')
+    assert c == 0
+    c, o, e = fake.riak_mesos('cluster', 'transfers', 'default',
+                              '--wait-for-service', '--timeout', '20')
+    assert c == 0
+    lines = o.decode('utf-8').splitlines()
+    assert lines[-1] == 'Cluster default transfers complete.'
+    progress = [re.match(r'(\d+) waiting, (\d+) active transfers on 4 '
+                         r'nodes(, ETA (.*))?$', line) for line in lines[:-1]]
+    assert all(progress)
+    # Every node hands off partitions, the new one for longest
+    assert int(progress[0].group(1)) > 7
+    assert progress[-1].group(0).startswith('0 waiting, 0 active')
+    # Once the rate is known the estimate is a duration, not 'unknown'
+    assert progress[0].group(4) == 'unknown'
+    assert re.match(r'(<1|\d+)s$', progress[-2].group(4))
+    c, o, e = fake.riak_mesos('cluster', 'transfers', 'default')
+    js = json.loads(o.decode('utf-8'))
+    assert js['riak-default-4'] == {
+        'transfers': {'waiting_to_handoff': [], 'active': []}}
+
+
+def test_cluster_restart_wait(fake):
+    fake.state.start_delay = 1.5
+    fake.state.transfer_time = 3
+    c, o, e = fake.riak_mesos('cluster', 'restart', 'default',
+                              '--wait-for-service', '--timeout', '20')
+    assert c == 0
+    lines = o.decode('utf-8').splitlines()
+    assert lines[0] == '{"success":true}'
+    assert re.match(r'Cluster default restarted in \d+\.\d seconds\.$',
+                    lines[-1])
+    for node in ['riak-default-1', 'riak-default-2', 'riak-default-3']:
+        assert 'Node ' + node + ' is waiting for ping, status, ' \
+            'ringready.' in lines
+        assert 'Node ' + node + ' is waiting for transfers.' in lines
+        assert len([line for line in lines if re.match(
+            'Node ' + node + r' restarted in \d+\.\d seconds\.$',
+            line)]) == 1
+
+
+def test_add_nodes_wait(fake):
+    fake.reset_stats()
+    c, o, e = fake.riak_mesos('cluster', 'add-node', 'default', '--nodes',
+                              '5', '--wait', '--timeout', '20')
+    assert c == 0
+    lines = o.decode('utf-8').splitlines()
+    # Nodes are waited on as they are created, so the lines interleave
+    assert lines.count('{"success":true}') == 5
+    assert sorted(line for line in lines[:10] if line.startswith('Node')) == \
+        ['Node riak-default-' + str(i) + ' is ready.' for i in range(4, 9)]
+    assert re.match(r'Created 5 of 5 nodes \(0 failed\) in \d+\.\d '
+                    r'seconds\. 5 of 5 new nodes ready in \d+\.\d '
+                    r'seconds\.$', lines[10])
+    assert fake.stats()['routes']['POST add_node'] == 5
+
+
+def test_add_nodes_wait_with_errors(fake):
+    # This seed lets the listing before the first POST through. Each node
+    # is still waited for, and the summary printed, when later requests fail
+    fake._random.seed(1)
+    fake.error_rate = 0.5
+    fake.error_paths = re.compile('/nodes')
+    c, o, e = fake.riak_mesos('cluster', 'add-node', 'default', '--nodes',
+                              '6', '--wait', '--timeout', '20',
+                              '--retries', '0', '--breaker-threshold', '0')
+    assert b'Traceback' not in e
+    lines = o.decode('utf-8').splitlines()
+    assert '' not in lines
+    created = lines.count('{"success":true}')
+    assert 0 < created < 6
+    assert len([line for line in lines
+                if line.startswith('Failed to add node, status_code: ')]) == \
+        6 - created
+    assert re.match(r'Created ' + str(created) + r' of 6 nodes \(' +
+                    str(6 - created) + r' failed\) in \d+\.\d seconds\. '
+                    r'\d of ' + str(created) + r' new nodes ready in ',
+                    lines[-1])
+
+
+def test_cluster_restart_wait_staggered(fake):
+    # The scheduler restarts one node at a time, and ringready fails on
+    # every node while any of them is down
+    fake.state.start_delay = 1
+    fake.state.transfer_time = 1
+    fake.state.restart_interval = 2.5
+    start = time.time()
+    c, o, e = fake.riak_mesos('cluster', 'restart', 'default',
+                              '--wait-for-service', '--timeout', '20')
+    assert c == 0
+    assert time.time() - start > 6
+    lines = o.decode('utf-8').splitlines()
+    assert re.match(r'Cluster default restarted in \d+\.\d seconds\.$',
+                    lines[-1])
+    restarted = [line.split()[1] for line in lines
+                 if re.match(r'Node \S+ restarted in', line)]
+    assert restarted == ['riak-default-1', 'riak-default-2',
+                         'riak-default-3']
+    # A node is only waited on once it has gone down itself, after the
+    # one before it came back up
+    for previous, node in zip(restarted, restarted[1:]):
+        assert lines.index('Node ' + previous + ' is waiting for '
+                           'transfers.') < \
+            lines.index('Node ' + node + ' is waiting for ping, status, '
+                        'ringready.')
+
+
+def test_agent_does_not_resend_failed_posts(fake, tmpdir):
+    config_file = str(tmpdir.join('config.json'))
+    env = dict(os.environ, HOME=str(tmpdir))
+    agent = subprocess.Popen(
+        ['riak-mesos', 'agent', 'start', '--config', config_file,
+         '--request-timeout', '1', '--retries', '0'],
+        stderr=subprocess.PIPE, env=env)
+    try:
+        agent.stderr.readline()
+        riak_mesos = ['riak-mesos', '--config', config_file, '-v']
+        # Resolves the framework URL in the agent
+        c, o, e = _c(riak_mesos + ['cluster', 'list'], env=env)
+        assert b'Agent request' in e
+        fake.latency = 1.5
+        c, o, e = _c(riak_mesos + ['cluster', 'add-node', 'default'],
+                     env=env)
+        assert b'not retrying POST' in e
+        c, o, e = _c(riak_mesos + ['cluster', 'list'], env=env)
+        assert b'retrying directly' in e
+        time.sleep(1)
+        assert fake.stats()['routes']['POST add_node'] == 1
+    finally:
+        agent.kill()
+        agent.wait()
+
+
+BATCH = """# riak-mesos commands, one per line
+cluster list
+riak-mesos cluster bogus
+
+node status riak-default-1 --debug
+cluster list --no-keep-alive
+node info riak-default-1
+"""
+
+
+def test_batch(fake, tmpdir):
+    batch_file = tmpdir.join('commands.txt')
+    batch_file.write(BATCH)
+    c, o, e = fake.riak_mesos('batch', str(batch_file))
+    assert c != 0
+    assert b'Ran 5 commands in ' in e
+    assert b', 2 failed' in e
+    assert b'2 of 5 commands failed' in e
+    assert b'--no-keep-alive must be given to shell or batch' in e
+    # --debug only applies to the command it was given to
+    lines = e.decode('utf-8').splitlines()
+    status = lines.index([line for line in lines
+                          if line.endswith('] node status riak-default-1 '
+                                           '--debug')][0])
+    assert any(line.startswith('HTTP URL: ') for line in lines[:status])
+    assert not any(line.startswith('HTTP URL: ')
+                   for line in lines[status:])
+    assert fake.stats()['routes']['GET node'] == 1
+    c, o, e = fake.riak_mesos('batch', '--stop-on-error', str(batch_file))
+    assert c != 0
+    assert b'Ran 2 commands in ' in e
+    assert b'1 of 2 commands failed' in e
+    assert fake.stats()['routes']['GET node'] == 1
+
+
+def test_shell(fake, tmpdir):
+    batch_file = tmpdir.join('commands.txt')
+    batch_file.write('cluster list\nnode info riak-default-1 -v\nexit\n'
+                     'cluster bogus\n')
+    with open(str(batch_file)) as stdin:
+        c, o, e = fake.riak_mesos('shell', stdin=stdin)
+    assert c == 0
+    assert b'"clusters":["default"]' in o
+    assert b'"riak-default-1"' in o
+    assert b'] node info riak-default-1 -v' in e
+    assert b'bogus' not in e
@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from riak_mesos.logs import LineFilter, LogTail, parse_since
+
+
+class FakeLog(object):
+    def __init__(self):
+        self.lines = []
+        self.requests = []
+
+    def fetch(self, rows):
+        self.requests.append(rows)
+        return len(self.lines), self.lines[-rows:]
+
+
+def test_log_tail_requests_only_new_rows():
+    log = FakeLog()
+    log.lines = ['line %d' % i for i in range(100)]
+    tail = LogTail(log.fetch, 20)
+    assert tail.poll() == log.lines[-20:]
+    assert tail.poll() == []
+    log.lines.extend(['line 100', 'line 101'])
+    assert tail.poll() == ['line 100', 'line 101']
+    assert log.requests == [20, 10, 10]
+    # Falling behind asks again for everything that was missed
+    log.lines.extend('line %d' % i for i in range(102, 150))
+    assert tail.poll() == log.lines[102:]
+    assert log.requests[-2:] == [10, 58]
+    assert tail.skipped == 0
+    # A rotated file starts again from its first line
+    log.lines = ['new 0', 'new 1']
+    assert tail.poll() == ['new 0', 'new 1']
+
+
+def test_line_filter():
+    line_filter = LineFilter('2016-10-18 12:00:00', 'error')
+    lines = ['2016-10-18 11:59:59.000 [error] old',
+             '    old report',
+             '2016-10-18 12:00:00.000 [error] new',
+             '    new error report',
+             '    new report',
+             '2016-10-18 12:00:01.000 [info] new']
+    assert [line for line in lines if line_filter.match(line)] == \
+        ['2016-10-18 12:00:00.000 [error] new', '    new error report']
+
+
+def test_parse_since():
+    assert parse_since('2016-10-18T12:00:00') == '2016-10-18 12:00:00'
+    assert parse_since('10m') == time.strftime(
+        '%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - 600))
+    with pytest.raises(ValueError):
+        parse_since('yesterday')
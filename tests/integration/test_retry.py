@@ -0,0 +1,49 @@
+import time
+from email.utils import formatdate
+
+from riak_mesos.retry import CircuitBreaker, RetryPolicy, retry_after
+
+
+class FakeResponse(object):
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def test_retry_policy():
+    policy = RetryPolicy(retries=2, backoff=1, max_backoff=3)
+    assert policy.should_retry('get', 0)
+    assert policy.should_retry('PUT', 1)
+    assert not policy.should_retry('get', 2)
+    assert not policy.should_retry('post', 0)
+    assert 0.5 <= policy.delay(0) <= 1
+    assert 1.5 <= policy.delay(5) <= 3
+    assert policy.delay(0, retry_after=10) == 10
+    assert policy.delay(0, retry_after=600) == 30
+
+
+def test_retry_after():
+    assert retry_after(FakeResponse({})) is None
+    assert retry_after(FakeResponse({'Retry-After': '2'})) == 2
+    assert retry_after(FakeResponse({'Retry-After': 'soon'})) is None
+    date = formatdate(time.time() + 60, usegmt=True)
+    assert 55 < retry_after(FakeResponse({'Retry-After': date})) <= 60
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0.1)
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.allow() and breaker.state == 'closed'
+    breaker.record(False)
+    assert breaker.state == 'open' and not breaker.allow()
+    time.sleep(0.1)
+    # One trial request is let through, and its failure reopens the breaker
+    assert breaker.allow() and not breaker.allow()
+    breaker.record(False)
+    assert breaker.state == 'open' and breaker.opened == 2
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'closed' and breaker.allow()
+    assert breaker.rejected == 2
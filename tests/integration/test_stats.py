@@ -0,0 +1,37 @@
+from riak_mesos.stats import StatsHistory, format_table
+
+FIELDS = [('gets/s', 'node_gets_total', 'counter'),
+          ('get_mean', 'node_get_fsm_time_mean', 'gauge')]
+
+
+def test_stats_history_rates():
+    history = StatsHistory(3, FIELDS)
+    history.add('n1', 10, {'node_gets_total': 100,
+                           'node_get_fsm_time_mean': 5})
+    assert history.latest('n1') == {'gets/s': None, 'get_mean': 5}
+    history.add('n1', 12, {'node_gets_total': 300})
+    assert history.latest('n1') == {'gets/s': 100, 'get_mean': None}
+    history.add('n1', 14, {'node_gets_total': 340})
+    history.add('n1', 16, {'node_gets_total': 380})
+    # Only the last 3 samples are kept, in the same fixed size array
+    assert history.sample_count('n1') == 3
+    assert len(history._samples['n1']) == 3 * 3
+    assert history.latest('n1')['gets/s'] == 20
+    assert history.latest('n1', None)['gets/s'] == 20
+    assert history.window('n1') == 4
+    # A restarted node's counters start again
+    history.add('n1', 18, {'node_gets_total': 10})
+    assert history.latest('n1')['gets/s'] is None
+
+
+def test_format_table():
+    history = StatsHistory(10, FIELDS)
+    for node in ['n1', 'n2']:
+        history.add(node, 0, {'node_gets_total': 0})
+        history.add(node, 1, {'node_gets_total': 50})
+    lines = format_table(history, ['n1', 'n2', 'n3'],
+                         {'n3': 'connection refused'})
+    assert lines[0].split() == ['node', 'gets/s', 'get_mean']
+    assert lines[1].split() == ['n1', '50.0', '-']
+    assert lines[3].split() == ['n3', 'error:', 'connection', 'refused']
+    assert lines[4].split() == ['total', '100.0', '-']
@@ -0,0 +1,32 @@
+from riak_mesos.transfers import DrainEstimate, format_duration
+
+
+def test_drain_estimate():
+    estimate = DrainEstimate(window=10)
+    assert estimate.eta() is None
+    estimate.add(0, 100)
+    assert estimate.eta() is None
+    estimate.add(5, 90)
+    assert estimate.rate() == 2
+    assert estimate.eta() == 45
+    # Only the last window seconds count, so a faster rate takes over
+    estimate.add(10, 70)
+    estimate.add(20, 20)
+    assert estimate.rate() == 5
+    assert estimate.eta() == 4
+    # More transfers were queued, start over
+    estimate.add(21, 40)
+    assert estimate.eta() is None
+    estimate.add(22, 40)
+    assert estimate.eta() is None
+    estimate.add(23, 0)
+    assert estimate.eta() == 0
+
+
+def test_format_duration():
+    assert format_duration(None) == 'unknown'
+    assert format_duration(0) == '0s'
+    assert format_duration(0.2) == '<1s'
+    assert format_duration(59.6) == '1m00s'
+    assert format_duration(754) == '12m34s'
+    assert format_duration(7260) == '2h01m'
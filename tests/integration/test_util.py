@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from riak_mesos.util import (DeadlineExceeded, clamp_timeout, map_concurrently,
+                             monotonic, poll, race)
+
+
+class FakeContext(object):
+    def __init__(self):
+        self.timeout = 1
+        self.concurrency = 4
+        self.poll_min_interval = 0.01
+        self.poll_max_interval = 0.05
+
+    def vlog(self, msg, *args):
+        pass
+
+
+def test_poll_ready_immediately():
+    calls = []
+
+    def check():
+        calls.append(1)
+        return True, None
+
+    start = monotonic()
+    assert poll(FakeContext(), check, start + 10)
+    assert len(calls) == 1
+    assert monotonic() - start < 0.01
+
+
+def test_poll_until_done():
+    states = [(False, 3), (False, 2), (False, 2), (True, 0)]
+    assert poll(FakeContext(), lambda: states.pop(0), monotonic() + 10)
+    assert states == []
+
+
+def test_poll_deadline():
+    start = monotonic()
+    assert not poll(FakeContext(), lambda: (False, None), start + 0.2)
+    assert 0.2 <= monotonic() - start < 0.4
+
+
+def test_map_concurrently():
+    def double(ctx, item):
+        if item == 3:
+            raise ValueError('bad item')
+        return item * 2
+
+    results = map_concurrently(FakeContext(), double, [1, 2, 3, 4, 5])
+    assert [(i, r) for i, r, e in results] == \
+        [(1, 2), (2, 4), (3, None), (4, 8), (5, 10)]
+    assert str(results[2][2]) == 'bad item'
+
+
+def test_map_concurrently_deadline():
+    def fetch(ctx, item):
+        if item == 2:
+            raise DeadlineExceeded(1.0, 'GET ' + str(item))
+        return item
+
+    with pytest.raises(DeadlineExceeded):
+        map_concurrently(FakeContext(), fetch, [1, 2, 3])
+
+
+def test_race():
+    def probe(ctx, delay):
+        if delay == 0:
+            raise IOError('connection refused')
+        time.sleep(delay)
+        return None if delay == 0.05 else 'after ' + str(delay)
+
+    start = monotonic()
+    assert race(FakeContext(), probe, [2, 0, 0.05, 0.1]) == \
+        (0.1, 'after 0.1')
+    assert monotonic() - start < 1
+    assert race(FakeContext(), probe, [0, 0.05]) == (None, None)
+
+
+def test_clamp_timeout():
+    assert clamp_timeout(30, None) == 30
+    assert clamp_timeout(None, None) is None
+    assert clamp_timeout(30, 5) == 5
+    assert clamp_timeout(None, 5) == 5
+    assert clamp_timeout((10, 30), 20) == (10, 20)
+    assert clamp_timeout(30, -1) == 0.001
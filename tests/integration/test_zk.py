@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from fake_zk import FakeZooKeeper
+from riak_mesos.util import monotonic, watch
+from test_util import FakeContext
+
+NODE_PATH = '/riak/frameworks/riak/nodes/riak-default-1'
+
+
+class FakeZkContext(FakeContext):
+    def __init__(self, zk):
+        FakeContext.__init__(self)
+        self.framework = 'riak'
+        self.zk = zk
+
+    def zk_client(self):
+        return self.zk
+
+    def call_timeout(self, timeout=None, doing=None):
+        return 0.1
+
+
+def test_watch_wakes_on_metadata_change():
+    zk = FakeZooKeeper()
+    zk.create(NODE_PATH, b'starting', makepath=True)
+    checks = []
+
+    def check():
+        checks.append(1)
+        data, stat = zk.get(NODE_PATH)
+        return data == b'started', data
+
+    threading.Timer(0.2, zk.set, [NODE_PATH, b'started']).start()
+    start = monotonic()
+    assert watch(FakeZkContext(zk), check, start + 5)
+    assert 0.2 <= monotonic() - start < 1
+    assert len(checks) == 2
+
+
+def test_watch_sees_new_nodes():
+    zk = FakeZooKeeper()
+    zk.ensure_path('/riak/frameworks/riak/nodes')
+    path = '/riak/frameworks/riak/nodes/riak-default-2'
+    threading.Timer(0.1, zk.create, [path, b'']).start()
+    assert watch(FakeZkContext(zk),
+                 lambda: (zk.exists(path) is not None, None),
+                 monotonic() + 5)
+
+
+def test_watch_deadline():
+    zk = FakeZooKeeper()
+    start = monotonic()
+    assert not watch(FakeZkContext(zk), lambda: (False, None), start + 0.2)
+    assert monotonic() - start < 1
+
+
+def test_zk_command_batch():
+    from riak_mesos.cli import Context
+    ctx = Context()
+    ctx.client = object()
+    ctx.zk = FakeZooKeeper()
+    ctx.zk.create(NODE_PATH, b'{"status":"started"}', makepath=True)
+    paths = [NODE_PATH, '/riak/frameworks/riak/nodes/missing']
+    assert ctx.zk_command('exists', paths) == \
+        {NODE_PATH: True, paths[1]: False}
+    assert list(ctx.zk_command('get', paths).values()) == \
+        ['{"status":"started"}', False]
+    assert ctx.zk_command('children', ['/riak/frameworks/riak/nodes']) == \
+        {'/riak/frameworks/riak/nodes': ['riak-default-1']}
+    assert ctx.zk_command('get', NODE_PATH) == '{"status":"started"}'
+    ctx.close()
+    assert ctx.zk is None
+
+
+def test_metadata_purge():
+    from riak_mesos import metadata
+    zk = FakeZooKeeper()
+    root = '/riak/frameworks/riak'
+    for cluster in range(5):
+        for node in range(30):
+            zk.create(root + '/clusters/c%d/nodes/n%d' % (cluster, node),
+                      b'x' * 10, makepath=True)
+    zk.create('/riak/frameworks/other', makepath=True)
+    znodes = metadata.walk(zk, root)
+    assert len(znodes) == 1 + 1 + 5 + 5 + 150
+    assert sum(size for path, depth, size in znodes) == 1500
+    assert metadata.purge(zk, znodes) == []
+    assert zk.calls['multi'] == 2
+    assert zk.exists(root) is None
+    assert zk.exists('/riak/frameworks/other') is not None
+    assert metadata.walk(zk, root) == []
+
+
+class HungAsyncResult(object):
+    """A reply from a zookeeper that never answers"""
+
+    def get(self, block=True, timeout=None):
+        if timeout is None:
+            raise AssertionError('Waiting without a timeout')
+        time.sleep(timeout)
+        raise RuntimeError('Timed out')
+
+
+class HungZooKeeper(FakeZooKeeper):
+    def exists_async(self, path, watch=None):
+        return HungAsyncResult()
+
+    def get_children_async(self, path, watch=None, include_data=False):
+        return HungAsyncResult()
+
+    def transaction(self):
+        transaction = FakeZooKeeper.transaction(self)
+        transaction.commit_async = HungAsyncResult
+        return transaction
+
+
+def test_hung_zookeeper_times_out():
+    from riak_mesos import metadata
+    ctx = FakeZkContext(HungZooKeeper())
+    start = monotonic()
+    assert not watch(ctx, lambda: (False, None), start + 0.3)
+    assert monotonic() - start < 1
+    with pytest.raises(RuntimeError):
+        metadata.walk(ctx.zk, '/riak', ctx.call_timeout)
+    znodes = [('/riak/a', 1, 0), ('/riak', 0, 0)]
+    assert metadata.purge(ctx.zk, znodes, call_timeout=ctx.call_timeout) \
+        == ['/riak/a', '/riak']